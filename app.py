@@ -1,39 +1,95 @@
 import datetime
 import logging
 import os
-from typing import List
+import secrets
+from threading import Thread
+from typing import TYPE_CHECKING, List, Union
 
-import folium
+import numpy as np
 import streamlit as st
-from folium.plugins import Draw
-from mapa import convert_bbox_to_stl
-from mapa.caching import get_hash_of_geojson
-from mapa.utils import TMPDIR
-from streamlit_folium import st_folium
 
-from mapa_streamlit.cleaning import run_cleanup_job
+from mapa_streamlit.batch import load_regions
+from mapa_streamlit.caching import ResultCache, get_cache_dir, get_cache_key
+from mapa_streamlit.cleaning import CacheInventory, Janitor
+from mapa_streamlit.drawings import DrawingIndex
+from mapa_streamlit.jobs import JobManager, JobState, QueueFullError, load_converter
+from mapa_streamlit.limits import AdaptiveLimits, Limits, get_approximate_max_area, get_system_load
+from mapa_streamlit.metrics import (
+    COMPUTE_STAGE_SECONDS,
+    DOWNLOAD_BYTES,
+    MetricsFileWriter,
+    Timer,
+    start_http_server,
+)
+from mapa_streamlit.prefetch import prefetch
+from mapa_streamlit.preview import create_preview, load_heightmap
 from mapa_streamlit.settings import (
-    ABOUT,
     BTN_LABEL_CREATE_STL,
     BTN_LABEL_DOWNLOAD_STL,
-    DEFAULT_TILING_FORMAT,
-    DISK_CLEANING_THRESHOLD,
+    BTN_LABEL_PREVIEW,
+    CACHE_LOW_WATER_MARK,
+    CACHE_MIN_AGE,
+    CACHE_SIZE_BUDGET,
+    DOWNLOAD_CACHE_MAX_ENTRIES,
+    JANITOR_CHECK_INTERVAL,
+    JANITOR_INTERVAL,
+    JOB_CONVERTER,
+    JOB_MAX_QUEUE_DEPTH,
+    JOB_MAX_WORKERS,
+    JOB_MEMORY_HEADROOM,
+    JOB_MEMORY_LIMIT_BASE,
+    JOB_MEMORY_LIMIT_FACTOR,
+    JOB_POLL_INTERVAL,
+    JOB_TTL,
+    LIMIT_HIGH_PRESSURE,
+    LIMIT_HYSTERESIS,
+    LIMIT_LOW_PRESSURE,
+    LIMIT_SCALE_CEILING,
+    LIMIT_SCALE_FLOOR,
+    LIMIT_TARGET_DURATION,
+    LIMIT_UPDATE_INTERVAL,
     MAP_CENTER,
     MAP_ZOOM,
-    MAX_ALLOWED_AREA_SIZE,
+    MAX_DEM_TILES,
+    MAX_OUTPUT_SIZE,
+    MAX_RASTER_PIXELS,
+    METRICS_ADDRESS,
+    METRICS_FILE,
+    METRICS_FILE_INTERVAL,
+    METRICS_PORT,
+    PREFETCH_FILE,
+    PREVIEW_SIZE,
+    PROFILE_JOBS,
+    PROFILE_TOKEN,
+    TILE_MAX_WORKERS,
     ModelSizeSlider,
     SquaredCheckbox,
     TilingSelect,
     ZOffsetSlider,
     ZScaleSlider,
+    get_about,
+)
+from mapa_streamlit.verification import (
+    CostEstimate,
+    estimate_cost,
+    selected_bbox_in_boundary,
+    selected_bbox_too_expensive,
 )
-from mapa_streamlit.verification import selected_bbox_in_boundary, selected_bbox_too_large
+
+if TYPE_CHECKING:
+    import folium
 
 log = logging.getLogger(__name__)
 log.setLevel(os.getenv("MAPA_STREAMLIT_LOG_LEVEL", "DEBUG"))
 
 
-def _show_map(center: List[float], zoom: int) -> folium.Map:
+@st.cache_resource
+def _show_map(center: List[float], zoom: int) -> "folium.Map":
+    # the map is the same for all sessions, build it only once per server. folium is imported lazily to keep the
+    # import of this module cheap.
+    import folium
+    from folium.plugins import Draw
+
     m = folium.Map(
         location=center,
         zoom_start=zoom,
@@ -57,107 +113,256 @@ def _show_map(center: List[float], zoom: int) -> folium.Map:
     return m
 
 
-def _compute_stl(geometry: dict, progress_bar: st.progress) -> None:
-    geo_hash = get_hash_of_geojson(geometry)
-    mapa_cache_dir = TMPDIR()
-    run_cleanup_job(path=mapa_cache_dir, disk_cleaning_threshold=DISK_CLEANING_THRESHOLD)
-    path = mapa_cache_dir / geo_hash
-    progress_bar.progress(0)
-    convert_bbox_to_stl(
-        bbox_geometry=geometry,
-        model_size=ModelSizeSlider.value if model_size is None else model_size,
-        z_scale=ZScaleSlider.value if z_scale is None else z_scale,
-        z_offset=ZOffsetSlider.value if z_offset is None else z_offset,
-        ensure_squared=ensure_squared,
-        output_file=path,
-        progress_bar=progress_bar,
-        split_area_in_tiles=DEFAULT_TILING_FORMAT if tiling_option is None else tiling_option,
+@st.cache_resource
+def _get_job_manager() -> JobManager:
+    # a single job manager is shared across all sessions of this server and thereby limits the number of concurrent
+    # conversions and their memory consumption server-wide
+    return JobManager(
+        max_workers=JOB_MAX_WORKERS,
+        converter=load_converter(JOB_CONVERTER),
+        max_queue_depth=JOB_MAX_QUEUE_DEPTH,
+        memory_headroom=JOB_MEMORY_HEADROOM,
+        memory_limit_base=JOB_MEMORY_LIMIT_BASE,
+        memory_limit_factor=JOB_MEMORY_LIMIT_FACTOR,
+        job_ttl=JOB_TTL,
+    )
+
+
+@st.cache_resource
+def _get_adaptive_limits() -> AdaptiveLimits:
+    # shared across sessions, as the load of the server is the same for all users
+    job_manager = _get_job_manager()
+    return AdaptiveLimits(
+        base=Limits(max_dem_tiles=MAX_DEM_TILES, max_raster_pixels=MAX_RASTER_PIXELS, max_output_size=MAX_OUTPUT_SIZE),
+        max_workers=JOB_MAX_WORKERS,
+        target_duration=LIMIT_TARGET_DURATION,
+        floor=LIMIT_SCALE_FLOOR,
+        ceiling=LIMIT_SCALE_CEILING,
+        low_pressure=LIMIT_LOW_PRESSURE,
+        high_pressure=LIMIT_HIGH_PRESSURE,
+        hysteresis=LIMIT_HYSTERESIS,
+        update_interval=LIMIT_UPDATE_INTERVAL,
+        get_load=lambda: get_system_load(job_manager.running, job_manager.queue_depth, job_manager.mean_duration),
+    )
+
+
+@st.cache_resource
+def _get_result_cache() -> ResultCache:
+    return ResultCache(get_cache_dir())
+
+
+@st.cache_resource
+def _get_cache_inventory() -> CacheInventory:
+    return CacheInventory(get_cache_dir())
+
+
+@st.cache_resource
+def _get_janitor() -> Janitor:
+    # a single janitor thread per server takes care of cleaning the cache in the background
+    janitor = Janitor(
+        inventory=_get_cache_inventory(),
+        cache_size_budget=CACHE_SIZE_BUDGET,
+        low_water_mark=CACHE_LOW_WATER_MARK,
+        min_age=CACHE_MIN_AGE,
+        interval=JANITOR_INTERVAL,
+        check_interval=JANITOR_CHECK_INTERVAL,
+    )
+    janitor.start()
+    return janitor
+
+
+@st.cache_resource
+def _start_metrics_exporters() -> None:
+    # metrics are collected per server process, expose them once
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, METRICS_ADDRESS)
+    if METRICS_FILE:
+        MetricsFileWriter(METRICS_FILE, METRICS_FILE_INTERVAL).start()
+
+
+@st.cache_resource
+def _prefetch() -> Union[None, Thread]:
+    # runs only once per server, downloads are I/O bound and hence run in a daemon thread
+    if not PREFETCH_FILE:
+        return None
+    thread = Thread(
+        target=prefetch, args=(load_regions(PREFETCH_FILE, {}), get_cache_dir()), name="mapa-prefetch", daemon=True
     )
-    # it is important to spawn this success message in the sidebar, because state will get lost otherwise
-    st.sidebar.success("Successfully computed STL file!")
+    thread.start()
+    return thread
 
 
-def _check_area_and_compute_stl(folium_output: dict, geo_hash: str, progress_bar: st.progress) -> None:
-    all_drawings_dict = {
-        get_hash_of_geojson(draw["geometry"]): draw["geometry"] for draw in folium_output["all_drawings"]
+def _get_params() -> dict:
+    # read customization values via their widget keys, so they are available before the widgets are rendered
+    state = st.session_state
+    return {
+        widget.key: state.get(widget.key, widget.value)
+        for widget in (ZOffsetSlider, ZScaleSlider, ModelSizeSlider, SquaredCheckbox, TilingSelect)
     }
-    geometry = all_drawings_dict[geo_hash]
-    if selected_bbox_too_large(geometry, threshold=MAX_ALLOWED_AREA_SIZE):
-        st.sidebar.warning(
+
+
+def _is_profiling() -> bool:
+    if PROFILE_JOBS:
+        return True
+    token = st.query_params.get("profile")
+    return PROFILE_TOKEN is not None and token is not None and secrets.compare_digest(token, PROFILE_TOKEN)
+
+
+def _compute_stl(geometry: dict, geo_hash: str, cost: CostEstimate) -> None:
+    params = _get_params()
+    cache_key = get_cache_key(geo_hash, params)
+    result_cache = _get_result_cache()
+    if result_cache.lookup(cache_key, record_hit=True) is not None:
+        st.session_state.job_id = None
+        st.session_state.notice = ("success", "Successfully computed STL file!")
+        return
+
+    mapa_cache_dir = get_cache_dir()
+    janitor = _get_janitor()
+    if janitor.stats is not None:
+        log.debug(f"🧹  last cleanup: {janitor.stats}")
+    # identical requests of other sessions attach to the same job instead of computing the result again
+    try:
+        st.session_state.job_id = _get_job_manager().submit(
+            key=cache_key,
+            memory=cost.memory,
+            profile=_is_profiling(),
+            bbox_geometry=geometry,
+            output_file=result_cache.path_for(cache_key),
+            cache_dir=mapa_cache_dir,
+            **params,
+        )
+    except QueueFullError:
+        st.session_state.job_id = None
+        st.session_state.notice = (
+            "error",
+            "Too many STL files are being computed at the moment. Please try again in a few minutes.",
+        )
+        return
+    # a new conversion is about to write to the cache, let the janitor check whether it exceeds its budget
+    janitor.notify()
+
+
+def _format_limit() -> str:
+    adaptive_limits = _get_adaptive_limits()
+    max_area = get_approximate_max_area(adaptive_limits.limits.max_raster_pixels)
+    load = "" if adaptive_limits.scale >= 1 else " due to the current server load"
+    return f"Regions are currently limited to about {max_area:,.0f} km²{load}."
+
+
+def _check_area_and_compute_stl(geo_hash: str) -> None:
+    st.session_state.notice = None
+    geometry = st.session_state.drawing_index.get_geometry(geo_hash)
+    with Timer(COMPUTE_STAGE_SECONDS, stage="validation"):
+        cost = estimate_cost(geometry, parallel_tiles=TILE_MAX_WORKERS, **_get_params())
+        adaptive_limits = _get_adaptive_limits()
+        adaptive_limits.update()
+        too_expensive = selected_bbox_too_expensive(cost, *adaptive_limits.limits)
+        in_boundary = selected_bbox_in_boundary(geometry)
+    if too_expensive:
+        st.session_state.notice = (
+            "warning",
             "Selected region is too large, fetching data for this area would consume too many resources. "
-            "Please select a smaller region."
+            f"Please select a smaller region. {_format_limit()}",
         )
-    elif not selected_bbox_in_boundary(geometry):
-        st.sidebar.warning(
-            "Selected rectangle is not within the allowed region of the world map. Do not scroll too far to the left or "
-            "right. Ensure to use the initial center view of the world for drawing your rectangle."
+    elif not in_boundary:
+        st.session_state.notice = (
+            "warning",
+            "Selected rectangle is not within the allowed region of the world map. Do not scroll too far to the left "
+            "or right. Ensure to use the initial center view of the world for drawing your rectangle.",
         )
     else:
-        _compute_stl(geometry, progress_bar)
+        _compute_stl(geometry, geo_hash, cost)
 
 
-def _download_btn(data: str, disabled: bool) -> None:
-    st.sidebar.download_button(
+@st.cache_resource(max_entries=DOWNLOAD_CACHE_MAX_ENTRIES, show_spinner=False)
+def _read_artifact(path: str, mtime_ns: int) -> bytes:
+    # shared across reruns and sessions, so each archive is read from disk and held in memory only once. The
+    # modification time is part of the cache key to pick up archives which got replaced.
+    with open(path, "rb") as fp:
+        return fp.read()
+
+
+def _download_btn(data: bytes, disabled: bool) -> None:
+    st.download_button(
         label=BTN_LABEL_DOWNLOAD_STL,
         data=data,
         file_name=f'{datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_mapa-streamlit.zip',
         disabled=disabled,
+        on_click=DOWNLOAD_BYTES.inc,
+        args=(len(data),),
     )
 
 
-def _get_active_drawing_hash(state, drawings: List[str]) -> str:
-    # update state initially
-    if "drawings" not in state:
-        state.drawings = []
-    if "active_drawing" not in state:
-        state.active_drawing = None
-
-    old_drawings = state.drawings
-    for d in drawings:
-        if d not in old_drawings:
-            active_drawing = d
-            state.drawings = drawings
-            state.active_drawing = active_drawing
-            log.debug(f"🎨  found new active_drawing: {active_drawing}")
-            return active_drawing
+def _show_job_status(geo_hash: str, polling: bool) -> None:
+    job_manager = _get_job_manager()
+    job = job_manager.get(st.session_state.get("job_id"))
+    if job is not None:
+        if polling != job.active:
+            # job got submitted or finished since the sidebar was rendered, rerun the whole app to start/stop polling
+            st.rerun()
+        elif job.state == JobState.QUEUED:
+            position = job_manager.position(job.job_id)
+            expected_wait = job_manager.expected_wait(job.job_id)
+            text = f"Waiting for a free worker to compute the STL file, position in queue: {position}"
+            if expected_wait is not None:
+                text += f", expected wait: ~{max(1, round(expected_wait / 60))} min"
+            st.info(f"{text} ...")
+        elif job.state == JobState.RUNNING:
+            # progress is reported by the conversion process via shared memory and picked up whenever the sidebar polls
+            st.progress(
+                int(job_manager.progress(job.job_id) or 0), text="Computing STL file, this might take a while ..."
+            )
+        elif job.state == JobState.DONE:
+            st.success("Successfully computed STL file!")
+        elif job.state == JobState.FAILED:
+            st.error(f"Computing STL file failed: {job.error}")
+
+    output_file = _get_result_cache().lookup(get_cache_key(geo_hash, _get_params())) if geo_hash else None
+    try:
+        data = _read_artifact(str(output_file), output_file.stat().st_mtime_ns) if output_file else None
+    except FileNotFoundError:
+        # archive got evicted in the meantime
+        data = None
+    if data is not None:
+        _download_btn(data, False)
     else:
-        log.debug(f"💾  no new drawing found, returning last active drawing from state: {state.active_drawing}")
-        return state.active_drawing
+        _download_btn(b"None", True)
 
 
-if __name__ == "__main__":
-    st.set_page_config(
-        page_title="mapa",
-        page_icon="🌍",
-        layout="wide",
-        initial_sidebar_state="expanded",
-        menu_items={"About": ABOUT},
-    )
+@st.cache_data(max_entries=32, show_spinner=False)
+def _load_heightmap(geo_hash: str, geometry: dict) -> np.ndarray:
+    # downsampled heightmaps are small, keep them around so that iterating on the customizations is instant
+    return load_heightmap(geometry, geo_hash, get_cache_dir(), PREVIEW_SIZE)
 
-    st.markdown(
-        """
-        # mapa &nbsp; 🌍 &nbsp; Map to STL Converter
-        Follow the instructions in the sidebar on the left to create and download a 3D-printable STL file.
-        """,
-        unsafe_allow_html=True,
+
+def _show_preview(geo_hash: str) -> None:
+    geometry = st.session_state.drawing_index.get_geometry(geo_hash)
+    if not selected_bbox_in_boundary(geometry):
+        return
+    try:
+        with st.spinner("Loading preview ..."):
+            heightmap = _load_heightmap(geo_hash, geometry)
+    except Exception as e:
+        log.warning(f"⚠️  could not load preview of {geo_hash}: {e}")
+        st.warning("Preview is not available for the selected region.")
+        return
+    # rendered on every rerun with the current customizations, so that changes are reflected immediately
+    preview = create_preview(heightmap, geometry, **_get_params())
+    st.image(
+        preview.image,
+        caption=f"Preview of the model: {preview.size_x} x {preview.size_y} x {preview.size_z} mm",
     )
-    st.write("\n")
-    m = _show_map(center=MAP_CENTER, zoom=MAP_ZOOM)
-    output = st_folium(m, key="init", width=1000, height=600)
 
-    geo_hash = None
-    if output:
-        if output["all_drawings"] is not None:
-            # get latest modified drawing
-            all_drawings = [get_hash_of_geojson(draw["geometry"]) for draw in output["all_drawings"]]
-            geo_hash = _get_active_drawing_hash(state=st.session_state, drawings=all_drawings)
 
-    # ensure progress bar resides at top of sidebar and is invisible initially
-    progress_bar = st.sidebar.progress(0)
-    progress_bar.empty()
+def _show_sidebar(geo_hash: str, polling: bool) -> None:
+    notice = st.session_state.get("notice")
+    if notice:
+        level, text = notice
+        getattr(st, level)(text)
 
     # Getting Started container
-    with st.sidebar.container():
+    with st.container():
         st.markdown(
             f"""
             # Getting Started
@@ -169,13 +374,22 @@ if __name__ == "__main__":
             """,
             unsafe_allow_html=True,
         )
-        st.button(
+        create_col, preview_col = st.columns(2)
+        create_col.button(
             BTN_LABEL_CREATE_STL,
             key="create_stl",
             on_click=_check_area_and_compute_stl,
-            kwargs={"folium_output": output, "geo_hash": geo_hash, "progress_bar": progress_bar},
+            kwargs={"geo_hash": geo_hash},
             disabled=False if geo_hash else True,
         )
+        # previews are cheap, so customizations can be tried before running the full conversion
+        if preview_col.button(BTN_LABEL_PREVIEW, key="preview", disabled=False if geo_hash else True):
+            st.session_state.preview = geo_hash
+        if geo_hash and st.session_state.get("preview") == geo_hash:
+            _show_preview(geo_hash)
+        # the sidebar is polled, so the limit follows the load of the server
+        _get_adaptive_limits().update()
+        st.caption(_format_limit())
         st.markdown(
             f"""
             5. Wait for the computation to finish
@@ -184,52 +398,96 @@ if __name__ == "__main__":
             unsafe_allow_html=True,
         )
 
-        output_file = TMPDIR() / f"{geo_hash}.zip"
-        if output_file.is_file():
-            with open(output_file, "rb") as fp:
-                _download_btn(fp, False)
-        else:
-            _download_btn(b"None", True)
+        _show_job_status(geo_hash, polling)
 
-        st.sidebar.markdown("---")
+        st.markdown("---")
 
     # Customization container
-    with st.sidebar.container():
+    with st.container():
         st.write(
             """
             # Customization
             Use below options to customize the output:
             """
         )
-        z_offset = st.slider(
+        st.slider(
             label=ZOffsetSlider.label,
             min_value=ZOffsetSlider.min_value,
             max_value=ZOffsetSlider.max_value,
             value=ZOffsetSlider.value,
             help=ZOffsetSlider.help,
+            key=ZOffsetSlider.key,
         )
-        z_scale = st.slider(
+        st.slider(
             label=ZScaleSlider.label,
             min_value=ZScaleSlider.min_value,
             max_value=ZScaleSlider.max_value,
             value=ZScaleSlider.value,
             step=ZScaleSlider.step,
             help=ZScaleSlider.help,
+            key=ZScaleSlider.key,
         )
-        model_size = st.slider(
+        st.slider(
             label=ModelSizeSlider.label,
             min_value=ModelSizeSlider.min_value,
             max_value=ModelSizeSlider.max_value,
             value=ModelSizeSlider.value,
             step=ModelSizeSlider.step,
             help=ModelSizeSlider.help,
+            key=ModelSizeSlider.key,
         )
-        ensure_squared = st.checkbox(
+        st.checkbox(
             label=SquaredCheckbox.label,
+            value=SquaredCheckbox.value,
             help=SquaredCheckbox.help,
+            key=SquaredCheckbox.key,
         )
-        tiling_option = st.selectbox(
+        st.selectbox(
             label=TilingSelect.label,
             options=TilingSelect.options,
             help=TilingSelect.help,
+            key=TilingSelect.key,
         )
+
+
+if __name__ == "__main__":
+    st.set_page_config(
+        page_title="mapa",
+        page_icon="🌍",
+        layout="wide",
+        initial_sidebar_state="expanded",
+        menu_items={"About": get_about()},
+    )
+
+    st.markdown(
+        """
+        # mapa &nbsp; 🌍 &nbsp; Map to STL Converter
+        Follow the instructions in the sidebar on the left to create and download a 3D-printable STL file.
+        """,
+        unsafe_allow_html=True,
+    )
+    st.write("\n")
+    # ensure the background janitor is running, DEM tiles are prefetched after a deploy and metrics are exposed
+    _get_janitor()
+    _prefetch()
+    _start_metrics_exporters()
+    m = _show_map(center=MAP_CENTER, zoom=MAP_ZOOM)
+    from streamlit_folium import st_folium
+
+    # only changed drawings trigger a rerun, panning and zooming the map does not
+    output = st_folium(m, key="init", width=1000, height=600, returned_objects=["all_drawings"])
+
+    if "drawing_index" not in st.session_state:
+        st.session_state.drawing_index = DrawingIndex()
+    geo_hash = None
+    if output:
+        if output["all_drawings"] is not None:
+            # get latest modified drawing
+            geo_hash = st.session_state.drawing_index.update(output["all_drawings"])
+
+    # the sidebar is rendered as fragment: interacting with the customization widgets or polling the status of a
+    # running job only reruns the sidebar, while the map is neither rebuilt nor sent to the browser again
+    job = _get_job_manager().get(st.session_state.get("job_id"))
+    polling = job is not None and job.active
+    with st.sidebar:
+        st.fragment(_show_sidebar, run_every=JOB_POLL_INTERVAL if polling else None)(geo_hash, polling)
@@ -1,13 +1,26 @@
+from functools import lru_cache
 from pathlib import Path
 
-import tomli
+PYPROJECT_TOML = Path(__file__).parent.parent / "pyproject.toml"
 
 
-def _get_version_from_project_toml():
-    with open(Path(__file__).parent.parent / "pyproject.toml", "rb") as f:
-        toml_dict = tomli.load(f)
+@lru_cache(maxsize=None)
+def _get_version() -> str:
+    # prefer the pyproject.toml of a source checkout, fall back to the metadata of the installed package
+    if PYPROJECT_TOML.is_file():
+        import tomli
 
-    return toml_dict["tool"]["poetry"]["version"]
+        with open(PYPROJECT_TOML, "rb") as f:
+            toml_dict = tomli.load(f)
+        return toml_dict["tool"]["poetry"]["version"]
 
+    from importlib.metadata import version
 
-__version__ = _get_version_from_project_toml()
+    return version("mapa-streamlit")
+
+
+def __getattr__(name: str):
+    # resolve the version lazily, so importing the package does not require reading and parsing any files
+    if name == "__version__":
+        return _get_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
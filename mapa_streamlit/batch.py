@@ -0,0 +1,225 @@
+import argparse
+import json
+import logging
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Union
+
+from mapa_streamlit.caching import ResultCache, get_cache_dir, get_cache_key, get_hash_of_geojson
+from mapa_streamlit.jobs import JobManager, JobState, convert_bbox_to_stl
+from mapa_streamlit.settings import (
+    DEFAULT_MODEL_SIZE,
+    DEFAULT_TILING_FORMAT,
+    DEFAULT_Z_OFFSET,
+    DEFAULT_Z_SCALE,
+    JOB_MAX_WORKERS,
+    JOB_MEMORY_HEADROOM,
+    JOB_MEMORY_LIMIT_BASE,
+    JOB_MEMORY_LIMIT_FACTOR,
+    MAX_DEM_TILES,
+    MAX_OUTPUT_SIZE,
+    MAX_RASTER_PIXELS,
+    TILE_MAX_WORKERS,
+)
+from mapa_streamlit.verification import estimate_cost, selected_bbox_in_boundary, selected_bbox_too_expensive
+
+log = logging.getLogger(__name__)
+
+PARAM_NAMES = ("z_offset", "z_scale", "model_size", "ensure_squared", "split_area_in_tiles")
+
+
+class Region(NamedTuple):
+    name: str
+    geometry: dict
+    params: dict
+
+
+class RegionResult(NamedTuple):
+    name: str
+    state: str
+    duration: Union[None, float] = None
+    output_file: Union[None, Path] = None
+    error: Union[None, str] = None
+    peak_memory: Union[None, int] = None
+
+
+class RegionState:
+    CACHED = "cached"
+    REJECTED = "rejected"
+    DONE = JobState.DONE
+    FAILED = JobState.FAILED
+
+
+def _get_name(feature: dict, index: int) -> str:
+    name = (feature.get("properties") or {}).get("name") or f"region_{index + 1}"
+    # names are used as file names of the copied archives
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("_") or f"region_{index + 1}"
+
+
+def load_regions(path: Path, params: dict) -> List[Region]:
+    """Reads the regions from a GeoJSON FeatureCollection. Conversion parameters given in the properties of a feature
+    take precedence over the given default parameters."""
+    collection = json.loads(Path(path).read_text())
+    if collection.get("type") != "FeatureCollection":
+        raise ValueError(f"{path} does not contain a GeoJSON FeatureCollection")
+    regions = []
+    for i, feature in enumerate(collection["features"]):
+        properties = feature.get("properties") or {}
+        overrides = {name: properties[name] for name in PARAM_NAMES if name in properties}
+        regions.append(Region(name=_get_name(feature, i), geometry=feature["geometry"], params={**params, **overrides}))
+    return regions
+
+
+def verify_region(region: Region) -> Union[None, str]:
+    # same checks as in the web app
+    cost = estimate_cost(region.geometry, parallel_tiles=TILE_MAX_WORKERS, **region.params)
+    exceeded = selected_bbox_too_expensive(cost, MAX_DEM_TILES, MAX_RASTER_PIXELS, MAX_OUTPUT_SIZE)
+    if exceeded is not None:
+        return f"region is too large, {exceeded} exceeds its limit"
+    if not selected_bbox_in_boundary(region.geometry):
+        return "region is not within the allowed coordinate boundaries"
+    return None
+
+
+def run_batch(
+    regions: List[Region],
+    cache_dir: Path,
+    max_workers: int,
+    output_dir: Union[None, Path] = None,
+    converter: Callable = convert_bbox_to_stl,
+    poll_interval: float = 0.5,
+) -> List[RegionResult]:
+    """Converts all regions in parallel, reusing and filling the same result cache as the web app.
+
+    Parameters
+    ----------
+    regions : List[Region]
+        Regions to be converted.
+    cache_dir : Path
+        Cache directory shared with the web app, which holds intermediate files of mapa and generated archives.
+    max_workers : int
+        Number of conversions running in parallel.
+    output_dir : Union[None, Path], optional
+        Directory into which the archives are copied as `<region name>.zip`. By default the archives are only
+        stored in the cache.
+    converter : Callable, optional
+        Function performing the conversion, see `JobManager`. By default `convert_bbox_to_stl` of mapa is used.
+    poll_interval : float, optional
+        Interval in seconds in which the state of the jobs is checked. By default 0.5
+
+    Returns
+    -------
+    List[RegionResult]
+        Result of each region in the order of the given regions.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    result_cache = ResultCache(cache_dir)
+    manager = JobManager(
+        max_workers=max_workers,
+        converter=converter,
+        memory_headroom=JOB_MEMORY_HEADROOM,
+        memory_limit_base=JOB_MEMORY_LIMIT_BASE,
+        memory_limit_factor=JOB_MEMORY_LIMIT_FACTOR,
+        # results are collected once all regions are converted, which might take longer than the ttl of the app
+        job_ttl=float("inf"),
+    )
+    results: List[Union[None, RegionResult]] = [None] * len(regions)
+    job_ids = {}
+    try:
+        for i, region in enumerate(regions):
+            error = verify_region(region)
+            if error is not None:
+                log.warning(f"⛔️  skipping {region.name}: {error}")
+                results[i] = RegionResult(name=region.name, state=RegionState.REJECTED, error=error)
+                continue
+            cache_key = get_cache_key(get_hash_of_geojson(region.geometry), region.params)
+            cached = result_cache.lookup(cache_key, record_hit=True)
+            if cached is not None:
+                results[i] = RegionResult(name=region.name, state=RegionState.CACHED, duration=0.0, output_file=cached)
+                continue
+            job_ids[i] = manager.submit(
+                key=cache_key,
+                memory=estimate_cost(region.geometry, parallel_tiles=TILE_MAX_WORKERS, **region.params).memory,
+                bbox_geometry=region.geometry,
+                output_file=result_cache.path_for(cache_key),
+                cache_dir=cache_dir,
+                **region.params,
+            )
+
+        while any(manager.get(job_id).active for job_id in job_ids.values()):
+            time.sleep(poll_interval)
+    finally:
+        manager.shutdown()
+
+    for i, job_id in job_ids.items():
+        job = manager.get(job_id)
+        results[i] = RegionResult(
+            name=regions[i].name,
+            state=job.state,
+            duration=job.duration,
+            output_file=job.result,
+            error=job.error,
+            peak_memory=job.peak_memory,
+        )
+
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for i, result in enumerate(results):
+            if result.output_file is not None:
+                results[i] = result._replace(
+                    output_file=Path(shutil.copyfile(result.output_file, output_dir / f"{result.name}.zip"))
+                )
+    return results
+
+
+def format_summary(results: List[RegionResult], wall_time: float) -> str:
+    lines = [f"{'region':<30} {'state':<10} {'duration':>10} {'memory':>10}  output / error"]
+    for result in results:
+        duration = f"{result.duration:.2f}s" if result.duration is not None else "-"
+        memory = f"{result.peak_memory / 1024**2:.0f}MB" if result.peak_memory is not None else "-"
+        lines.append(
+            f"{result.name:<30} {result.state:<10} {duration:>10} {memory:>10}  {result.error or result.output_file}"
+        )
+    succeeded = [r for r in results if r.state in (RegionState.DONE, RegionState.CACHED)]
+    size_mb = sum(r.output_file.stat().st_size for r in succeeded) / 1024**2
+    lines.append(
+        f"{len(succeeded)}/{len(results)} regions succeeded in {wall_time:.2f}s, "
+        f"throughput: {len(succeeded) / wall_time * 60 if wall_time else 0.0:.2f} regions/min, {size_mb:.2f} MB"
+    )
+    return "\n".join(lines)
+
+
+def _parse_args(argv: Union[None, List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m mapa_streamlit",
+        description="Convert all regions of a GeoJSON FeatureCollection into 3D-printable STL files.",
+    )
+    parser.add_argument("input", type=Path, help="GeoJSON file containing a FeatureCollection of regions.")
+    parser.add_argument("-o", "--output-dir", type=Path, help="Directory into which the archives are copied.")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Cache directory, by default the one of mapa.")
+    parser.add_argument("-j", "--max-workers", type=int, default=JOB_MAX_WORKERS, help="Parallel conversions.")
+    parser.add_argument("--z-offset", type=int, default=DEFAULT_Z_OFFSET)
+    parser.add_argument("--z-scale", type=float, default=DEFAULT_Z_SCALE)
+    parser.add_argument("--model-size", type=int, default=DEFAULT_MODEL_SIZE)
+    parser.add_argument("--ensure-squared", action="store_true")
+    parser.add_argument("--split-area-in-tiles", default=DEFAULT_TILING_FORMAT)
+    return parser.parse_args(argv)
+
+
+def main(argv: Union[None, List[str]] = None) -> int:
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    params = {name: getattr(args, name) for name in PARAM_NAMES}
+    regions = load_regions(args.input, params)
+
+    start = time.time()
+    results = run_batch(
+        regions,
+        cache_dir=args.cache_dir or get_cache_dir(),
+        max_workers=args.max_workers,
+        output_dir=args.output_dir,
+    )
+    print(format_summary(results, time.time() - start))
+    return 0 if all(r.state in (RegionState.DONE, RegionState.CACHED) for r in results) else 1
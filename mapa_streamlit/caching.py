@@ -0,0 +1,170 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from hashlib import md5
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Iterator, Union
+
+from mapa_streamlit.metrics import CACHE_REQUESTS
+from mapa_streamlit.settings import CACHE_DIR
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = "manifest.json"
+LOCK_DIR_NAME = "locks"
+# number of hex digits of the hashed lock name, i.e. each namespace uses at most 16**3 empty lock files
+LOCK_STRIPE_DIGITS = 3
+
+
+def get_cache_dir() -> Path:
+    """Cache directory configured via `MAPA_STREAMLIT_CACHE_DIR`, e.g. on a filesystem shared by several replicas of
+    the app, or the same directory as `mapa.utils.TMPDIR`, which is the default cache directory of mapa."""
+    cache_dir = Path(CACHE_DIR) if CACHE_DIR else Path(tempfile.gettempdir()) / "mapa"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+@contextmanager
+def file_lock(cache_dir: Path, namespace: str, name: str = "", blocking: bool = True) -> Iterator[bool]:
+    """Advisory lock, which is shared by all processes using the same cache directory, also across hosts as long as
+    the shared filesystem supports `flock`.
+
+    Names are hashed into a fixed number of lock files per namespace, so that the number of lock files is bounded.
+    Locks are not reentrant, so locks of the same namespace must not be nested.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        Cache directory, lock files are kept in its `locks` subdirectory.
+    namespace : str
+        Kind of the locked resource, e.g. "results" or "rasters".
+    name : str, optional
+        Name of the locked resource within its namespace, e.g. the cache key of an archive.
+    blocking : bool, optional
+        Whether to wait for the lock. Otherwise the context yields False in case the lock is held by someone else.
+        By default True
+
+    Yields
+    ------
+    bool
+        Whether the lock was acquired.
+    """
+    lock_dir = Path(cache_dir) / LOCK_DIR_NAME
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    stripe = md5(name.encode()).hexdigest()[:LOCK_STRIPE_DIGITS]
+    with open(lock_dir / f"{namespace}_{stripe}.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_hash_of_geojson(geojson: dict) -> str:
+    """Same hash as `mapa.caching.get_hash_of_geojson`, which mapa uses for naming intermediate files, but without
+    having to import mapa and all its heavy dependencies."""
+    return md5(json.dumps(geojson, sort_keys=True).encode()).hexdigest()
+
+
+def get_cache_key(geo_hash: str, params: dict) -> str:
+    """Returns a key which uniquely identifies the output of a conversion.
+
+    Parameters
+    ----------
+    geo_hash : str
+        Hash of the GeoJSON geometry of the selected bounding box.
+    params : dict
+        All parameters influencing the generated output, i.e. z-offset, z-scale, model size, squared and tiling.
+
+    Returns
+    -------
+    str
+        md5 hex digest of the geometry hash combined with all parameters.
+    """
+
+    normalized = {k: round(v, 4) if isinstance(v, float) else v for k, v in params.items()}
+    return md5(json.dumps({"geo_hash": geo_hash, **normalized}, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Content addressed cache of generated zip archives.
+
+    Archives are stored as `<cache key>.zip` in the given directory. A manifest next to them records size, creation
+    time, last access and the number of hits of each archive. Archives which are found on disk but are missing in the
+    manifest (e.g. written by a worker process) are adopted on first lookup. The directory can be shared by several
+    processes, the manifest is re-read and updated under a file lock, so that no process loses the updates of others.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.manifest_file = self.path / MANIFEST_FILE_NAME
+        self._lock = Lock()
+        self._manifest = self._load_manifest()
+
+    def path_for(self, key: str) -> Path:
+        """Output path to be passed to mapa, which appends the `.zip` suffix itself."""
+        return self.path / key
+
+    def lookup(self, key: str, record_hit: bool = False) -> Union[None, Path]:
+        archive = self.path / f"{key}.zip"
+        if not archive.is_file():
+            if record_hit:
+                CACHE_REQUESTS.inc(result="miss")
+            if key in self._manifest:
+                self._update_manifest(lambda manifest: manifest.pop(key, None))
+            return None
+        if key in self._manifest and not record_hit:
+            return archive
+
+        def _update(manifest: dict) -> None:
+            entry = manifest.get(key)
+            if entry is None:
+                stat = archive.stat()
+                entry = {"size": stat.st_size, "created": stat.st_mtime, "last_access": stat.st_mtime, "hits": 0}
+                manifest[key] = entry
+            if record_hit:
+                entry["hits"] += 1
+                entry["last_access"] = time.time()
+                # explicitly bump the access time, which is used for LRU eviction and is not reliably updated by reads
+                os.utime(archive, (entry["last_access"], archive.stat().st_mtime))
+                log.info(f"🚀  serving cached result {key}, hits: {entry['hits']}")
+
+        try:
+            self._update_manifest(_update)
+        except FileNotFoundError:
+            # evicted in the meantime by another process
+            return self.lookup(key, record_hit)
+        if record_hit:
+            CACHE_REQUESTS.inc(result="hit")
+        return archive
+
+    def entry(self, key: str) -> Union[None, dict]:
+        return self._manifest.get(key)
+
+    def _load_manifest(self) -> dict:
+        if not self.manifest_file.is_file():
+            return {}
+        try:
+            return json.loads(self.manifest_file.read_text())
+        except json.JSONDecodeError:
+            log.warning(f"⚠️  could not parse manifest {self.manifest_file}, starting with an empty one")
+            return {}
+
+    def _update_manifest(self, update: Callable[[dict], None]) -> None:
+        # read-modify-write of the manifest on disk, which might have been changed by other processes in the meantime
+        with self._lock, file_lock(self.path, "manifest"):
+            manifest = self._load_manifest()
+            update(manifest)
+            tmp_file = self.manifest_file.with_suffix(f".{os.getpid()}.tmp")
+            tmp_file.write_text(json.dumps(manifest))
+            os.replace(tmp_file, self.manifest_file)
+            self._manifest = manifest
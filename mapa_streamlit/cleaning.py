@@ -1,10 +1,17 @@
 import logging
+import os
 import shutil
+import time
+from collections import Counter
 from pathlib import Path
-from typing import Union
+from threading import Event, RLock, Thread
+from typing import Dict, NamedTuple, Set, Union
 
 import psutil
 
+from mapa_streamlit.caching import file_lock
+from mapa_streamlit.metrics import CACHE_SIZE_BYTES, CLEANUP_FREED_BYTES, CLEANUP_SECONDS, COMPUTE_STAGE_SECONDS
+
 log = logging.getLogger(__name__)
 
 
@@ -47,37 +54,341 @@ def _get_data_size_of_dir(path: Path) -> float:
     return round(sum(f.stat().st_size for f in path.glob("**/*") if f.is_file()) / 1024**2, 4)
 
 
-def _delete_files_in_dir(path: Path, file_suffix: str, name_prefix: Union[None, str] = None) -> None:
+def _delete_files_in_dir(
+    path: Path, file_suffix: str, name_prefix: Union[None, str] = None, inventory: Union[None, "CacheInventory"] = None
+) -> None:
     for file in path.iterdir():
         if file.suffix == file_suffix:
             if name_prefix:  # if name prefix is specified, only delete file if name matches
                 if file.name.startswith(name_prefix):
                     file.unlink()
                     log.info(f"🗑  deleted file: {file}")
+                    if inventory:
+                        inventory.remove(file)
             else:
                 file.unlink()
                 log.info(f"🗑  deleted file: {file}")
+                if inventory:
+                    inventory.remove(file)
 
 
 def _get_number_of_files_in_dir(path: Path, file_suffix: str) -> int:
     return len([f for f in path.glob("**/*") if f.suffix == file_suffix])
 
 
-def run_cleanup_job(path: Path, disk_cleaning_threshold: float) -> None:
+class CleanupStats(NamedTuple):
+    disk_usage: float
+    ram_usage: float
+    cache_size: int
+    freed: int
+    duration: float
+    timestamp: float
+
+
+class FileEntry(NamedTuple):
+    size: int
+    mtime: float
+    atime: float
+
+
+class CacheInventory:
+    """Keeps track of the files, their total size and number of files per suffix inside a cache directory.
+
+    The directory tree is walked once with `os.scandir` when the inventory is created. Afterwards the inventory is
+    maintained incrementally: files can be registered via `add` and `remove`, while `sync` only rescans directories
+    whose modification time changed, i.e. in which files were created, renamed or deleted by other processes. Files
+    which are rewritten in place do not change the modification time of their directory, these are only picked up by a
+    full `refresh`. Querying the size and number of files is O(1).
+
+    Parameters
+    ----------
+    path : Path
+        Root of the cache directory.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._lock = RLock()
+        self._files: Dict[str, FileEntry] = {}
+        self._children: Dict[str, Set[str]] = {}
+        self._dirs: Dict[str, int] = {}
+        self._size = 0
+        self._counts: Counter = Counter()
+        self.refresh()
+
+    @property
+    def size(self) -> int:
+        """Total size of all files in bytes."""
+        return self._size
+
+    @property
+    def size_mb(self) -> float:
+        return round(self._size / 1024**2, 4)
+
+    def count(self, file_suffix: str) -> int:
+        return self._counts[file_suffix]
+
+    def files(self) -> Dict[Path, FileEntry]:
+        with self._lock:
+            return {Path(f): entry for f, entry in self._files.items()}
+
+    def refresh(self) -> None:
+        """Rebuilds the inventory from scratch with a single pass over the directory tree."""
+        with self._lock:
+            self._files.clear()
+            self._children.clear()
+            self._dirs.clear()
+            self._size = 0
+            self._counts.clear()
+            self._scan_dir(str(self.path))
+
+    def sync(self) -> None:
+        """Picks up changes made by others by rescanning directories with a changed modification time only."""
+        with self._lock:
+            for directory, mtime in list(self._dirs.items()):
+                try:
+                    changed = os.stat(directory).st_mtime_ns != mtime
+                except FileNotFoundError:
+                    self._forget_dir(directory)
+                    continue
+                if changed:
+                    self._scan_dir(directory)
+
+    def add(self, file: Path) -> None:
+        with self._lock:
+            self._record(str(file), os.stat(file))
+
+    def remove(self, file: Path) -> None:
+        with self._lock:
+            self._forget(str(file))
+
+    def _scan_dir(self, directory: str) -> None:
+        try:
+            # take the modification time before scanning, so changes made during the scan are picked up next time
+            self._dirs[directory] = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            self._forget_dir(directory)
+            return
+        known = self._children.get(directory, set())
+        seen = set()
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in self._dirs:
+                    self._scan_dir(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                seen.add(entry.path)
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    seen.discard(entry.path)
+                    continue
+                # files might have been replaced under the same name, so known files are compared against their stat
+                known_entry = self._files.get(entry.path)
+                if known_entry is None or (known_entry.size, known_entry.mtime) != (stat.st_size, stat.st_mtime):
+                    self._record(entry.path, stat)
+        for file in known - seen:
+            self._forget(file)
+
+    def _forget_dir(self, directory: str) -> None:
+        self._dirs.pop(directory, None)
+        for file in self._children.pop(directory, set()):
+            self._forget(file)
+
+    def _record(self, file: str, stat: os.stat_result) -> None:
+        self._forget(file)
+        self._files[file] = FileEntry(size=stat.st_size, mtime=stat.st_mtime, atime=stat.st_atime)
+        self._children.setdefault(os.path.dirname(file), set()).add(file)
+        self._size += stat.st_size
+        self._counts[os.path.splitext(file)[1]] += 1
+
+    def _forget(self, file: str) -> None:
+        entry = self._files.pop(file, None)
+        if entry is not None:
+            self._children.get(os.path.dirname(file), set()).discard(file)
+            self._size -= entry.size
+            self._counts[os.path.splitext(file)[1]] -= 1
+
+
+def _get_eviction_tier(file: Path) -> Union[None, int]:
+    """Returns the tier in which the given file gets evicted, files in lower tiers are evicted first.
+
+    Tiers are ordered by the cost of recreating the files: generated STL and zip files as well as profiles of their
+    conversion only require meshing, intermediate (merged and clipped) tiffs and elevation arrays need to be derived
+    from the raw tiles, while raw DEM tiles need to be downloaded again. Files which do not belong to any tier (e.g.
+    the result cache manifest) are never evicted. Neither are partial archives and temporary files, which are still
+    being written by running conversions and only get their final name once completed.
+    """
+
+    if file.name.startswith("partial_") or ".tmp" in file.suffixes:
+        return None
+    elif file.suffix in (".stl", ".zip") or file.name.startswith("profile_"):
+        return 0
+    elif file.suffix == ".tiff" and file.name.startswith(("merged_", "clipped_")):
+        return 1
+    elif file.suffix in (".npy", ".json") and file.name.startswith("elevation_"):
+        return 1
+    elif file.suffix == ".tiff":
+        return 2
+    return None
+
+
+def evict_lru(inventory: CacheInventory, cache_size_budget: int, low_water_mark: float, min_age: float) -> int:
+    """Evicts the least recently used files tier by tier, until the cache size drops below the low-water mark.
+
+    Parameters
+    ----------
+    inventory : CacheInventory
+        Inventory of the cache directory to be cleaned.
+    cache_size_budget : int
+        Maximum size of the cache in bytes. Nothing is evicted, as long as the cache does not exceed this budget.
+    low_water_mark : float
+        Fraction of the budget, the cache gets shrunk to once the budget is exceeded.
+    min_age : float
+        Files modified within this number of seconds are considered in use and are not evicted.
+
+    Returns
+    -------
+    int
+        Number of bytes freed.
+    """
+
+    if inventory.size <= cache_size_budget:
+        return 0
+    target = cache_size_budget * low_water_mark
+    now = time.time()
+    candidates = []
+    for file in inventory.files():
+        tier = _get_eviction_tier(file)
+        if tier is None:
+            continue
+        # access times might have been bumped since the file was added to the inventory, so stat it again
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            inventory.remove(file)
+            continue
+        if now - stat.st_mtime >= min_age:
+            candidates.append((tier, max(stat.st_atime, stat.st_mtime), file, stat.st_size))
+
+    freed = 0
+    for _, _, file, size in sorted(candidates):
+        if inventory.size <= target:
+            break
+        file.unlink(missing_ok=True)
+        inventory.remove(file)
+        freed += size
+        log.info(f"🗑  deleted file: {file}")
+    return freed
+
+
+def run_cleanup_job(
+    path: Path,
+    cache_size_budget: int,
+    low_water_mark: float,
+    min_age: float = 0.0,
+    inventory: Union[None, CacheInventory] = None,
+) -> CleanupStats:
+    start = time.time()
+    if inventory is None:
+        inventory = CacheInventory(path)
+    else:
+        inventory.sync()
     disk_usage = _get_disk_usage(path)
     ram_usage = _get_ram_usage()
-    mapa_cache = _get_data_size_of_dir(path)
-    log.info(f"💾  Disk usage: {disk_usage}%, Ram usage: {ram_usage}%, mapa files: {mapa_cache} MB")
-    stl_num = _get_number_of_files_in_dir(path, ".stl")
-    tiff_num = _get_number_of_files_in_dir(path, ".tiff")
-    log.info(f"🗂  Number of STL files: {stl_num}, number of TIFF files: {tiff_num}")
-    if disk_usage > disk_cleaning_threshold:
-        log.info(f"🧹  Disk usage exceeds threshold ({disk_usage}%>{disk_cleaning_threshold}%), deleting files ...")
-        _delete_files_in_dir(path, ".stl")
-        _delete_files_in_dir(path, ".zip")
-        _delete_files_in_dir(path, ".tiff", name_prefix="merged_")
-        _delete_files_in_dir(path, ".tiff", name_prefix="clipped_")
+    budget_mb = round(cache_size_budget / 1024**2, 4)
+    log.info(f"💾  Disk usage: {disk_usage}%, Ram usage: {ram_usage}%, mapa files: {inventory.size_mb} MB")
+    log.info(f"🗂  Number of STL files: {inventory.count('.stl')}, number of TIFF files: {inventory.count('.tiff')}")
+    freed = 0
+    if inventory.size > cache_size_budget:
+        # processes sharing the cache directory take turns, evicting concurrently would free more than needed
+        with file_lock(path, "cleanup") as acquired:
+            if acquired:
+                log.info(f"🧹  Cache size exceeds budget ({inventory.size_mb} MB>{budget_mb} MB), evicting files ...")
+                freed = evict_lru(inventory, cache_size_budget, low_water_mark, min_age)
+                log.info(f"✅  Freed {round(freed / 1024**2, 4)} MB, cache size is now {inventory.size_mb} MB")
     else:
         log.info(
-            f"✅  Disk usage does not exceed threshold ({disk_usage}%<{disk_cleaning_threshold}%), no cleaning required."
+            f"✅  Cache size does not exceed budget ({inventory.size_mb} MB<{budget_mb} MB), no cleaning required."
         )
+    stats = CleanupStats(
+        disk_usage=disk_usage,
+        ram_usage=ram_usage,
+        cache_size=inventory.size,
+        freed=freed,
+        duration=round(time.time() - start, 4),
+        timestamp=start,
+    )
+    CLEANUP_SECONDS.observe(stats.duration)
+    CLEANUP_FREED_BYTES.inc(freed)
+    CACHE_SIZE_BYTES.set(stats.cache_size)
+    return stats
+
+
+class Janitor(Thread):
+    """Daemon thread which runs the cleanup job in the background, keeping cache housekeeping off the request path.
+
+    A full cleanup, including a full rescan of the inventory, runs every `interval` seconds. In between, the janitor
+    checks every `check_interval` seconds (or immediately, when being notified) whether the cache exceeds its budget
+    and cleans up ahead of schedule if so. Statistics of the last cleanup are available via `stats`. Housekeeping in
+    response to a notification, i.e. an upcoming conversion, is recorded as `cleanup` stage of computing STL files.
+    """
+
+    def __init__(
+        self,
+        inventory: CacheInventory,
+        cache_size_budget: int,
+        low_water_mark: float,
+        min_age: float,
+        interval: float,
+        check_interval: float,
+    ) -> None:
+        super().__init__(name="mapa-janitor", daemon=True)
+        self.inventory = inventory
+        self.cache_size_budget = cache_size_budget
+        self.low_water_mark = low_water_mark
+        self.min_age = min_age
+        self.interval = interval
+        self.check_interval = check_interval
+        self.stats: Union[None, CleanupStats] = None
+        self._wakeup = Event()
+        self._stopped = Event()
+
+    def run(self) -> None:
+        notified = False
+        while not self._stopped.is_set():
+            start = time.perf_counter()
+            due = self.stats is None or time.time() - self.stats.timestamp >= self.interval
+            if due:
+                # files rewritten in place are missed by the incremental sync, so rebuild the inventory now and then
+                self.inventory.refresh()
+            else:
+                self.inventory.sync()
+            if due or self.inventory.size > self.cache_size_budget:
+                self.run_once()
+            if notified:
+                COMPUTE_STAGE_SECONDS.observe(time.perf_counter() - start, stage="cleanup")
+            notified = self._wakeup.wait(self.check_interval) and not self._stopped.is_set()
+            self._wakeup.clear()
+
+    def run_once(self) -> CleanupStats:
+        try:
+            self.stats = run_cleanup_job(
+                path=self.inventory.path,
+                cache_size_budget=self.cache_size_budget,
+                low_water_mark=self.low_water_mark,
+                min_age=self.min_age,
+                inventory=self.inventory,
+            )
+        except Exception:
+            # never let the janitor die, the next run will try again
+            log.exception("❌  cleanup job failed")
+        return self.stats
+
+    def notify(self) -> None:
+        """Wakes the janitor up to check the cache size, without blocking the caller."""
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
@@ -0,0 +1,82 @@
+import logging
+from typing import Dict, List, Set, Tuple, Union
+
+from mapa_streamlit.caching import get_hash_of_geojson
+
+log = logging.getLogger(__name__)
+
+
+def _get_canonical_form(geometry: dict) -> Union[None, Tuple]:
+    # nested tuples of the coordinates are way cheaper to compute than serializing and hashing the geometry. The types
+    # of the values are part of the canonical form, as e.g. 8 and 8.0 compare equal, but are serialized differently.
+    if geometry.keys() != {"type", "coordinates"}:
+        return None
+    rings = geometry["coordinates"]
+    coordinates = tuple(tuple(tuple(coordinate) for coordinate in ring) for ring in rings)
+    types = tuple(type(value) for ring in rings for coordinate in ring for value in coordinate)
+    return geometry["type"], coordinates, types
+
+
+class DrawingIndex:
+    """Keeps track of the rectangles a user has drawn on the map within a session.
+
+    Hashes of drawings are cached by the canonical form of their coordinates, so each drawing is serialized and
+    hashed only once. Known drawings are stored in a set, which makes detecting new drawings linear in the number of
+    drawings instead of quadratic. Drawings which are no longer on the map are dropped, except for the active one.
+    """
+
+    def __init__(self) -> None:
+        self._hashes: Dict[Tuple, str] = {}
+        self._geometries: Dict[str, dict] = {}
+        self.known: Set[str] = set()
+        self.active: Union[None, str] = None
+
+    def get_hash(self, geometry: dict) -> str:
+        canonical_form = _get_canonical_form(geometry)
+        if canonical_form is None:
+            return get_hash_of_geojson(geometry)
+        geo_hash = self._hashes.get(canonical_form)
+        if geo_hash is None:
+            geo_hash = get_hash_of_geojson(geometry)
+            self._hashes[canonical_form] = geo_hash
+        return geo_hash
+
+    def get_geometry(self, geo_hash: str) -> Union[None, dict]:
+        return self._geometries.get(geo_hash)
+
+    def update(self, drawings: List[dict]) -> Union[None, str]:
+        """Registers the given drawings and returns the hash of the active drawing.
+
+        Parameters
+        ----------
+        drawings : List[dict]
+            All drawings on the map, as returned by `st_folium` in `all_drawings`.
+
+        Returns
+        -------
+        Union[None, str]
+            Hash of the first drawing which was not known before. If there is no new drawing, the previously active
+            drawing is returned.
+        """
+
+        hashes = set()
+        new_drawing = None
+        for draw in drawings:
+            geo_hash = self.get_hash(draw["geometry"])
+            hashes.add(geo_hash)
+            self._geometries[geo_hash] = draw["geometry"]
+            if new_drawing is None and geo_hash not in self.known:
+                new_drawing = geo_hash
+
+        if new_drawing is not None:
+            self.known = hashes
+            self.active = new_drawing
+            log.debug(f"🎨  found new active_drawing: {new_drawing}")
+        else:
+            log.debug(f"💾  no new drawing found, returning last active drawing from state: {self.active}")
+
+        retained = hashes | {self.active}
+        if len(self._geometries) > len(retained):
+            self._geometries = {h: g for h, g in self._geometries.items() if h in retained}
+            self._hashes = {c: h for c, h in self._hashes.items() if h in retained}
+        return self.active
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Union
+
+import numpy as np
+
+from mapa_streamlit.caching import file_lock, get_hash_of_geojson
+from mapa_streamlit.profiling import stage
+from mapa_streamlit.verification import get_bounds
+
+log = logging.getLogger(__name__)
+
+
+class Elevation(NamedTuple):
+    # elevation in meter of the clipped raster, memory-mapped from the cache directory
+    array: np.ndarray
+    # distance in meter along the top edge of the raster, which mapa uses for scaling the elevation
+    top_edge_length: float
+
+    def get_elevation_scale(self, model_size: int) -> float:
+        # same as `mapa.raster.determine_elevation_scale`
+        return model_size / self.top_edge_length
+
+
+def path_to_elevation_array(geo_hash: str, cache_dir: Path) -> Path:
+    return Path(cache_dir) / f"elevation_{geo_hash}.npy"
+
+
+def path_to_elevation_metadata(geo_hash: str, cache_dir: Path) -> Path:
+    return Path(cache_dir) / f"elevation_{geo_hash}.json"
+
+
+def _get_top_edge_length(tiff) -> float:
+    from haversine import haversine
+    from mapa.raster import _get_coordinate_of_pixel
+
+    top_left = _get_coordinate_of_pixel(0, 0, tiff)
+    top_right = _get_coordinate_of_pixel(0, tiff.width, tiff)
+    return haversine(top_left, top_right, unit="m")
+
+
+def _store_array(array: np.ndarray, path: Path) -> None:
+    # concurrent conversions of the same geometry must never map a partially written file
+    tmp_file = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp_file, array)
+    os.replace(tmp_file, path)
+
+
+def _store_metadata(top_edge_length: float, path: Path) -> None:
+    tmp_file = path.with_name(f"{path.stem}.{os.getpid()}.tmp.json")
+    tmp_file.write_text(json.dumps({"top_edge_length": top_edge_length}))
+    os.replace(tmp_file, path)
+
+
+def _load_cached_elevation(geo_hash: str, cache_dir: Path) -> Union[None, Elevation]:
+    # array and metadata are evicted independently of each other and of the clipped raster
+    try:
+        metadata = json.loads(path_to_elevation_metadata(geo_hash, cache_dir).read_text())
+        array = np.load(path_to_elevation_array(geo_hash, cache_dir), mmap_mode="r")
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+    return Elevation(array=array, top_edge_length=metadata["top_edge_length"])
+
+
+def download_dem_tiles(bbox_geometry: dict, cache_dir: Path) -> List[Path]:
+    # downloads the DEM tiles the same way as `mapa.stac.fetch_stac_items_for_bbox`, but publishes them atomically,
+    # so that other processes sharing the cache directory never read partially downloaded tiles
+    from urllib import request
+
+    from mapa.exceptions import NoSTACItemFound
+    from planetary_computer import sign_inplace
+    from pystac_client import Client
+
+    from mapa_streamlit.preview import STAC_API_URL, STAC_COLLECTION
+
+    client = Client.open(STAC_API_URL, ignore_conformance=True, modifier=sign_inplace)
+    tiffs = []
+    for item in client.search(collections=[STAC_COLLECTION], bbox=get_bounds(bbox_geometry).tolist()).items():
+        tiff = cache_dir / f"{item.id}.tiff"
+        tiffs.append(tiff)
+        with file_lock(cache_dir, "dem", item.id):
+            if tiff.is_file():
+                continue
+            log.info(f"🏞  downloading stac item {item.id}")
+            tmp_file = tiff.with_name(f"{tiff.stem}.{os.getpid()}.tmp")
+            try:
+                request.urlretrieve(item.assets["data"].href, tmp_file)
+                os.replace(tmp_file, tiff)
+            finally:
+                tmp_file.unlink(missing_ok=True)
+    if not tiffs:
+        raise NoSTACItemFound("Could not find the desired STAC item for the given bounding box.")
+    return tiffs
+
+
+def _merge_and_clip_dem_tiles(tiffs: List[Path], bbox_geometry: dict, geo_hash: str, cache_dir: Path) -> Path:
+    # same as `mapa._fetch_merge_and_clip_tiffs`, but for tiles which were downloaded already
+    from mapa.raster import clip_tiff_to_bbox, merge_tiffs
+
+    merged_tiff = merge_tiffs(tiffs, geo_hash, cache_dir) if len(tiffs) > 1 else tiffs[0]
+    return clip_tiff_to_bbox(merged_tiff, bbox_geometry, geo_hash, cache_dir)
+
+
+def load_elevation(bbox_geometry: dict, cache_dir: Path) -> Elevation:
+    """Returns the elevation of the given geometry. The DEM tiles are downloaded, merged and clipped, unless the clipped
+    raster is cached already, and its pixels are stored as numpy array next to it, together with the length of its top
+    edge. Later conversions of the same geometry map that array into memory instead of fetching and decoding the raster
+    again, so that conversions with different parameters only compute the mesh and concurrent conversions share the
+    same pages of memory. All files are published atomically or derived under a file lock, so that the cache directory
+    can be shared by several processes.
+    """
+    cache_dir = Path(cache_dir)
+    geo_hash = get_hash_of_geojson(bbox_geometry)
+    elevation = _load_cached_elevation(geo_hash, cache_dir)
+    if elevation is not None:
+        log.info("🚀  using cached elevation array!")
+        return elevation
+
+    from mapa.raster import tiff_to_array
+    from mapa.utils import path_to_clipped_tiff
+    from rasterio import open as open_tiff
+
+    path_to_array = path_to_elevation_array(geo_hash, cache_dir)
+    # mapa writes the merged and clipped rasters in place, so only one process at a time may derive them
+    with file_lock(cache_dir, "rasters", geo_hash):
+        # another process might have derived the elevation while waiting for the lock
+        elevation = _load_cached_elevation(geo_hash, cache_dir)
+        if elevation is not None:
+            log.info("🚀  using cached elevation array!")
+            return elevation
+        path_to_tiff = path_to_clipped_tiff(geo_hash, cache_dir)
+        if path_to_tiff.is_file():
+            log.info("🚀  using cached tiff!")
+        else:
+            with stage("dem_download"):
+                tiffs = download_dem_tiles(bbox_geometry, cache_dir)
+            with stage("clipping"):
+                path_to_tiff = _merge_and_clip_dem_tiles(tiffs, bbox_geometry, geo_hash, cache_dir)
+        with open_tiff(path_to_tiff) as tiff:
+            # only the header of the raster is read for determining the distance
+            top_edge_length = _get_top_edge_length(tiff)
+            if not path_to_array.is_file():
+                log.info(f"💾  storing elevation array: {path_to_array}")
+                with stage("elevation_array"):
+                    _store_array(tiff_to_array(tiff), path_to_array)
+        _store_metadata(top_edge_length, path_to_elevation_metadata(geo_hash, cache_dir))
+    return Elevation(array=np.load(path_to_array, mmap_mode="r"), top_edge_length=top_edge_length)
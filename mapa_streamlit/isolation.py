@@ -0,0 +1,118 @@
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, Tuple, Union
+
+from mapa_streamlit import progress
+from mapa_streamlit.profiling import collect_timings
+
+log = logging.getLogger(__name__)
+
+
+class ConversionError(Exception):
+    def __init__(self, message: str, peak_memory: Union[None, int] = None) -> None:
+        super().__init__(message)
+        self.peak_memory = peak_memory
+
+    def __reduce__(self):
+        # keep the peak memory when pickling the error, e.g. when passing it between processes
+        return type(self), (str(self), self.peak_memory)
+
+
+def _get_peak_memory() -> int:
+    # ru_maxrss is given in kilobytes on linux. Tile conversions run in child processes, of which the largest one is
+    # accounted for in addition.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (own + children) * 1024
+
+
+def _run(
+    function: Callable,
+    kwargs: dict,
+    memory_limit: Union[None, int],
+    niceness: int,
+    progress_slots,
+    connection: Connection,
+) -> None:
+    progress.attach(progress_slots)
+    if niceness:
+        os.nice(niceness)
+    if memory_limit is not None:
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        if hard_limit != resource.RLIM_INFINITY:
+            memory_limit = min(memory_limit, hard_limit)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard_limit))
+    try:
+        with collect_timings() as timings:
+            result = function(**kwargs)
+    except MemoryError:
+        if memory_limit is None:
+            error = "conversion ran out of memory"
+        else:
+            error = f"conversion exceeded its memory limit of {round(memory_limit / 1024**2)} MB"
+        connection.send((None, error, _get_peak_memory(), None))
+    except Exception as e:
+        connection.send((None, str(e) or type(e).__name__, _get_peak_memory(), None))
+    else:
+        connection.send((result, None, _get_peak_memory(), timings))
+    finally:
+        connection.close()
+
+
+def run_isolated(
+    function: Callable, kwargs: dict, memory_limit: Union[None, int] = None, niceness: int = 0, progress_slots=None
+) -> Tuple[Any, int, Dict[str, float]]:
+    """Calls the function with the given keyword arguments in a fresh process, so that a conversion running out of
+    memory neither takes down the calling process nor any other conversion.
+
+    Parameters
+    ----------
+    function : Callable
+        Function to be called, needs to be picklable, i.e. defined on module level.
+    kwargs : dict
+        Keyword arguments passed to the function.
+    memory_limit : Union[None, int], optional
+        Limit of the address space of the process in bytes, exceeding it raises a `MemoryError` within the process.
+        By default the process is not limited.
+    niceness : int, optional
+        Increment of the niceness of the process, i.e. how much its CPU priority is lowered. By default 0
+    progress_slots : optional
+        Shared array of a `mapa_streamlit.progress.ProgressChannel`, which the function reports its progress to. By
+        default progress is not reported.
+
+    Returns
+    -------
+    Tuple[Any, int, Dict[str, float]]
+        Result of the function, peak resident memory of the process in bytes and durations in seconds of the stages
+        the function entered, see `mapa_streamlit.profiling.stage`.
+
+    Raises
+    ------
+    ConversionError
+        In case the function raised an exception or the process died, e.g. killed by the OOM killer.
+    """
+    mp_context = multiprocessing.get_context("spawn")
+    receiver, sender = mp_context.Pipe(duplex=False)
+    process = mp_context.Process(
+        target=_run, args=(function, kwargs, memory_limit, niceness, progress_slots, sender), name="mapa-conversion"
+    )
+    process.start()
+    sender.close()
+    try:
+        result, error, peak_memory, timings = receiver.recv()
+    except EOFError:
+        process.join()
+        if process.exitcode is not None and process.exitcode < 0:
+            name = signal.Signals(-process.exitcode).name
+            raise ConversionError(f"conversion process was killed by {name}, it probably ran out of memory") from None
+        raise ConversionError(f"conversion process exited unexpectedly with code {process.exitcode}") from None
+    finally:
+        receiver.close()
+    process.join()
+    if error is not None:
+        raise ConversionError(error, peak_memory)
+    return result, peak_memory, timings
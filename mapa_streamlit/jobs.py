@@ -0,0 +1,435 @@
+import importlib
+import logging
+import math
+import multiprocessing
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import RLock
+from typing import Any, Callable, Deque, Dict, Tuple, Union
+
+import psutil
+
+from mapa_streamlit.caching import file_lock
+from mapa_streamlit.isolation import run_isolated
+from mapa_streamlit.metrics import (
+    COMPUTE_SECONDS,
+    COMPUTE_STAGE_SECONDS,
+    JOB_PEAK_MEMORY_BYTES,
+    JOBS,
+    JOBS_RUNNING,
+    QUEUE_DEPTH,
+)
+from mapa_streamlit.profiling import path_to_profile, run_profiled
+from mapa_streamlit.progress import ProgressChannel, ProgressReporter
+from mapa_streamlit.settings import TILE_MAX_WORKERS
+
+log = logging.getLogger(__name__)
+
+# niceness of the processes running background jobs, so that they do not compete with interactive jobs for CPU
+BACKGROUND_NICENESS = 10
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobState:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    job_id: str
+    kwargs: dict
+    key: Union[None, str] = None
+    memory: int = 0
+    background: bool = False
+    # whether the conversion is profiled, see `mapa_streamlit.profiling.run_profiled`
+    profile: bool = False
+    state: str = JobState.QUEUED
+    result: Union[None, Path] = None
+    error: Union[None, str] = None
+    # peak resident memory of the conversion process in bytes, None in case the result was produced by another process
+    peak_memory: Union[None, int] = None
+    # durations in seconds of the stages of the conversion, e.g. meshing and zipping, see `mapa_streamlit.profiling`
+    timings: Dict[str, float] = field(default_factory=dict)
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Union[None, float] = None
+    finished_at: Union[None, float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in (JobState.QUEUED, JobState.RUNNING)
+
+    @property
+    def duration(self) -> Union[None, float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return round(self.finished_at - self.started_at, 2)
+
+
+def convert_bbox_to_stl(max_tile_workers: int = TILE_MAX_WORKERS, **kwargs) -> Path:
+    """Default converter, which imports mapa lazily so that conversion processes only pay for it when actually used. The
+    elevation array of each geometry is reused across conversions and the tiles of tiled outputs are converted in
+    parallel, see `mapa_streamlit.tiling.convert_bbox_to_stl`."""
+    from mapa_streamlit.tiling import convert_bbox_to_stl
+
+    return convert_bbox_to_stl(max_tile_workers=max_tile_workers, **kwargs)
+
+
+def load_converter(path: Union[None, str]) -> Callable:
+    """Returns the converter given as `module:function`, e.g. a fake one for load tests, or the default converter."""
+    if not path:
+        return convert_bbox_to_stl
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _get_available_memory() -> int:
+    return psutil.virtual_memory().available
+
+
+def _run_job(
+    converter: Callable,
+    kwargs: dict,
+    progress_slot: Union[None, int] = None,
+    memory_limit: Union[None, int] = None,
+    profile: bool = False,
+    niceness: int = 0,
+    progress_slots=None,
+) -> Tuple[Any, Union[None, int], Dict[str, float]]:
+    """Runs the converter in an isolated process and returns its result along with the peak memory of the process and
+    the durations of the stages of the conversion. In case of profiling, the profile and the timings of the conversion
+    are also stored next to the output file."""
+    if progress_slot is not None:
+        # mapa reports its progress to the given streamlit progress bar, which is replaced by the progress channel
+        kwargs = {**kwargs, "progress_bar": ProgressReporter(progress_slot)}
+    isolation_kwargs = dict(memory_limit=memory_limit, niceness=niceness, progress_slots=progress_slots)
+    if "output_file" not in kwargs:
+        return run_isolated(converter, kwargs, **isolation_kwargs)
+    output_file = Path(kwargs["output_file"])
+    # processes sharing the cache directory, e.g. replicas of the app, convert the same output only once
+    with file_lock(output_file.parent, "results", output_file.name):
+        existing = next(output_file.parent.glob(f"{output_file.name}.*"), None)
+        if existing is not None:
+            log.info(f"🚀  using result of another process: {existing}")
+            return existing, None, {}
+        # let the converter write to a private name and atomically move the result into place once it is complete,
+        # so that readers never see partially written archives
+        partial_file = output_file.with_name(f"partial_{uuid.uuid4().hex}_{output_file.name}")
+        kwargs = {**kwargs, "output_file": partial_file}
+        if profile:
+            kwargs = {**kwargs, "function": converter, "profile_file": path_to_profile(output_file)}
+            converter = run_profiled
+        try:
+            result, peak_memory, timings = run_isolated(converter, kwargs, **isolation_kwargs)
+        except Exception:
+            for file in partial_file.parent.glob(f"{partial_file.name}*"):
+                file.unlink(missing_ok=True)
+            raise
+        final_file = output_file.with_name(f"{output_file.name}{Path(result).suffix}")
+        os.replace(result, final_file)
+    return final_file, peak_memory, timings
+
+
+class JobManager:
+    """Runs STL conversions in the background, so that the streamlit script thread returns immediately. Each conversion
+    runs in a separate process, which is started and waited for by a thread of a pool of workers.
+
+    Jobs are only handed to the pool once a worker is free and enough memory is available for the estimated peak
+    memory of the job, which means that a job in state `running` is actually being computed, while all others wait in
+    state `queued`. Memory reserved by running jobs is subtracted from the available memory, as their actual usage
+    might not have peaked yet. A single job is always admitted while no other job is running, so that large jobs do
+    not starve. Once `max_queue_depth` jobs are waiting, further submissions are rejected.
+
+    Jobs submitted with a `key` are coalesced: as long as a job with the same key is queued or running, submitting it
+    again returns the id of the existing job instead of computing the same result twice.
+
+    Background jobs, e.g. for warming up the cache, are kept in a separate queue, which is only served while no
+    interactive job is waiting. They run one at a time with lowered CPU priority, are never admitted without sufficient
+    memory and do not count towards `max_queue_depth`. Submitting an interactive job with the key of a queued
+    background job promotes the latter to the interactive queue.
+
+    Parameters
+    ----------
+    max_workers : int
+        Number of conversions which are allowed to run in parallel.
+    converter : Callable, optional
+        Function performing the conversion, it is called with the keyword arguments passed to `submit`. Needs to be
+        picklable, i.e. defined on module level. By default `convert_bbox_to_stl` of mapa is used.
+    max_queue_depth : Union[None, int], optional
+        Maximum number of waiting jobs, by default the queue is unbounded.
+    memory_headroom : int, optional
+        Memory in bytes which needs to remain available after admitting a job. By default 0
+    available_memory : Callable, optional
+        Function returning the currently available memory in bytes. By default the available system memory is used.
+    memory_limit_base : Union[None, int], optional
+        Each conversion runs in a separate process, whose address space is limited to this number of bytes plus
+        `memory_limit_factor` times the estimated peak memory of the job. Exceeding the limit fails the job instead of
+        exhausting the memory of the host. By default conversions are not limited.
+    memory_limit_factor : float, optional
+        Factor applied to the estimated peak memory when limiting the address space. By default 2.0
+    job_ttl : float, optional
+        Number of seconds for which finished and failed jobs are kept after finishing, afterwards `get` returns None
+        for them. By default 3600.0
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        converter: Callable = convert_bbox_to_stl,
+        max_queue_depth: Union[None, int] = None,
+        memory_headroom: int = 0,
+        available_memory: Callable[[], int] = _get_available_memory,
+        memory_limit_base: Union[None, int] = None,
+        memory_limit_factor: float = 2.0,
+        job_ttl: float = 3600.0,
+    ) -> None:
+        self.max_workers = max_workers
+        self.converter = converter
+        self.max_queue_depth = max_queue_depth
+        self.memory_headroom = memory_headroom
+        self.available_memory = available_memory
+        self.memory_limit_base = memory_limit_base
+        self.memory_limit_factor = memory_limit_factor
+        self.job_ttl = job_ttl
+        # one progress slot for each worker of both pools, conversion processes are spawned, see `run_isolated`
+        self._progress = ProgressChannel(slots=max_workers + 1, mp_context=multiprocessing.get_context("spawn"))
+        # the workers merely wait for the conversion processes, hence threads suffice
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mapa-job")
+        self._background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mapa-background-job")
+        self._progress_slots: Dict[str, int] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._pending: Deque[Job] = deque()
+        self._background: Deque[Job] = deque()
+        self._in_flight: Dict[str, Job] = {}
+        # terminal jobs in the order they finished, so that expired ones are always at the front
+        self._finished: Deque[Job] = deque()
+        self._running = 0
+        self._running_background = 0
+        self._reserved_memory = 0
+        self._durations: Deque[float] = deque(maxlen=20)
+        self._is_shut_down = False
+        self._lock = RLock()
+
+    def submit(
+        self, key: Union[None, str] = None, memory: int = 0, background: bool = False, profile: bool = False, **kwargs
+    ) -> str:
+        """Queues a conversion and returns the id of its job.
+
+        Parameters
+        ----------
+        key : Union[None, str], optional
+            Key for coalescing identical jobs, by default jobs are not coalesced.
+        memory : int, optional
+            Estimated peak memory of the job in bytes, used for admission. By default 0
+        background : bool, optional
+            Whether the job is run at low priority in the background. By default False
+        profile : bool, optional
+            Whether the conversion is profiled, which requires an `output_file`. In case an identical job is already
+            in flight, it is not profiled. By default False
+        **kwargs
+            Keyword arguments passed to the converter.
+
+        Raises
+        ------
+        QueueFullError
+            In case `max_queue_depth` jobs are already waiting.
+        """
+        with self._lock:
+            if key in self._in_flight:
+                job = self._in_flight[key]
+                if not background and job in self._background:
+                    self._check_queue_depth()
+                    self._background.remove(job)
+                    job.background = False
+                    self._pending.append(job)
+                    log.info(f"⏫  promoted background job {job.job_id} with key {key}")
+                    self._dispatch()
+                    self._update_gauges()
+                else:
+                    log.info(f"🔗  attaching to in-flight job {job.job_id} with key {key}")
+                return job.job_id
+            self._expire()
+            if not background:
+                self._check_queue_depth()
+            job = Job(
+                job_id=uuid.uuid4().hex, kwargs=kwargs, key=key, memory=memory, background=background, profile=profile
+            )
+            self._jobs[job.job_id] = job
+            if key is not None:
+                self._in_flight[key] = job
+            if background:
+                self._background.append(job)
+                log.info(f"📥  queued background job {job.job_id}, {len(self._background)} job(s) waiting")
+            else:
+                self._pending.append(job)
+                log.info(f"📥  queued job {job.job_id}, {len(self._pending)} job(s) waiting")
+            self._dispatch()
+            self._update_gauges()
+        return job.job_id
+
+    def get(self, job_id: Union[None, str]) -> Union[None, Job]:
+        return self._jobs.get(job_id)
+
+    def progress(self, job_id: Union[None, str]) -> Union[None, float]:
+        """Progress of a job in percent as reported by the converter, or None in case the job is not known or failed."""
+        job = self._jobs.get(job_id)
+        if job is None or job.state == JobState.FAILED:
+            return None
+        if job.state == JobState.DONE:
+            return 100.0
+        slot = self._progress_slots.get(job_id)
+        return self._progress.get(slot) if slot is not None else 0.0
+
+    def position(self, job_id: Union[None, str]) -> Union[None, int]:
+        """1-based position of a queued job in the queue or None in case the job is not waiting."""
+        with self._lock:
+            for i, job in enumerate(self._pending):
+                if job.job_id == job_id:
+                    return i + 1
+        return None
+
+    @property
+    def mean_duration(self) -> Union[None, float]:
+        """Mean duration in seconds of recently finished jobs, or None in case no job finished yet."""
+        durations = list(self._durations)
+        return sum(durations) / len(durations) if durations else None
+
+    def expected_wait(self, job_id: Union[None, str]) -> Union[None, float]:
+        """Expected time in seconds until a queued job is started, based on the duration of recently finished jobs.
+        Returns None in case the job is not waiting or no job finished yet."""
+        position = self.position(job_id)
+        mean_duration = self.mean_duration
+        if position is None or mean_duration is None:
+            return None
+        return round(math.ceil(position / self.max_workers) * mean_duration, 1)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            self._is_shut_down = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._background_executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _check_queue_depth(self) -> None:
+        if self.max_queue_depth is not None and len(self._pending) >= self.max_queue_depth:
+            log.warning(f"⛔️  rejecting job, {len(self._pending)} job(s) are already waiting")
+            raise QueueFullError(f"{len(self._pending)} jobs are already waiting")
+
+    def _admissible(self, job: Job) -> bool:
+        if self._running == 0 and not job.background:
+            return True
+        available = self.available_memory() - self._reserved_memory
+        if available - job.memory < self.memory_headroom:
+            log.info(f"⏸️  holding back job {job.job_id}, only {round(available / 1024**2)} MB of memory available")
+            return False
+        return True
+
+    def _expire(self) -> None:
+        # caller needs to hold the lock
+        now = time.time()
+        while self._finished and now - self._finished[0].finished_at >= self.job_ttl:
+            del self._jobs[self._finished.popleft().job_id]
+
+    def _dispatch(self) -> None:
+        # caller needs to hold the lock. Jobs are started strictly in order, a job which does not fit into memory
+        # blocks the ones behind it, so that large jobs are not overtaken indefinitely.
+        if self._is_shut_down:
+            return
+        while self._pending and self._running < self.max_workers and self._admissible(self._pending[0]):
+            self._running += 1
+            self._start(self._pending.popleft(), self._executor)
+        # background jobs only start while no interactive job is waiting for a worker or for memory
+        while (
+            self._background
+            and not self._pending
+            and self._running_background == 0
+            and self._admissible(self._background[0])
+        ):
+            self._running_background += 1
+            self._start(self._background.popleft(), self._background_executor)
+
+    def _update_gauges(self) -> None:
+        QUEUE_DEPTH.set(len(self._pending))
+        JOBS_RUNNING.set(self._running + self._running_background)
+
+    def _start(self, job: Job, executor: ThreadPoolExecutor) -> None:
+        job.state = JobState.RUNNING
+        job.started_at = time.time()
+        self._reserved_memory += job.memory
+        slot = self._progress.acquire()
+        if slot is not None:
+            self._progress_slots[job.job_id] = slot
+        future = executor.submit(
+            _run_job,
+            self.converter,
+            job.kwargs,
+            slot,
+            self._get_memory_limit(job),
+            profile=job.profile,
+            niceness=BACKGROUND_NICENESS if job.background else 0,
+            progress_slots=self._progress.array,
+        )
+        future.add_done_callback(lambda f, job=job: self._on_done(job, f))
+        log.info(f"🏃  started {'background ' if job.background else ''}job {job.job_id}")
+
+    @staticmethod
+    def _format_memory(job: Job) -> str:
+        peak = f"{round(job.peak_memory / 1024**2)} MB" if job.peak_memory is not None else "unknown"
+        return f"peak memory: {peak}, estimated: {round(job.memory / 1024**2)} MB"
+
+    def _get_memory_limit(self, job: Job) -> Union[None, int]:
+        if self.memory_limit_base is None:
+            return None
+        return int(self.memory_limit_base + self.memory_limit_factor * job.memory)
+
+    def _on_done(self, job: Job, future: Future) -> None:
+        with self._lock:
+            job.finished_at = time.time()
+            try:
+                job.result, job.peak_memory, job.timings = future.result()
+                job.state = JobState.DONE
+                self._durations.append(job.duration)
+                log.info(f"✅  finished job {job.job_id} in {job.duration}s, {self._format_memory(job)}")
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                job.peak_memory = getattr(e, "peak_memory", None)
+                job.state = JobState.FAILED
+                log.error(f"❌  job {job.job_id} failed: {job.error}, {self._format_memory(job)}")
+            if job.background:
+                self._running_background -= 1
+            else:
+                self._running -= 1
+            self._reserved_memory -= job.memory
+            self._in_flight.pop(job.key, None)
+            self._progress.release(self._progress_slots.pop(job.job_id, None))
+            self._finished.append(job)
+            self._expire()
+            self._dispatch()
+            self._update_gauges()
+        JOBS.inc(state=job.state)
+        if job.peak_memory is not None:
+            JOB_PEAK_MEMORY_BYTES.observe(job.peak_memory, tiles=job.kwargs.get("split_area_in_tiles", "1x1"))
+        if not job.background:
+            # latency as experienced by users, background jobs intentionally wait and run at low priority
+            COMPUTE_STAGE_SECONDS.observe(job.started_at - job.submitted_at, stage="queue")
+            COMPUTE_STAGE_SECONDS.observe(job.finished_at - job.started_at, stage="conversion")
+            for name, seconds in job.timings.items():
+                COMPUTE_STAGE_SECONDS.observe(seconds, stage=name)
+            COMPUTE_SECONDS.observe(job.finished_at - job.submitted_at)
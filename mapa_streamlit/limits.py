@@ -0,0 +1,144 @@
+import logging
+import math
+import time
+from threading import Lock
+from typing import Callable, NamedTuple, Union
+
+import psutil
+
+from mapa_streamlit.verification import DEM_PIXELS_PER_DEGREE, EARTH_RADIUS
+
+log = logging.getLogger(__name__)
+
+
+class Limits(NamedTuple):
+    max_dem_tiles: int
+    max_raster_pixels: int
+    max_output_size: int
+
+
+class Load(NamedTuple):
+    # usage of RAM and CPU in percent, number of running and waiting conversions and mean duration of recent ones
+    ram_usage: float
+    cpu_usage: float
+    running: int
+    queue_depth: int
+    mean_duration: Union[None, float]
+
+
+def get_system_load(running: int, queue_depth: int, mean_duration: Union[None, float]) -> Load:
+    # the cpu usage is measured since the previous call, so the first call of a process returns 0
+    return Load(
+        ram_usage=psutil.virtual_memory().percent,
+        cpu_usage=psutil.cpu_percent(interval=None),
+        running=running,
+        queue_depth=queue_depth,
+        mean_duration=mean_duration,
+    )
+
+
+def get_approximate_max_area(max_raster_pixels: int) -> float:
+    """Area in km² covered by the given number of DEM pixels at the equator, as an indication for users."""
+    pixel_size = 2 * math.pi * EARTH_RADIUS / 360 / DEM_PIXELS_PER_DEGREE
+    return max_raster_pixels * pixel_size**2
+
+
+class AdaptiveLimits:
+    """Scales the cost limits of conversions with the load of the server, so that large regions can be converted
+    while the server is idle and the limits shrink once it gets busy.
+
+    The pressure is the highest of RAM usage, CPU usage, the number of running and waiting conversions per worker and
+    the mean duration of recent conversions relative to the target duration, each normalized to 1 for full load. Up
+    to `low_pressure` the limits are scaled by `ceiling`, from `high_pressure` on by `floor`, and linearly in between.
+    The scale only changes once the new scale differs by more than `hysteresis` from the current one, so that the
+    limits do not flap with the noise of the measurements.
+
+    Parameters
+    ----------
+    base : Limits
+        Limits at a scale of 1.
+    max_workers : int
+        Number of conversions running in parallel, used for normalizing the number of jobs.
+    target_duration : float
+        Duration of a conversion in seconds which is considered full load.
+    floor : float
+        Smallest scale of the limits.
+    ceiling : float
+        Largest scale of the limits.
+    low_pressure : float
+        Pressure up to which the limits are scaled by the ceiling.
+    high_pressure : float
+        Pressure from which on the limits are scaled by the floor.
+    hysteresis : float
+        Minimal change of the scale, which is applied.
+    update_interval : float
+        Minimal interval in seconds between two load measurements.
+    get_load : Callable
+        Function returning the current load.
+    """
+
+    def __init__(
+        self,
+        base: Limits,
+        max_workers: int,
+        target_duration: float,
+        floor: float,
+        ceiling: float,
+        low_pressure: float,
+        high_pressure: float,
+        hysteresis: float,
+        update_interval: float,
+        get_load: Callable[[], Load],
+    ) -> None:
+        self.base = base
+        self.max_workers = max_workers
+        self.target_duration = target_duration
+        self.floor = floor
+        self.ceiling = ceiling
+        self.low_pressure = low_pressure
+        self.high_pressure = high_pressure
+        self.hysteresis = hysteresis
+        self.update_interval = update_interval
+        self.get_load = get_load
+        self.scale = 1.0
+        self._updated_at: Union[None, float] = None
+        self._lock = Lock()
+
+    def get_pressure(self, load: Load) -> float:
+        pressures = [
+            load.ram_usage / 100,
+            load.cpu_usage / 100,
+            (load.running + load.queue_depth) / self.max_workers,
+        ]
+        if load.mean_duration is not None:
+            pressures.append(load.mean_duration / self.target_duration)
+        return max(pressures)
+
+    def get_target_scale(self, pressure: float) -> float:
+        fraction = (pressure - self.low_pressure) / (self.high_pressure - self.low_pressure)
+        fraction = min(max(fraction, 0.0), 1.0)
+        return self.ceiling - fraction * (self.ceiling - self.floor)
+
+    def update(self) -> float:
+        """Measures the load, if due, and adjusts the scale accordingly. Returns the current scale."""
+        with self._lock:
+            now = time.monotonic()
+            if self._updated_at is not None and now - self._updated_at < self.update_interval:
+                return self.scale
+            self._updated_at = now
+            load = self.get_load()
+            target = self.get_target_scale(self.get_pressure(load))
+            # the bounds are always reached, so that the hysteresis does not keep the scale just short of them
+            if abs(target - self.scale) > self.hysteresis or target in (self.floor, self.ceiling):
+                if target != self.scale:
+                    log.info(f"⚖️  scaling limits from {self.scale:.2f} to {target:.2f}, load: {load}")
+                self.scale = target
+            return self.scale
+
+    @property
+    def limits(self) -> Limits:
+        return Limits(
+            max_dem_tiles=max(1, int(self.base.max_dem_tiles * self.scale)),
+            max_raster_pixels=int(self.base.max_raster_pixels * self.scale),
+            max_output_size=int(self.base.max_output_size * self.scale),
+        )
@@ -0,0 +1,244 @@
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, math.inf)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Base class of all metrics, values are kept per combination of label values."""
+
+    type: str = "untyped"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._lock = Lock()
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        """Returns the name, labels and value of each sample of the metric."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        with self._lock:
+            return [(f"{self.name}_total", labels, value) for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """Gauge which is either set explicitly or, in case a function is given, evaluated on every scrape."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self._value: float = 0
+        self._function: Union[None, Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def get(self) -> float:
+        return self._function() if self._function is not None else self._value
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        return [(self.name, (), self.get())]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(set(buckets) | {math.inf}))
+        self._counts: Dict[Tuple[Tuple[str, str], ...], List[int]] = {}
+        self._sums: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels: str) -> int:
+        counts = self._counts.get(tuple(sorted(labels.items())))
+        return counts[-1] if counts else 0
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        samples = []
+        with self._lock:
+            for labels, counts in sorted(self._counts.items()):
+                for bound, count in zip(self.buckets, counts, strict=True):
+                    samples.append((f"{self.name}_bucket", labels + (("le", _format_value(bound)),), count))
+                samples.append((f"{self.name}_sum", labels, self._sums[labels]))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+COMPUTE_STAGE_SECONDS = REGISTRY.histogram(
+    "mapa_compute_stage_seconds",
+    "Duration of the stages of computing STL files (validation, cleanup, queue, conversion and its stages like "
+    "dem_download, clipping, meshing and zipping).",
+)
+COMPUTE_SECONDS = REGISTRY.histogram(
+    "mapa_compute_seconds", "Duration from submitting a conversion until its result is available."
+)
+CACHE_REQUESTS = REGISTRY.counter("mapa_cache_requests", "Lookups of generated archives in the result cache.")
+DOWNLOAD_BYTES = REGISTRY.counter("mapa_download_bytes", "Bytes of downloaded archives.")
+JOBS = REGISTRY.counter("mapa_jobs", "Finished conversions by state.")
+QUEUE_DEPTH = REGISTRY.gauge("mapa_queue_depth", "Number of conversions waiting for a worker.")
+JOBS_RUNNING = REGISTRY.gauge("mapa_jobs_running", "Number of running conversions.")
+JOB_PEAK_MEMORY_BYTES = REGISTRY.histogram(
+    "mapa_job_peak_memory_bytes",
+    "Peak resident memory of conversions by tiling format.",
+    buckets=tuple(2**i * 1024**2 for i in range(6, 15)),
+)
+CLEANUP_SECONDS = REGISTRY.histogram(
+    "mapa_cleanup_seconds", "Duration of cache cleanups.", buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+)
+CLEANUP_FREED_BYTES = REGISTRY.counter("mapa_cleanup_freed_bytes", "Bytes freed by cache cleanups.")
+CACHE_SIZE_BYTES = REGISTRY.gauge("mapa_cache_size_bytes", "Size of the cache directory after the last cleanup.")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self) -> None:
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # scrapes would flood the logs otherwise
+        pass
+
+
+def start_http_server(port: int, address: str = "127.0.0.1", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serves the metrics of the given registry on any path in a daemon thread."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((address, port), handler)
+    Thread(target=server.serve_forever, name="mapa-metrics-server", daemon=True).start()
+    log.info(f"📈  serving metrics on http://{address}:{server.server_port}/metrics")
+    return server
+
+
+def write_to_file(path: Path, registry: Registry = REGISTRY) -> None:
+    """Atomically writes the metrics to the given file, e.g. for the textfile collector of the node exporter."""
+    path = Path(path)
+    tmp_file = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_file.write_text(registry.render())
+    os.replace(tmp_file, path)
+
+
+class MetricsFileWriter(Thread):
+    """Daemon thread which writes the metrics to a file every `interval` seconds."""
+
+    def __init__(self, path: Path, interval: float, registry: Registry = REGISTRY) -> None:
+        super().__init__(name="mapa-metrics-writer", daemon=True)
+        self.path = Path(path)
+        self.interval = interval
+        self.registry = registry
+        self._stopped = Event()
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                write_to_file(self.path, self.registry)
+            except OSError:
+                log.exception(f"❌  could not write metrics to {self.path}")
+            self._stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+class Timer:
+    """Context manager observing the elapsed time in the given histogram."""
+
+    def __init__(self, histogram: Histogram, **labels: str) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
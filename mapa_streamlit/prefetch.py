@@ -0,0 +1,49 @@
+import logging
+from pathlib import Path
+from typing import List
+
+from mapa_streamlit.batch import Region
+from mapa_streamlit.elevation import download_dem_tiles
+from mapa_streamlit.settings import MAX_DEM_TILES
+from mapa_streamlit.verification import estimate_cost, selected_bbox_in_boundary
+
+log = logging.getLogger(__name__)
+
+
+def prefetch(regions: List[Region], cache_dir: Path) -> int:
+    """Downloads the DEM tiles covering the given regions into the cache directory, e.g. of mountain ranges a
+    deployment expects to be selected frequently.
+
+    Generated archives and intermediate rasters are keyed by the exact geometry, which hand-drawn rectangles never
+    match, hence only the raw DEM tiles are fetched. Conversions of any rectangle within the regions can reuse them.
+    Failing downloads are logged and skipped, as they are retried by the conversions anyway.
+
+    Parameters
+    ----------
+    regions : List[Region]
+        Regions whose DEM tiles are downloaded, their conversion parameters are ignored.
+    cache_dir : Path
+        Cache directory for intermediate files of mapa.
+
+    Returns
+    -------
+    int
+        Number of regions whose DEM tiles are available in the cache directory.
+    """
+    prefetched = 0
+    for region in regions:
+        if not selected_bbox_in_boundary(region.geometry):
+            log.warning(f"⛔️  not prefetching {region.name}: region is not within the allowed coordinate boundaries")
+            continue
+        dem_tiles = estimate_cost(region.geometry).dem_tiles
+        if dem_tiles > MAX_DEM_TILES:
+            log.warning(f"⛔️  not prefetching {region.name}: region covers {dem_tiles} DEM tiles")
+            continue
+        try:
+            download_dem_tiles(region.geometry, cache_dir)
+        except Exception:
+            log.exception(f"❌  prefetching {region.name} failed")
+            continue
+        prefetched += 1
+    log.info(f"🔥  prefetched DEM tiles of {prefetched} of {len(regions)} region(s)")
+    return prefetched
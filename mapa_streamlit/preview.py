@@ -0,0 +1,119 @@
+import logging
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from mapa_streamlit.verification import EARTH_RADIUS, get_bounds
+
+log = logging.getLogger(__name__)
+
+# same collection and STAC API as used by mapa, see `mapa.conf`
+STAC_API_URL = "https://planetarycomputer.microsoft.com/api/stac/v1"
+STAC_COLLECTION = "alos-dem"
+
+
+class Preview(NamedTuple):
+    image: np.ndarray
+    size_x: float
+    size_y: float
+    size_z: float
+
+
+def _get_cached_sources(geo_hash: str, cache_dir: Path) -> List[str]:
+    # the clipped raster of a previous conversion of the same geometry is the cheapest source. It is complete once
+    # the elevation array derived from it exists, as mapa writes it in place.
+    clipped_tiff = cache_dir / f"clipped_{geo_hash}.tiff"
+    elevation_array = cache_dir / f"elevation_{geo_hash}.npy"
+    return [str(clipped_tiff)] if clipped_tiff.is_file() and elevation_array.is_file() else []
+
+
+def _get_stac_sources(bounds: Tuple[float, float, float, float], cache_dir: Path) -> List[str]:
+    # DEM tiles which were already downloaded by mapa are read locally, all others are read remotely. Both are cloud
+    # optimized GeoTIFFs, so a downsampled read only touches their overviews.
+    from planetary_computer import sign_inplace
+    from pystac_client import Client
+
+    client = Client.open(STAC_API_URL, ignore_conformance=True, modifier=sign_inplace)
+    sources = []
+    for item in client.search(collections=[STAC_COLLECTION], bbox=list(bounds)).items():
+        tiff = cache_dir / f"{item.id}.tiff"
+        sources.append(str(tiff) if tiff.is_file() else item.assets["data"].href)
+    return sources
+
+
+def read_heightmap(sources: List[str], bounds: Tuple[float, float, float, float], max_size: int) -> np.ndarray:
+    """Reads the elevation of the given bounds from the given rasters, downsampled so that the larger side of the
+    returned heightmap has `max_size` pixels."""
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.merge import merge
+
+    lon_min, lat_min, lon_max, lat_max = bounds
+    res = max(lon_max - lon_min, lat_max - lat_min) / max_size
+    datasets = [rasterio.open(source) for source in sources]
+    try:
+        mosaic, _ = merge(datasets, bounds=bounds, res=res, resampling=Resampling.average)
+    finally:
+        for dataset in datasets:
+            dataset.close()
+    return mosaic[0].astype(np.float64)
+
+
+def load_heightmap(geometry: dict, geo_hash: str, cache_dir: Path, max_size: int) -> np.ndarray:
+    bounds = tuple(get_bounds(geometry).tolist())
+    sources = _get_cached_sources(geo_hash, cache_dir) or _get_stac_sources(bounds, cache_dir)
+    if not sources:
+        raise ValueError("no elevation data available for the selected region")
+    return read_heightmap(sources, bounds, max_size)
+
+
+def _get_top_edge_length(bounds: Tuple[float, float, float, float]) -> float:
+    # haversine distance in meter along the top edge, as used by mapa for determining the elevation scale
+    lon_min, _, lon_max, lat_max = np.radians(bounds)
+    a = np.cos(lat_max) ** 2 * np.sin((lon_max - lon_min) / 2) ** 2
+    return float(2 * EARTH_RADIUS * 1000 * np.arcsin(np.sqrt(a)))
+
+
+def hillshade(heightmap: np.ndarray, pixel_size: float, azimuth: float = 315.0, altitude: float = 45.0) -> np.ndarray:
+    """Shaded relief of the given heightmap as 8-bit grayscale image, `pixel_size` is given in units of the heights."""
+    dy, dx = np.gradient(heightmap, pixel_size)
+    slope = np.pi / 2 - np.arctan(np.hypot(dx, dy))
+    aspect = np.arctan2(-dx, dy)
+    azimuth, altitude = np.radians(azimuth), np.radians(altitude)
+    shaded = np.sin(altitude) * np.sin(slope) + np.cos(altitude) * np.cos(slope) * np.cos(azimuth - aspect)
+    return (np.clip(shaded, 0, 1) * 255).astype(np.uint8)
+
+
+def create_preview(
+    heightmap: np.ndarray,
+    geometry: dict,
+    z_offset: float,
+    z_scale: float,
+    model_size: int,
+    ensure_squared: bool,
+    split_area_in_tiles: str,
+) -> Preview:
+    """Renders a shaded relief of the model along with its dimensions in millimeter, as it would be generated by mapa
+    with the given parameters. Tile borders are drawn as black lines."""
+    bounds = tuple(get_bounds(geometry).tolist())
+    if ensure_squared:
+        side = min(heightmap.shape)
+        heightmap = heightmap[:side, :side]
+    rows, cols = heightmap.shape
+
+    # same scaling as mapa: the model size refers to the north-south dimension, heights are scaled by the ratio of
+    # the model size and the width of the area in meter
+    elevation_scale = model_size / _get_top_edge_length(bounds)
+    size_x = model_size
+    size_y = model_size if ensure_squared else model_size / rows * cols
+    size_z = (heightmap.max() - heightmap.min()) * elevation_scale * z_scale + z_offset
+
+    # pixel size in the scaled units of the model, so that the relief shows the effect of the z-scale
+    image = hillshade(heightmap * elevation_scale * z_scale, pixel_size=size_x / rows)
+    tiles_x, tiles_y = (int(n) for n in split_area_in_tiles.split("x"))
+    for i in range(1, tiles_x):
+        image[round(i * rows / tiles_x), :] = 0
+    for i in range(1, tiles_y):
+        image[:, round(i * cols / tiles_y)] = 0
+    return Preview(image=image, size_x=round(size_x, 1), size_y=round(size_y, 1), size_z=round(size_z, 1))
@@ -0,0 +1,84 @@
+import cProfile
+import json
+import logging
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Union
+
+log = logging.getLogger(__name__)
+
+# durations in seconds of the stages of the conversion running in this process, None unless they are collected
+_timings: Union[None, Dict[str, float]] = None
+
+
+def path_to_profile(output_file: Union[str, Path]) -> Path:
+    """Path of the profile of the given output without suffix, the timings are stored next to it as json file. The
+    prefix keeps the profile from being taken for the result itself."""
+    output_file = Path(output_file)
+    return output_file.with_name(f"profile_{output_file.name}.prof")
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """Collects the durations of the stages entered within the context into the yielded dict. Nested contexts share
+    the dict of the outermost one."""
+    global _timings
+    if _timings is not None:
+        yield _timings
+        return
+    _timings = {}
+    try:
+        yield _timings
+    finally:
+        _timings = None
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Adds the time spent within the context to the given stage, in case timings are collected. Stages entered
+    several times, e.g. once per tile, are summed up."""
+    if _timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _timings[name] = _timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def run_profiled(function: Callable, profile_file: Union[str, Path], **kwargs):
+    """Calls the function with the given keyword arguments within cProfile and stores the profile along with the
+    timings of the stages, also in case the function fails. Tiles converted in a pool of processes only show up in
+    the timings, as the profiler only covers the calling process.
+
+    Parameters
+    ----------
+    function : Callable
+        Function to be profiled.
+    profile_file : Union[str, Path]
+        Path of the profile, which can be inspected with e.g. `python -m pstats` or snakeviz. The timings are stored
+        as json file of the same name.
+    **kwargs
+        Keyword arguments passed to the function.
+    """
+    profiler = cProfile.Profile()
+    with collect_timings() as stages:
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = profiler.runcall(function, **kwargs)
+            failed = False
+            return result
+        finally:
+            total = time.perf_counter() - start
+            profile_file = Path(profile_file)
+            profiler.dump_stats(profile_file)
+            timings = {
+                "total": round(total, 4),
+                "failed": failed,
+                "stages": {name: round(seconds, 4) for name, seconds in stages.items()},
+            }
+            profile_file.with_suffix(".json").write_text(json.dumps(timings, indent=2))
+            log.info(f"⏱  stored profile {profile_file}, timings: {timings}")
@@ -0,0 +1,64 @@
+from multiprocessing.context import BaseContext
+from threading import Lock
+from typing import List, Union
+
+# shared array of the channel, set in worker processes by `attach`
+_slots = None
+
+
+class ProgressChannel:
+    """Fixed number of progress slots in shared memory, which worker processes write to and the server reads from.
+
+    Each running job holds one slot. Writing to a slot is a plain memory write without any locking or messaging, and
+    readers only see the latest value whenever they look, so any number of updates is coalesced for free and the
+    number of UI updates is bound by the polling interval of the reader instead of the number of progress ticks.
+
+    Parameters
+    ----------
+    slots : int
+        Number of slots, i.e. of jobs which can report their progress at the same time.
+    mp_context : BaseContext
+        Multiprocessing context of the worker processes. The shared array needs to be passed to them when they are
+        started, e.g. via `mapa_streamlit.isolation.run_isolated`, which calls `attach` within the process.
+    """
+
+    def __init__(self, slots: int, mp_context: BaseContext) -> None:
+        self.array = mp_context.RawArray("d", slots)
+        self._free: List[int] = list(range(slots))
+        self._lock = Lock()
+
+    def acquire(self) -> Union[None, int]:
+        """Returns a free slot with its progress reset to 0, or None in case all slots are in use."""
+        with self._lock:
+            if not self._free:
+                return None
+            slot = self._free.pop(0)
+        self.array[slot] = 0.0
+        return slot
+
+    def release(self, slot: Union[None, int]) -> None:
+        if slot is None:
+            return
+        with self._lock:
+            self._free.append(slot)
+
+    def get(self, slot: int) -> float:
+        return self.array[slot]
+
+
+def attach(array) -> None:
+    """Makes the shared array of a progress channel available in a worker process."""
+    global _slots
+    _slots = array
+
+
+class ProgressReporter:
+    """Stand-in for a streamlit progress bar, which is passed to mapa within a worker process and writes the progress
+    into its slot of the progress channel."""
+
+    def __init__(self, slot: int) -> None:
+        self.slot = slot
+
+    def progress(self, value: Union[int, float]) -> None:
+        if _slots is not None:
+            _slots[self.slot] = float(value)
@@ -1,19 +1,89 @@
-from importlib.metadata import version
+import os
+from functools import lru_cache
 from typing import Tuple
 
-from mapa_streamlit import __version__
-
 MAP_CENTER = [25.0, 55.0]
 MAP_ZOOM = 3
 
 BTN_LABEL_CREATE_STL = "Create STL"
 BTN_LABEL_DOWNLOAD_STL = "Download STL"
-
-MAX_ALLOWED_AREA_SIZE = 25.0
-
-DISK_CLEANING_THRESHOLD = 60.0
-
-ABOUT = f"""
+BTN_LABEL_PREVIEW = "Preview"
+
+# number of pixels of the larger side of the heightmap used for previews
+PREVIEW_SIZE = 200
+
+# limits of the estimated cost of a selected area: number of 1° x 1° DEM tiles to be fetched, number of pixels of the
+# clipped elevation raster (25 square degrees at the equator) and total size of the generated STL files in bytes
+MAX_DEM_TILES = 36
+MAX_RASTER_PIXELS = 25 * 3600**2
+MAX_OUTPUT_SIZE = 1024**3
+
+# the limits above are scaled with the load of the server between the floor and the ceiling: up to the low pressure
+# (highest of RAM and CPU usage, running and waiting conversions per worker and recent conversion durations relative
+# to the target duration, 1 meaning full load) they are scaled by the ceiling, from the high pressure on by the floor.
+# The scale only changes by more than the hysteresis and the load is measured at most every LIMIT_UPDATE_INTERVAL
+# seconds.
+LIMIT_SCALE_FLOOR = 0.25
+LIMIT_SCALE_CEILING = 2.0
+LIMIT_LOW_PRESSURE = 0.5
+LIMIT_HIGH_PRESSURE = 0.9
+LIMIT_HYSTERESIS = 0.1
+LIMIT_UPDATE_INTERVAL = 10.0
+LIMIT_TARGET_DURATION = 120.0
+
+# directory holding DEM tiles, intermediate rasters and generated archives, by default the temp directory of mapa.
+# Replicas of the app pointing to the same directory on a shared filesystem reuse each other's files.
+CACHE_DIR = os.getenv("MAPA_STREAMLIT_CACHE_DIR") or None
+
+# size budget of the cache directory in bytes, once exceeded, least recently used files are evicted until the cache
+# shrinks below the low-water mark (fraction of the budget). Files modified within the last CACHE_MIN_AGE seconds are
+# considered in use and are never evicted.
+CACHE_SIZE_BUDGET = int(os.getenv("MAPA_STREAMLIT_CACHE_SIZE_BUDGET", 5 * 1024**3))
+CACHE_LOW_WATER_MARK = 0.8
+CACHE_MIN_AGE = 60.0
+
+# interval in seconds of full background cleanups and of checking whether the cache exceeds its budget in between
+JANITOR_INTERVAL = 600.0
+JANITOR_CHECK_INTERVAL = 30.0
+
+# number of archives held in memory for serving downloads
+DOWNLOAD_CACHE_MAX_ENTRIES = 8
+
+# number of STL conversions running in parallel and interval in seconds in which the sidebar polls their status
+JOB_MAX_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+JOB_POLL_INTERVAL = 1.0
+# converter given as `module:function`, which replaces the conversion by mapa, e.g. by a fake one for load tests
+JOB_CONVERTER = os.getenv("MAPA_STREAMLIT_CONVERTER") or None
+# number of tiles of a tiled conversion which are converted in parallel, so that concurrent conversions share the CPUs
+TILE_MAX_WORKERS = max(1, (os.cpu_count() or 1) // JOB_MAX_WORKERS)
+# maximum number of conversions waiting for a worker, further requests are rejected, and memory in bytes which needs to
+# remain available when starting a conversion in addition to its estimated peak memory
+JOB_MAX_QUEUE_DEPTH = 20
+JOB_MEMORY_HEADROOM = 512 * 1024**2
+# each conversion runs in its own process, whose address space is limited to the base (interpreter, libraries and
+# thread arenas) plus the factor times its estimated peak memory, so that a single conversion cannot exhaust the memory
+JOB_MEMORY_LIMIT_BASE = int(os.getenv("MAPA_STREAMLIT_JOB_MEMORY_LIMIT_BASE", 4 * 1024**3))
+JOB_MEMORY_LIMIT_FACTOR = 2.0
+# number of seconds for which finished and failed jobs are kept, so that sessions can show their outcome
+JOB_TTL = 3600.0
+
+# metrics in the Prometheus text format are served on this port of the given address and/or written to this file every
+# METRICS_FILE_INTERVAL seconds, both are disabled by default
+METRICS_PORT = int(os.getenv("MAPA_STREAMLIT_METRICS_PORT", 0)) or None
+METRICS_ADDRESS = os.getenv("MAPA_STREAMLIT_METRICS_ADDRESS", "127.0.0.1")
+METRICS_FILE = os.getenv("MAPA_STREAMLIT_METRICS_FILE")
+METRICS_FILE_INTERVAL = 15.0
+
+# conversions are profiled and their profile and stage timings are stored next to the result, either all of them or
+# only those requested by sessions opened with the query parameter `?profile=<PROFILE_TOKEN>`, both disabled by default
+PROFILE_JOBS = os.getenv("MAPA_STREAMLIT_PROFILE") == "1"
+PROFILE_TOKEN = os.getenv("MAPA_STREAMLIT_PROFILE_TOKEN") or None
+
+# GeoJSON FeatureCollection of regions, whose DEM tiles are downloaded in the background at server start, e.g. the
+# bundled mapa_streamlit/prefetch.geojson. Prefetching is disabled by default.
+PREFETCH_FILE = os.getenv("MAPA_STREAMLIT_PREFETCH_FILE", "")
+
+ABOUT_TEMPLATE = """
 # mapa 🌍
 Hi my name is Fabian Gebhart :wave: and I am the author of mapa. mapa let's you create 3D-printable STL files
 from every region around the globe. The elevation data is retrieved from
@@ -25,12 +95,22 @@ For more details please refer to:
 * the [mapa-streamlit repo](https://github.com/fgebhart/mapa-streamlit) which contains the source code of this streamlit app or
 * the original [mapa repo](https://github.com/fgebhart/mapa) which contains the source code of the [mapa python package](https://pypi.org/project/mapa/)
 
-Made with mapa-streamlit v{__version__}
+Made with mapa-streamlit v{mapa_streamlit_version}
 
-Made with mapa v{version('mapa')}
+Made with mapa v{mapa_version}
 """
 
 
+@lru_cache(maxsize=None)
+def get_about() -> str:
+    # resolving versions requires reading package metadata, which is deferred until the about page is needed
+    from importlib.metadata import version
+
+    from mapa_streamlit import __version__
+
+    return ABOUT_TEMPLATE.format(mapa_streamlit_version=__version__, mapa_version=version("mapa"))
+
+
 DEFAULT_Z_OFFSET = 2
 DEFAULT_Z_SCALE = 2.0
 DEFAULT_MODEL_SIZE = 100
@@ -38,6 +118,7 @@ DEFAULT_TILING_FORMAT = "1x1"
 
 
 class ZOffsetSlider:
+    key: str = "z_offset"
     label: str = "Z-offset:"
     min_value: int = 0
     max_value: int = 20
@@ -46,6 +127,7 @@ class ZOffsetSlider:
 
 
 class ZScaleSlider:
+    key: str = "z_scale"
     label: str = "Z-scale:"
     min_value: float = 0.0
     max_value: float = 5.0
@@ -55,6 +137,7 @@ class ZScaleSlider:
 
 
 class ModelSizeSlider:
+    key: str = "model_size"
     label: str = "Model size:"
     min_value: int = 10
     max_value: int = 200
@@ -67,7 +150,9 @@ class ModelSizeSlider:
 
 
 class SquaredCheckbox:
+    key: str = "ensure_squared"
     label: str = "Squared model output?"
+    value: bool = False
     help: str = (
         "Enable this to force the computed output STL file to be squared in x and y dimensions. Note, that the "
         "rectangle you selected will be cut to achieve this. This option might be helpful, as drawing a perfect "
@@ -76,10 +161,18 @@ class SquaredCheckbox:
 
 
 class TilingSelect:
+    key: str = "split_area_in_tiles"
     label: str = "Split output STL file in multiple tiles?"
     options: Tuple[str] = (DEFAULT_TILING_FORMAT, "1x2", "2x1", "2x2", "2x3", "3x2", "3x3")
+    value: str = DEFAULT_TILING_FORMAT
     help: str = (
         "Select shape and number of tiles you want the generated output to be spilt into. This is helpful when "
         "aiming for a print larger than the printer area. The first number splits the north-south axis and the "
         "second number splits the west-east axis."
     )
+
+
+def __getattr__(name: str):
+    if name == "ABOUT":
+        return get_about()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
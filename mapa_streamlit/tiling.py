@@ -0,0 +1,164 @@
+import logging
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, List, Union
+
+import numpy as np
+
+from mapa_streamlit.elevation import load_elevation
+from mapa_streamlit.profiling import stage
+
+log = logging.getLogger(__name__)
+
+# share of the progress reported once the raster is fetched, the remaining share is split evenly across the tiles
+PREPARATION_PROGRESS = 10
+
+
+def _convert_tile(
+    array: np.ndarray,
+    desired_size,
+    z_offset: Union[None, float],
+    z_scale: float,
+    elevation_scale: float,
+    output_file: str,
+) -> Path:
+    from mapa import convert_array_to_stl
+
+    return convert_array_to_stl(
+        array=array,
+        as_ascii=False,
+        desired_size=desired_size,
+        max_res=False,
+        z_offset=z_offset,
+        z_scale=z_scale,
+        elevation_scale=elevation_scale,
+        output_file=output_file,
+    )
+
+
+def _convert_tiles(tiles: List[np.ndarray], stl_files: List[Path], convert_tile: Callable, max_workers: int, **kwargs):
+    """Yields the STL files in the order the tiles are finished."""
+    if max_workers == 1 or len(tiles) == 1:
+        for tile, stl_file in zip(tiles, stl_files, strict=True):
+            with stage("meshing"):
+                converted = Path(convert_tile(tile, output_file=str(stl_file), **kwargs))
+            yield converted
+        return
+    # tiles are converted in fresh interpreters, as this function runs within a multi-threaded worker process
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(tiles)), mp_context=mp_context) as executor:
+        futures = [
+            executor.submit(convert_tile, tile, output_file=str(stl_file), **kwargs)
+            for tile, stl_file in zip(tiles, stl_files, strict=True)
+        ]
+        for future in as_completed(futures):
+            # time spent waiting for the next tile, i.e. the meshing which does not overlap with zipping
+            with stage("meshing"):
+                converted = Path(future.result())
+            yield converted
+
+
+def convert_tiles_in_parallel(
+    tiles: List[np.ndarray],
+    convert_tile: Callable,
+    output_file: Union[str, Path],
+    max_workers: int,
+    progress_bar: Union[None, object] = None,
+    **kwargs,
+) -> Path:
+    """Converts each tile into a STL file in a pool of processes and streams the STL files into a zip archive as soon
+    as they are finished, so that compressing overlaps with converting the remaining tiles.
+
+    Parameters
+    ----------
+    tiles : List[np.ndarray]
+        Elevation arrays of the tiles.
+    convert_tile : Callable
+        Function converting a single tile, called with the array, the keyword arguments and the `output_file` of the
+        tile. Needs to be picklable, i.e. defined on module level.
+    output_file : Union[str, Path]
+        Name and path of the output without suffix, tiles are stored as `<output_file>_<i>.stl` in
+        `<output_file>.zip`, the same way as mapa does. A single tile is stored as `<output_file>.stl`.
+    max_workers : int
+        Number of tiles which are converted in parallel. In case of a single worker or tile, the tiles are converted
+        in the calling process.
+    progress_bar : Union[None, object], optional
+        Object with a `progress` method, which is called with the progress in percent after each finished tile.
+    **kwargs
+        Further keyword arguments passed to `convert_tile`.
+
+    Returns
+    -------
+    Path
+        Path to the zip archive.
+    """
+    archive = Path(f"{output_file}.zip")
+    if len(tiles) == 1:
+        stl_files = [Path(f"{output_file}.stl")]
+    else:
+        stl_files = [Path(f"{output_file}_{i + 1}.stl") for i in range(len(tiles))]
+    try:
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            converted = _convert_tiles(tiles, stl_files, convert_tile, max_workers, **kwargs)
+            for done, stl_file in enumerate(converted, start=1):
+                with stage("zipping"):
+                    zip_file.write(stl_file, stl_file.name)
+                stl_file.unlink()
+                log.info(f"📦  added tile {stl_file.name} to archive ({done}/{len(tiles)})")
+                if progress_bar is not None:
+                    progress_bar.progress(PREPARATION_PROGRESS + (100 - PREPARATION_PROGRESS) * done // len(tiles))
+    except BaseException:
+        archive.unlink(missing_ok=True)
+        raise
+    finally:
+        for stl_file in stl_files:
+            stl_file.unlink(missing_ok=True)
+    return archive
+
+
+def convert_bbox_to_stl(
+    bbox_geometry: dict,
+    output_file: Union[str, Path],
+    max_tile_workers: int = 1,
+    model_size: int = 200,
+    z_offset: Union[None, float] = 0.0,
+    z_scale: float = 1.0,
+    ensure_squared: bool = False,
+    split_area_in_tiles: str = "1x1",
+    cache_dir: Union[None, str, Path] = None,
+    progress_bar: Union[None, object] = None,
+) -> Path:
+    """Same as `mapa.convert_bbox_to_stl` with compression enabled, but reuses the elevation array of previous
+    conversions of the same geometry and converts the tiles in parallel. The raster is split exactly like mapa does,
+    and each tile is converted by mapa, so that the output is identical."""
+    from mapa import _get_desired_size
+    from mapa.raster import cut_array_to_square
+    from mapa.tiling import get_x_y_from_tiles_format, split_array_into_tiles
+    from mapa.utils import TMPDIR
+
+    tiles_format = get_x_y_from_tiles_format(split_area_in_tiles)
+    elevation = load_elevation(bbox_geometry, Path(cache_dir or TMPDIR()))
+    with stage("tiling"):
+        array = elevation.array
+        if ensure_squared:
+            array = cut_array_to_square(array)
+        desired_size = _get_desired_size(
+            array=array, x=model_size / tiles_format.x, y=model_size / tiles_format.y, ensure_squared=ensure_squared
+        )
+        tiles = split_array_into_tiles(array, tiles_format)
+    if progress_bar is not None:
+        progress_bar.progress(PREPARATION_PROGRESS)
+
+    return convert_tiles_in_parallel(
+        tiles,
+        _convert_tile,
+        output_file,
+        max_workers=max_tile_workers,
+        progress_bar=progress_bar,
+        desired_size=desired_size,
+        z_offset=z_offset,
+        z_scale=z_scale,
+        elevation_scale=elevation.get_elevation_scale(model_size),
+    )
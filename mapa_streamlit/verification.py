@@ -1,25 +1,139 @@
 import logging
-from math import sqrt
-from typing import List
+from typing import NamedTuple, Union
+
+import numpy as np
 
 log = logging.getLogger(__name__)
 
+EARTH_RADIUS = 6371.0088
+# the ALOS World 3D DEM used by mapa is split into tiles of 1° x 1° with a latitudinal pixel spacing of 1 arcsecond.
+# The longitudinal pixel spacing grows with the latitude, so that pixels keep a roughly constant size on the ground.
+DEM_PIXELS_PER_DEGREE = 3600
+DEM_LON_SPACING_BANDS = np.array([60.0, 70.0, 80.0, 90.0])
+DEM_LON_SPACING = np.array([1, 2, 3, 6])
+# mapa reduces the resolution of each tile to approximately this size, see `mapa.conf.MAXIMUM_RESOLUTION`
+MESH_RESOLUTION = 800
+# binary STL files consist of an 84 byte header and 50 bytes per triangle
+STL_HEADER_SIZE = 84
+STL_TRIANGLE_SIZE = 50
+# approximate peak memory in bytes per pixel of the raster (merged, clipped and converted to an array) and per
+# triangle of the largest tile (computed triangles, stacked copy and STL mesh)
+RASTER_BYTES_PER_PIXEL = 12
+MESH_BYTES_PER_TRIANGLE = 200
+# number of latitudes at which the longitudinal pixel spacing is sampled
+LAT_SAMPLES = 256
 
-def _get_distance(c1: List[float], c2: List[float]) -> float:
-    return sqrt((c1[0] - c2[0]) ** 2 + (c1[1] - c2[1]) ** 2)
 
+class CostEstimate(NamedTuple):
+    area: float
+    dem_tiles: int
+    raster_pixels: int
+    triangles: int
+    output_size: int
+    memory: int
 
-def _get_area(bbox: List[List[float]]) -> float:
-    width = _get_distance(c1=bbox[0], c2=bbox[1])
-    height = _get_distance(c1=bbox[1], c2=bbox[2])
-    return round(abs(width * height), 2)
 
+def get_bounds(geometry: dict) -> np.ndarray:
+    coordinates = np.asarray(geometry["coordinates"][0], dtype=np.float64)
+    return np.concatenate((coordinates.min(axis=0), coordinates.max(axis=0)))
 
-def selected_bbox_too_large(geometry: dict, threshold: float) -> bool:
-    bbox = geometry["coordinates"][0]
-    area = _get_area(bbox=bbox)
-    log.info(f"📏  area with size: {area} was selected, threshold is: {threshold}")
-    return area > threshold
+
+def _get_geodesic_area(lon_min: float, lat_min: float, lon_max: float, lat_max: float) -> float:
+    # area of the spherical rectangle in km²
+    lon_span = np.radians(lon_max - lon_min)
+    return float(EARTH_RADIUS**2 * lon_span * abs(np.sin(np.radians(lat_max)) - np.sin(np.radians(lat_min))))
+
+
+def _get_raster_shape(lon_min: float, lat_min: float, lon_max: float, lat_max: float) -> np.ndarray:
+    rows = (lat_max - lat_min) * DEM_PIXELS_PER_DEGREE
+    # average number of columns across all rows, sampled at evenly spaced latitudes
+    lats = np.abs(np.linspace(lat_min, lat_max, LAT_SAMPLES))
+    spacing = DEM_LON_SPACING[
+        np.minimum(np.searchsorted(DEM_LON_SPACING_BANDS, lats, side="right"), len(DEM_LON_SPACING) - 1)
+    ]
+    cols = ((lon_max - lon_min) * DEM_PIXELS_PER_DEGREE / spacing).mean()
+    return np.maximum(np.round([rows, cols]), 1).astype(np.int64)
+
+
+def _get_split_sizes(length: int, sections: int) -> np.ndarray:
+    # same sizes as numpy.array_split, which is used by mapa for splitting the raster into tiles
+    return length // sections + (np.arange(sections) < length % sections)
+
+
+def _get_triangles_of_tiles(tile_shapes: np.ndarray) -> np.ndarray:
+    # same binning as `mapa.convert_array_to_stl`, each tile is reduced to about MESH_RESOLUTION pixels per side
+    bin_factors = np.round(tile_shapes.sum(axis=1) / MESH_RESOLUTION / 2)
+    bin_factors = np.maximum(bin_factors, 1).astype(np.int64)
+    rows, cols = (tile_shapes // bin_factors[:, np.newaxis]).T
+    # 4 triangles per pixel for the surface, 4 per border pixel for the sides and 2 per border pixel for the bottom
+    return 4 * rows * cols + 6 * (rows + cols) - 2
+
+
+def estimate_cost(
+    geometry: dict, split_area_in_tiles: str = "1x1", ensure_squared: bool = False, parallel_tiles: int = 1, **kwargs
+) -> CostEstimate:
+    """Predicts the resources needed for converting the given geometry into STL files, without fetching any data.
+
+    Parameters
+    ----------
+    geometry : dict
+        GeoJSON geometry of the selected bounding box.
+    split_area_in_tiles : str, optional
+        Tiling format of the output, e.g. "2x3". By default "1x1"
+    ensure_squared : bool, optional
+        Whether the raster is cut to a square before computing the mesh. By default False
+    parallel_tiles : int, optional
+        Number of tiles which are converted at the same time. By default 1
+    **kwargs
+        Further conversion parameters, which do not influence the cost, e.g. the model size only scales the mesh but
+        does not change the number of triangles.
+
+    Returns
+    -------
+    CostEstimate
+        Area on the ground in km², number of DEM tiles to be fetched, number of pixels of the clipped raster,
+        number of triangles of all STL files, their total size in bytes and the peak memory of the conversion in
+        bytes.
+    """
+    lon_min, lat_min, lon_max, lat_max = get_bounds(geometry)
+    dem_tiles = (np.ceil(lon_max) - np.floor(lon_min)) * (np.ceil(lat_max) - np.floor(lat_min))
+
+    shape = _get_raster_shape(lon_min, lat_min, lon_max, lat_max)
+    if ensure_squared:
+        shape = np.repeat(shape.min(), 2)
+
+    tiles_x, tiles_y = (int(n) for n in split_area_in_tiles.split("x"))
+    tile_rows, tile_cols = _get_split_sizes(shape[0], tiles_x), _get_split_sizes(shape[1], tiles_y)
+    tile_shapes = np.stack(np.meshgrid(tile_rows, tile_cols, indexing="ij"), axis=-1).reshape(-1, 2)
+    triangles = _get_triangles_of_tiles(tile_shapes)
+    raster_pixels = int(shape.prod())
+    largest_tiles = np.sort(triangles)[::-1][: max(parallel_tiles, 1)]
+
+    return CostEstimate(
+        area=round(_get_geodesic_area(lon_min, lat_min, lon_max, lat_max), 2),
+        dem_tiles=max(int(dem_tiles), 1),
+        raster_pixels=raster_pixels,
+        triangles=int(triangles.sum()),
+        output_size=int(len(tile_shapes) * STL_HEADER_SIZE + triangles.sum() * STL_TRIANGLE_SIZE),
+        # only the largest tiles which are converted at the same time contribute to the peak memory
+        memory=int(raster_pixels * RASTER_BYTES_PER_PIXEL + largest_tiles.sum() * MESH_BYTES_PER_TRIANGLE),
+    )
+
+
+def selected_bbox_too_expensive(
+    cost: CostEstimate, max_dem_tiles: int, max_raster_pixels: int, max_output_size: int
+) -> Union[None, str]:
+    """Returns the name of the first estimate exceeding its limit or None in case the selected area is affordable."""
+    log.info(f"📏  estimated cost of selected area: {cost}")
+    for name, value, limit in [
+        ("dem_tiles", cost.dem_tiles, max_dem_tiles),
+        ("raster_pixels", cost.raster_pixels, max_raster_pixels),
+        ("output_size", cost.output_size, max_output_size),
+    ]:
+        if value > limit:
+            log.info(f"⛔️  {name} of {value} exceeds limit of {limit}")
+            return name
+    return None
 
 
 class CoordinateBoundaries:
@@ -0,0 +1,112 @@
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Callable, Dict, Union
+
+import pytest
+
+# benchmarks take a while and their timings depend on the machine, hence they only run on demand
+ENABLED = os.getenv("MAPA_STREAMLIT_BENCHMARK") == "1"
+SAVE_BASELINE = os.getenv("MAPA_STREAMLIT_BENCHMARK_SAVE") == "1"
+# a benchmark fails in case it is slower than its baseline by more than this factor
+TOLERANCE = float(os.getenv("MAPA_STREAMLIT_BENCHMARK_TOLERANCE", 3.0))
+# timings of very fast benchmarks are dominated by noise, regressions below this number of seconds are ignored
+MIN_REGRESSION = 0.005
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+BENCHMARK_DIR = Path(__file__).parent
+
+FILE_COUNTS = [1_000, 10_000, 100_000]
+
+_results: Dict[str, float] = {}
+
+
+def pytest_collection_modifyitems(config, items) -> None:
+    if ENABLED:
+        return
+    skip = pytest.mark.skip(reason="benchmarks are only run with MAPA_STREAMLIT_BENCHMARK=1")
+    for item in items:
+        if BENCHMARK_DIR in Path(item.fspath).parents:
+            item.add_marker(skip)
+
+
+def pytest_terminal_summary(terminalreporter) -> None:
+    if not _results:
+        return
+    baseline = _load_baseline()
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(f"{'benchmark':<64} {'seconds':>10} {'baseline':>10} {'ratio':>7}")
+    for name, seconds in sorted(_results.items()):
+        reference = baseline.get(name)
+        ratio = f"{seconds / reference:.2f}" if reference else "-"
+        reference = f"{reference:.5f}" if reference else "-"
+        terminalreporter.write_line(f"{name:<64} {seconds:>10.5f} {reference:>10} {ratio:>7}")
+    if SAVE_BASELINE:
+        BASELINE_FILE.write_text(json.dumps({**baseline, **_results}, indent=2, sort_keys=True) + "\n")
+        terminalreporter.write_line(f"saved baseline to {BASELINE_FILE}")
+
+
+def _load_baseline() -> Dict[str, float]:
+    if not BASELINE_FILE.is_file():
+        return {}
+    return json.loads(BASELINE_FILE.read_text())
+
+
+def measure(func: Callable, setup: Union[None, Callable] = None, rounds: int = 3) -> float:
+    """Returns the fastest of several runs of the given function in seconds, `setup` is run untimed before each."""
+    timings = []
+    for _ in range(rounds):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+@pytest.fixture
+def benchmark(request) -> Callable:
+    """Measures the given function, records the timing under the name of the test and compares it to the baseline."""
+
+    def _benchmark(func: Callable, setup: Union[None, Callable] = None, rounds: int = 3) -> float:
+        seconds = measure(func, setup, rounds)
+        name = request.node.name
+        _results[name] = round(seconds, 6)
+        reference = _load_baseline().get(name)
+        regressed = seconds > reference * TOLERANCE and seconds - reference > MIN_REGRESSION if reference else False
+        if regressed and not SAVE_BASELINE:
+            pytest.fail(f"{name} took {seconds:.5f}s, which is more than {TOLERANCE}x its baseline of {reference:.5f}s")
+        return seconds
+
+    return _benchmark
+
+
+def create_cache_tree(path: Path, number_of_files: int, seed: int = 0) -> Path:
+    """Creates a synthetic cache directory with a realistic mix of files, as written by mapa and the result cache:
+    raw DEM tiles, merged and clipped rasters, STL files and zip archives. Files are sparse, so that their apparent
+    size is realistic without actually consuming disk space."""
+    rng = random.Random(seed)
+    path.mkdir(parents=True, exist_ok=True)
+    now = time.time()
+    for i in range(number_of_files):
+        kind = rng.random()
+        if kind < 0.1:
+            name, size = f"ALPSMLC30_N{i:03d}E{i % 180:03d}_DSM.tiff", 25 * 1024**2
+        elif kind < 0.25:
+            name, size = f"merged_{i:032x}.tiff", 50 * 1024**2
+        elif kind < 0.4:
+            name, size = f"clipped_{i:032x}.tiff", 5 * 1024**2
+        elif kind < 0.7:
+            name, size = f"{i:032x}.stl", 60 * 1024**2
+        elif kind < 0.99:
+            name, size = f"{i:032x}.zip", 15 * 1024**2
+        else:
+            name, size = f"partial_{i:032x}.stl", 30 * 1024**2
+        file = path / name
+        with open(file, "wb") as fp:
+            fp.truncate(size)
+        # spread access and modification times over the last week
+        timestamp = now - rng.uniform(3600, 7 * 24 * 3600)
+        os.utime(file, (timestamp, timestamp))
+    return path
@@ -0,0 +1,83 @@
+import shutil
+from functools import partial
+
+import pytest
+
+from mapa_streamlit.cleaning import (
+    CacheInventory,
+    _delete_files_in_dir,
+    _get_data_size_of_dir,
+    _get_number_of_files_in_dir,
+    evict_lru,
+)
+from tests.benchmarks.conftest import FILE_COUNTS, create_cache_tree, measure
+
+# a linear function takes ~10x longer for 10x the files, anything well beyond indicates super-linear behavior
+MAX_SCALING_FACTOR = 30
+
+
+@pytest.fixture(scope="module", params=FILE_COUNTS, ids=lambda n: f"{n}_files")
+def cache_tree(request, tmp_path_factory):
+    path = create_cache_tree(tmp_path_factory.mktemp("cache"), request.param)
+    yield path
+    shutil.rmtree(path)
+
+
+def test_get_data_size_of_dir(benchmark, cache_tree) -> None:
+    benchmark(lambda: _get_data_size_of_dir(cache_tree))
+
+
+def test_get_number_of_files_in_dir(benchmark, cache_tree) -> None:
+    benchmark(lambda: _get_number_of_files_in_dir(cache_tree, ".stl"))
+
+
+def test_cache_inventory__refresh(benchmark, cache_tree) -> None:
+    benchmark(lambda: CacheInventory(cache_tree))
+
+
+def test_cache_inventory__sync(benchmark, cache_tree) -> None:
+    inventory = CacheInventory(cache_tree)
+    benchmark(inventory.sync)
+
+
+def test_delete_files_in_dir(benchmark, cache_tree) -> None:
+    partial_files = [f.name for f in cache_tree.iterdir() if f.name.startswith("partial_")]
+
+    def _create_partial_files() -> None:
+        for name in partial_files:
+            (cache_tree / name).touch()
+
+    benchmark(lambda: _delete_files_in_dir(cache_tree, ".stl", name_prefix="partial_"), setup=_create_partial_files)
+    _create_partial_files()
+
+
+@pytest.mark.parametrize("number_of_files", FILE_COUNTS, ids=lambda n: f"{n}_files")
+def test_evict_lru(benchmark, tmp_path, number_of_files) -> None:
+    inventory = None
+
+    def _setup() -> None:
+        nonlocal inventory
+        path = tmp_path / "cache"
+        shutil.rmtree(path, ignore_errors=True)
+        inventory = CacheInventory(create_cache_tree(path, number_of_files))
+
+    # evict half of the cache
+    benchmark(lambda: evict_lru(inventory, inventory.size // 2, 1.0, min_age=60), setup=_setup, rounds=1)
+
+
+@pytest.mark.parametrize(
+    "func",
+    [
+        lambda path: _get_data_size_of_dir(path),
+        lambda path: _delete_files_in_dir(path, ".stl", name_prefix="partial_"),
+        lambda path: CacheInventory(path),
+        lambda path: evict_lru(CacheInventory(path), CacheInventory(path).size // 2, 1.0, min_age=60),
+    ],
+    ids=["get_data_size_of_dir", "delete_files_in_dir", "cache_inventory", "evict_lru"],
+)
+def test_scales_linearly(func, tmp_path) -> None:
+    timings = []
+    for number_of_files in (1_000, 10_000):
+        path = tmp_path / str(number_of_files)
+        timings.append(measure(partial(func, path), setup=partial(create_cache_tree, path, number_of_files), rounds=1))
+    assert timings[1] / timings[0] < MAX_SCALING_FACTOR
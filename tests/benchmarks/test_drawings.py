@@ -0,0 +1,46 @@
+from functools import partial
+
+import pytest
+
+from mapa_streamlit.drawings import DrawingIndex
+from tests.benchmarks.conftest import measure
+from tests.helpers import rectangle
+
+HISTORY_LENGTHS = [100, 1_000, 10_000]
+
+
+def _get_drawings(n: int) -> list:
+    return [rectangle(i % 360 - 180, i / 360 % 180 - 90) for i in range(n)]
+
+
+@pytest.mark.parametrize("length", HISTORY_LENGTHS, ids=lambda n: f"{n}_drawings")
+def test_drawing_index__update_without_new_drawing(benchmark, length) -> None:
+    # the common case: a rerun which was not triggered by drawing a new rectangle
+    drawings = _get_drawings(length)
+    index = DrawingIndex()
+    index.update(drawings)
+    benchmark(lambda: index.update(drawings))
+
+
+@pytest.mark.parametrize("length", HISTORY_LENGTHS[:2], ids=lambda n: f"{n}_drawings")
+def test_drawing_index__replay_history(benchmark, length) -> None:
+    # a user drawing one rectangle after another, st_folium always returns all drawings of the map
+    drawings = _get_drawings(length)
+
+    def _replay() -> None:
+        index = DrawingIndex()
+        for i in range(1, length + 1):
+            index.update(drawings[:i])
+
+    benchmark(_replay, rounds=1)
+
+
+def test_drawing_index__scales_linearly() -> None:
+    timings = []
+    # larger histories no longer fit into the CPU caches, which would be measured in addition to the algorithm
+    for length in HISTORY_LENGTHS[:2]:
+        drawings = _get_drawings(length)
+        index = DrawingIndex()
+        index.update(drawings)
+        timings.append(measure(partial(index.update, drawings), rounds=10))
+    assert timings[1] / timings[0] < 15
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from mapa_streamlit.settings import MAX_DEM_TILES, MAX_OUTPUT_SIZE, MAX_RASTER_PIXELS
+from mapa_streamlit.verification import estimate_cost, selected_bbox_in_boundary, selected_bbox_too_expensive
+
+NUMBER_OF_GEOMETRIES = 5_000
+
+
+@pytest.fixture(scope="module")
+def geometries():
+    rng = np.random.default_rng(0)
+    lon_min = rng.uniform(-200, 170, NUMBER_OF_GEOMETRIES)
+    lat_min = rng.uniform(-90, 80, NUMBER_OF_GEOMETRIES)
+    # mostly small selections, some of them too large
+    width, height = rng.exponential(1.0, (2, NUMBER_OF_GEOMETRIES))
+    return [
+        {
+            "type": "Polygon",
+            "coordinates": [[[x0, y0], [x0, y0 + h], [x0 + w, y0 + h], [x0 + w, y0], [x0, y0]]],
+        }
+        for x0, y0, w, h in zip(lon_min.tolist(), lat_min.tolist(), width.tolist(), height.tolist(), strict=True)
+    ]
+
+
+@pytest.mark.parametrize("tiling", ["1x1", "3x3"])
+def test_estimate_cost(benchmark, geometries, tiling) -> None:
+    benchmark(lambda: [estimate_cost(g, split_area_in_tiles=tiling) for g in geometries])
+
+
+def test_selected_bbox_too_expensive(benchmark, geometries) -> None:
+    costs = [estimate_cost(g) for g in geometries]
+    benchmark(
+        lambda: [selected_bbox_too_expensive(c, MAX_DEM_TILES, MAX_RASTER_PIXELS, MAX_OUTPUT_SIZE) for c in costs]
+    )
+
+
+def test_selected_bbox_in_boundary(benchmark, geometries) -> None:
+    benchmark(lambda: [selected_bbox_in_boundary(g) for g in geometries])
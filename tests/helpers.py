@@ -0,0 +1,63 @@
+import time
+from pathlib import Path
+
+import numpy as np
+
+from mapa_streamlit.jobs import Job, JobManager
+
+PARAMS = {
+    "z_offset": 2,
+    "z_scale": 2.0,
+    "model_size": 100,
+    "ensure_squared": False,
+    "split_area_in_tiles": "1x1",
+}
+
+
+def get_bbox(lon_min: float, lat_min: float, lon_max: float, lat_max: float) -> dict:
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [[lon_min, lat_min], [lon_min, lat_max], [lon_max, lat_max], [lon_max, lat_min], [lon_min, lat_min]]
+        ],
+    }
+
+
+def rectangle(lon: float, lat: float) -> dict:
+    # feature of a rectangle of one square degree, as drawn on the map
+    return {
+        "type": "Feature",
+        "properties": {},
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[lon, lat], [lon, lat + 1], [lon + 1, lat + 1], [lon + 1, lat], [lon, lat]]],
+        },
+    }
+
+
+def fake_convert_bbox_to_stl(output_file: Path, duration: float = 0.0, fail: bool = False, **kwargs) -> Path:
+    # converters run in worker processes, hence they need to be importable from a module which is not a test module
+    output_file = Path(f"{output_file}.zip")
+    output_file.write_text("partial")
+    time.sleep(duration)
+    if fail:
+        raise ValueError("conversion failed")
+    output_file.write_text("foo")
+    return output_file
+
+
+def fake_convert_tile(array: np.ndarray, output_file: str, fail_on: int = -1, **kwargs) -> Path:
+    if array[0, 0] == fail_on:
+        raise ValueError("conversion failed")
+    output_file = Path(output_file)
+    output_file.write_bytes(array.tobytes())
+    return output_file
+
+
+def wait_for(manager: JobManager, job_id: str, timeout: float = 30.0) -> Job:
+    start = time.time()
+    while manager.get(job_id).active:
+        if time.time() - start > timeout:
+            raise TimeoutError(f"job {job_id} did not finish within {timeout}s")
+        time.sleep(0.05)
+    return manager.get(job_id)
@@ -0,0 +1,45 @@
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+# load tests run many app sessions for a while and depend on the machine, hence they only run on demand
+ENABLED = os.getenv("MAPA_STREAMLIT_LOAD_TEST") == "1"
+# number of simultaneous sessions and timeout in seconds of each session
+SESSIONS = int(os.getenv("MAPA_STREAMLIT_LOAD_TEST_SESSIONS", 50))
+SESSION_TIMEOUT = float(os.getenv("MAPA_STREAMLIT_LOAD_TEST_TIMEOUT", 300.0))
+LOAD_TEST_DIR = Path(__file__).parent
+
+_report: Dict[str, object] = {}
+
+
+def pytest_collection_modifyitems(config, items) -> None:
+    if ENABLED:
+        return
+    skip = pytest.mark.skip(reason="load tests are only run with MAPA_STREAMLIT_LOAD_TEST=1")
+    for item in items:
+        if LOAD_TEST_DIR in Path(item.fspath).parents:
+            item.add_marker(skip)
+
+
+def record(latencies: Dict[str, List[float]], outcomes: Dict[str, int], wall_time: float, peak_rss: int) -> None:
+    _report.update(latencies=latencies, outcomes=outcomes, wall_time=wall_time, peak_rss=peak_rss)
+
+
+def pytest_terminal_summary(terminalreporter) -> None:
+    if not _report:
+        return
+    terminalreporter.section("load test")
+    terminalreporter.write_line(f"{'interaction':<16} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, latencies in _report["latencies"].items():
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (np.nan,) * 3
+        terminalreporter.write_line(f"{name:<16} {len(latencies):>7} {p50:>7.3f}s {p95:>7.3f}s {p99:>7.3f}s")
+    outcomes = _report["outcomes"]
+    wall_time = _report["wall_time"]
+    terminalreporter.write_line(", ".join(f"{state}: {count}" for state, count in sorted(outcomes.items())))
+    terminalreporter.write_line(
+        f"throughput: {outcomes.get('done', 0) / wall_time * 60:.2f} conversions/min in {wall_time:.1f}s, "
+        f"peak server RSS: {_report['peak_rss'] / 1024**2:.0f} MB"
+    )
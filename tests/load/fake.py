@@ -0,0 +1,25 @@
+import os
+import time
+import zipfile
+from pathlib import Path
+
+# duration in seconds and memory in bytes of each fake conversion, read on every call, so that they are picked up by
+# worker processes started after changing them
+DURATION_ENV = "MAPA_STREAMLIT_FAKE_DURATION"
+MEMORY_ENV = "MAPA_STREAMLIT_FAKE_MEMORY"
+
+
+def convert_bbox_to_stl(output_file: Path, progress_bar=None, **kwargs) -> Path:
+    """Deterministic stand-in for the conversion by mapa, which holds the configured amount of memory for the
+    configured duration, reports its progress and writes a small archive."""
+    duration = float(os.getenv(DURATION_ENV, 1.0))
+    memory = bytearray(b"\x01") * int(os.getenv(MEMORY_ENV, 0))
+    steps = 10
+    for i in range(steps):
+        time.sleep(duration / steps)
+        if progress_bar is not None:
+            progress_bar.progress((i + 1) * 100 // steps)
+    output_file = Path(f"{output_file}.zip")
+    with zipfile.ZipFile(output_file, "w") as zip_file:
+        zip_file.writestr(f"{Path(output_file).stem}.stl", f"solid fake\n{len(memory)}\nendsolid fake\n")
+    return output_file
@@ -0,0 +1,168 @@
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Dict, List, Tuple
+
+import psutil
+import pytest
+import streamlit as st
+import streamlit_folium
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import magic
+from streamlit.testing.v1 import AppTest, app_test
+from streamlit.testing.v1.util import patch_config_options
+
+from mapa_streamlit import caching, jobs, settings
+from tests.helpers import rectangle
+from tests.load import fake
+from tests.load.conftest import SESSION_TIMEOUT, SESSIONS, record
+
+APP_FILE = Path(__file__).parents[2] / "app.py"
+DRAWINGS_KEY = "load_test_drawings"
+_parse_lock = Lock()
+_add_magic = magic.add_magic
+
+
+def _st_folium(m, key: str, **kwargs) -> dict:
+    # the map is rendered by the browser, which is not part of the load test, drawings are injected per session
+    return {"all_drawings": st.session_state.get(DRAWINGS_KEY)}
+
+
+def _add_magic_serialized(code: str, script_path: str):
+    # each app test compiles the script on its first run, and parsing in many threads at once trips over the
+    # recursion check of the ast module in python 3.11. A server compiles the script only once, so this is not measured.
+    with _parse_lock:
+        return _add_magic(code, script_path)
+
+
+class _SharedRuntime:
+    """Each app test installs a mock runtime and its config globally while it runs and removes them afterwards, which
+    breaks the runs of concurrent sessions. Instead, the first mock runtime and the config are kept for all sessions,
+    same as a server shares them across sessions.
+    """
+
+    def __init__(self) -> None:
+        self.runtime = None
+
+    def instance(self, cls) -> Runtime:
+        if cls._instance is not None and self.runtime is None:
+            self.runtime = cls._instance
+        if self.runtime is None:
+            raise RuntimeError("Runtime hasn't been created!")
+        return self.runtime
+
+    def exists(self, cls) -> bool:
+        return cls._instance is not None or self.runtime is not None
+
+
+class _RssSampler(Thread):
+    """Samples the resident memory of this process, which acts as server, including all its worker processes."""
+
+    def __init__(self, interval: float = 0.1) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self._stopped = Event()
+
+    def run(self) -> None:
+        process = psutil.Process()
+        while not self._stopped.is_set():
+            rss = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            self.peak = max(self.peak, rss)
+            self._stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def _get_outcome(at: AppTest) -> str:
+    texts = [e.value for e in (*at.success, *at.error)]
+    if any(text.startswith("Successfully computed") for text in texts):
+        return "done"
+    if any(text.startswith("Too many STL files") for text in texts):
+        return "rejected"
+    if any(text.startswith("Computing STL file failed") for text in texts):
+        return "failed"
+    return "pending"
+
+
+def _run_session(i: int) -> Tuple[str, Dict[str, List[float]]]:
+    """A user drawing a rectangle, creating the STL file and waiting for it, while the sidebar polls the status."""
+    latencies = defaultdict(list)
+    at = AppTest.from_file(str(APP_FILE), default_timeout=SESSION_TIMEOUT)
+    at.session_state[DRAWINGS_KEY] = [rectangle(5.0 + i % 20 * 0.5, 44.0 + i // 20 * 0.5)]
+
+    def _interact(name: str, action) -> None:
+        start = time.perf_counter()
+        action()
+        latencies[name].append(time.perf_counter() - start)
+        assert not at.exception, [e.value for e in at.exception]
+
+    _interact("load", at.run)
+    _interact("create", lambda: at.button(key="create_stl").click().run())
+    deadline = time.time() + SESSION_TIMEOUT
+    while _get_outcome(at) == "pending" and time.time() < deadline:
+        time.sleep(settings.JOB_POLL_INTERVAL)
+        _interact("poll", at.run)
+    return _get_outcome(at), latencies
+
+
+@pytest.fixture
+def fake_server(monkeypatch, tmp_path):
+    """Runs the app against a fake converter and a fresh cache directory, without prefetching."""
+    managers = []
+
+    class _JobManager(jobs.JobManager):
+        def __init__(self, *args, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+            managers.append(self)
+
+    monkeypatch.setattr(settings, "JOB_CONVERTER", f"{fake.__name__}:convert_bbox_to_stl")
+    monkeypatch.setattr(settings, "PREFETCH_FILE", None)
+    monkeypatch.setattr(caching, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "JobManager", _JobManager)
+    monkeypatch.setattr(streamlit_folium, "st_folium", _st_folium)
+    monkeypatch.setattr(magic, "add_magic", _add_magic_serialized)
+    shared_runtime = _SharedRuntime()
+    monkeypatch.setattr(Runtime, "instance", classmethod(shared_runtime.instance))
+    monkeypatch.setattr(Runtime, "exists", classmethod(shared_runtime.exists))
+    monkeypatch.setattr(app_test, "patch_config_options", lambda overrides: nullcontext())
+    monkeypatch.setitem(os.environ, fake.DURATION_ENV, os.getenv(fake.DURATION_ENV, "5.0"))
+    monkeypatch.setitem(os.environ, fake.MEMORY_ENV, os.getenv(fake.MEMORY_ENV, str(50 * 1024**2)))
+    st.cache_resource.clear()
+    with patch_config_options({"global.appTest": True}):
+        yield
+    for manager in managers:
+        manager.shutdown(wait=False)
+    st.cache_resource.clear()
+
+
+def test_app__concurrent_sessions(fake_server) -> None:
+    sampler = _RssSampler()
+    sampler.start()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=SESSIONS) as executor:
+        results = list(executor.map(_run_session, range(SESSIONS)))
+    wall_time = time.time() - start
+    sampler.stop()
+
+    latencies = defaultdict(list)
+    for _, session_latencies in results:
+        for name, values in session_latencies.items():
+            latencies[name].extend(values)
+    outcomes = Counter(outcome for outcome, _ in results)
+    record(dict(latencies), dict(outcomes), wall_time, sampler.peak)
+
+    # users are either served or told to come back later, but no session fails or hangs
+    assert set(outcomes) <= {"done", "rejected"}
+    assert outcomes["done"] >= min(SESSIONS, settings.JOB_MAX_QUEUE_DEPTH)
@@ -0,0 +1,86 @@
+import json
+
+from mapa_streamlit.batch import PARAM_NAMES, Region, RegionState, format_summary, load_regions, main, run_batch
+from mapa_streamlit.caching import ResultCache, get_cache_key, get_hash_of_geojson
+from tests.helpers import PARAMS, fake_convert_bbox_to_stl, get_bbox
+
+
+def _write_feature_collection(path, features):
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    return path
+
+
+def test_load_regions(tmp_path) -> None:
+    input_file = _write_feature_collection(
+        tmp_path / "regions.geojson",
+        [
+            {"type": "Feature", "properties": {"name": "Black Forest"}, "geometry": get_bbox(8.0, 48.0, 8.1, 48.1)},
+            {"type": "Feature", "properties": {"z_scale": 3.0}, "geometry": get_bbox(9.0, 48.0, 9.1, 48.1)},
+        ],
+    )
+    regions = load_regions(input_file, PARAMS)
+    assert [r.name for r in regions] == ["Black_Forest", "region_2"]
+    assert regions[0].params == PARAMS
+    assert regions[1].params == {**PARAMS, "z_scale": 3.0}
+    assert set(PARAM_NAMES) == set(PARAMS)
+
+
+def test_run_batch(tmp_path) -> None:
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    output_dir = tmp_path / "output"
+    regions = [
+        Region(name="foo", geometry=get_bbox(8.0, 48.0, 8.1, 48.1), params=PARAMS),
+        Region(name="baa", geometry=get_bbox(9.0, 48.0, 9.1, 48.1), params=PARAMS),
+        Region(name="too_large", geometry=get_bbox(0.0, 0.0, 20.0, 20.0), params=PARAMS),
+        Region(name="out_of_bounds", geometry=get_bbox(190.0, 48.0, 190.1, 48.1), params=PARAMS),
+    ]
+    # the second region was already computed, e.g. by the web app
+    cache_key = get_cache_key(get_hash_of_geojson(regions[1].geometry), PARAMS)
+    (cache_dir / f"{cache_key}.zip").write_text("cached")
+
+    results = run_batch(
+        regions,
+        cache_dir=cache_dir,
+        max_workers=2,
+        output_dir=output_dir,
+        converter=fake_convert_bbox_to_stl,
+        poll_interval=0.05,
+    )
+    assert [r.state for r in results] == [
+        RegionState.DONE,
+        RegionState.CACHED,
+        RegionState.REJECTED,
+        RegionState.REJECTED,
+    ]
+    assert "dem_tiles" in results[2].error
+    assert "boundaries" in results[3].error
+    assert (output_dir / "foo.zip").read_text() == "foo"
+    assert (output_dir / "baa.zip").read_text() == "cached"
+
+    # the result of the first region is available to the web app
+    cache_key = get_cache_key(get_hash_of_geojson(regions[0].geometry), PARAMS)
+    assert ResultCache(cache_dir).lookup(cache_key) is not None
+
+    summary = format_summary(results, wall_time=2.0)
+    assert "2/4 regions succeeded in 2.00s, throughput: 60.00 regions/min" in summary
+
+
+def test_run_batch__missing_cache_dir(tmp_path) -> None:
+    cache_dir = tmp_path / "missing" / "cache"
+    regions = [Region(name="foo", geometry=get_bbox(8.0, 48.0, 8.1, 48.1), params=PARAMS)]
+
+    results = run_batch(
+        regions, cache_dir=cache_dir, max_workers=1, converter=fake_convert_bbox_to_stl, poll_interval=0.05
+    )
+    assert results[0].state == RegionState.DONE, results[0].error
+    assert results[0].output_file.parent == cache_dir
+
+
+def test_main(tmp_path, capsys) -> None:
+    input_file = _write_feature_collection(
+        tmp_path / "regions.geojson",
+        [{"type": "Feature", "properties": {}, "geometry": get_bbox(0.0, 0.0, 20.0, 20.0)}],
+    )
+    assert main([str(input_file), "--cache-dir", str(tmp_path)]) == 1
+    assert "0/1 regions succeeded" in capsys.readouterr().out
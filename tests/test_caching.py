@@ -0,0 +1,111 @@
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from mapa_streamlit.caching import MANIFEST_FILE_NAME, ResultCache, file_lock, get_cache_key
+from mapa_streamlit.jobs import _run_job
+from tests.helpers import PARAMS
+
+
+def test_get_cache_key() -> None:
+    key = get_cache_key("foo", PARAMS)
+    assert key == get_cache_key("foo", dict(reversed(PARAMS.items())))
+    assert key != get_cache_key("baa", PARAMS)
+
+    # changing any of the parameters results in a different key
+    for name, value in [
+        ("z_offset", 3),
+        ("z_scale", 2.1),
+        ("model_size", 101),
+        ("ensure_squared", True),
+        ("split_area_in_tiles", "2x2"),
+    ]:
+        assert key != get_cache_key("foo", {**PARAMS, name: value})
+
+    # float noise does not lead to different keys
+    assert key == get_cache_key("foo", {**PARAMS, "z_scale": 2.0000000001})
+
+
+def test_result_cache(tmp_path) -> None:
+    cache = ResultCache(tmp_path)
+    key = get_cache_key("foo", PARAMS)
+    assert cache.path_for(key) == tmp_path / key
+    assert cache.lookup(key) is None
+    assert cache.entry(key) is None
+
+    archive = tmp_path / f"{key}.zip"
+    archive.write_text("foo")
+    assert cache.lookup(key) == archive
+    assert cache.entry(key)["hits"] == 0
+    assert cache.entry(key)["size"] == 3
+
+    assert cache.lookup(key, record_hit=True) == archive
+    assert cache.lookup(key, record_hit=True) == archive
+    assert cache.entry(key)["hits"] == 2
+
+    # manifest is persisted and picked up by new instances
+    manifest = json.loads((tmp_path / MANIFEST_FILE_NAME).read_text())
+    assert manifest[key]["hits"] == 2
+    assert ResultCache(tmp_path).entry(key)["hits"] == 2
+
+    # entries of deleted archives are dropped
+    archive.unlink()
+    assert cache.lookup(key) is None
+    assert cache.entry(key) is None
+
+
+def test_result_cache__corrupt_manifest(tmp_path) -> None:
+    (tmp_path / MANIFEST_FILE_NAME).write_text("{")
+    cache = ResultCache(tmp_path)
+    assert cache.entry("foo") is None
+
+
+def test_file_lock(tmp_path) -> None:
+    with file_lock(tmp_path, "results", "foo") as acquired:
+        assert acquired
+        # held by another open file, i.e. by another process in practice
+        with file_lock(tmp_path, "results", "foo", blocking=False) as acquired_again:
+            assert not acquired_again
+        # other namespaces are independent
+        with file_lock(tmp_path, "rasters", "foo", blocking=False) as acquired_other:
+            assert acquired_other
+    with file_lock(tmp_path, "results", "foo", blocking=False) as acquired:
+        assert acquired
+
+
+def _record_hits(path: Path, key: str, hits: int) -> None:
+    cache = ResultCache(path)
+    for _ in range(hits):
+        cache.lookup(key, record_hit=True)
+
+
+def _counting_converter(output_file: Path, counter_file: Path) -> Path:
+    with open(counter_file, "a") as f:
+        f.write("converted\n")
+    time.sleep(0.5)
+    output_file = Path(f"{output_file}.zip")
+    output_file.write_text("foo")
+    return output_file
+
+
+def _convert(output_file: Path, counter_file: Path) -> Path:
+    result, _, _ = _run_job(_counting_converter, {"output_file": output_file, "counter_file": counter_file})
+    return result
+
+
+def test_shared_cache_dir__two_processes(tmp_path) -> None:
+    key = get_cache_key("foo", PARAMS)
+    (tmp_path / f"{key}.zip").write_text("foo")
+    counter_file = tmp_path / "counter.txt"
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")) as executor:
+        # updates of the manifest by both processes are merged instead of overwriting each other
+        for future in [executor.submit(_record_hits, tmp_path, key, 20) for _ in range(2)]:
+            future.result()
+        assert ResultCache(tmp_path).entry(key)["hits"] == 40
+
+        # the same archive is converted only once, the second process picks up the result of the first one
+        futures = [executor.submit(_convert, tmp_path / "baa", counter_file) for _ in range(2)]
+        assert [future.result() for future in futures] == [tmp_path / "baa.zip"] * 2
+    assert counter_file.read_text() == "converted\n"
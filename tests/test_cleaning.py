@@ -1,10 +1,19 @@
+import os
+import time
+from pathlib import Path
+
 from mapa_streamlit.cleaning import (
+    CacheInventory,
+    Janitor,
     _delete_files_in_dir,
     _get_data_size_of_dir,
     _get_disk_usage,
+    _get_eviction_tier,
     _get_number_of_files_in_dir,
+    evict_lru,
     run_cleanup_job,
 )
+from mapa_streamlit.metrics import COMPUTE_STAGE_SECONDS
 
 
 def test__get_disk_usage():
@@ -93,7 +102,7 @@ def test__get_number_of_files_in_dir(tmp_path) -> None:
 
 
 def test_run_cleanup_job(tmp_path) -> None:
-    # chose very low threshold to ensure files will be delted
+    # chose a budget of zero to ensure all files will be deleted
     stl = tmp_path / "baa.stl"
     stl.write_text("foo")
     assert stl.is_file()
@@ -103,13 +112,19 @@ def test_run_cleanup_job(tmp_path) -> None:
     zip = tmp_path / "baz.zip"
     zip.write_text("foo")
     assert zip.is_file()
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text("{}")
 
-    run_cleanup_job(tmp_path, disk_cleaning_threshold=0.0)
+    stats = run_cleanup_job(tmp_path, cache_size_budget=0, low_water_mark=0.8)
+    assert stats.freed == 9
+    assert stats.cache_size == 2
     assert not stl.is_file()
-    assert tiff.is_file()
+    assert not tiff.is_file()
     assert not zip.is_file()
+    # files which do not belong to any tier are never evicted
+    assert manifest.is_file()
 
-    # chose very high threshold to check that files won't get deleted
+    # chose very high budget to check that files won't get deleted
     stl = tmp_path / "baa.stl"
     stl.write_text("foo")
     assert stl.is_file()
@@ -117,6 +132,242 @@ def test_run_cleanup_job(tmp_path) -> None:
     tiff.write_text("foo")
     assert tiff.is_file()
 
-    run_cleanup_job(tmp_path, disk_cleaning_threshold=100.0)
+    stats = run_cleanup_job(tmp_path, cache_size_budget=1024**3, low_water_mark=0.8)
+    assert stats.freed == 0
+    assert stats.cache_size == 8
     assert stl.is_file()
     assert tiff.is_file()
+
+
+def test__get_eviction_tier() -> None:
+    assert _get_eviction_tier(Path("foo.stl")) == 0
+    assert _get_eviction_tier(Path("foo.zip")) == 0
+    assert _get_eviction_tier(Path("profile_foo.prof")) == 0
+    assert _get_eviction_tier(Path("profile_foo.json")) == 0
+    assert _get_eviction_tier(Path("merged_foo.tiff")) == 1
+    assert _get_eviction_tier(Path("clipped_foo.tiff")) == 1
+    assert _get_eviction_tier(Path("elevation_foo.npy")) == 1
+    assert _get_eviction_tier(Path("elevation_foo.json")) == 1
+    assert _get_eviction_tier(Path("ALPSMLC30_N047E008_DSM.tiff")) == 2
+    assert _get_eviction_tier(Path("manifest.json")) is None
+    assert _get_eviction_tier(Path("partial_abc_foo.zip")) is None
+    assert _get_eviction_tier(Path("partial_abc_foo.zip_1.stl")) is None
+    assert _get_eviction_tier(Path("elevation_foo.123.tmp.npy")) is None
+    assert _get_eviction_tier(Path("ALPSMLC30_N047E008_DSM.123.tmp")) is None
+
+
+def _write_file(path: Path, size: int, atime: float) -> Path:
+    path.write_bytes(b"\0" * size)
+    os.utime(path, (atime, 0))
+    return path
+
+
+def test_evict_lru(tmp_path) -> None:
+    raw_tile = _write_file(tmp_path / "tile.tiff", 100, atime=1)
+    clipped_tiff = _write_file(tmp_path / "clipped_foo.tiff", 100, atime=2)
+    old_zip = _write_file(tmp_path / "old.zip", 100, atime=3)
+    new_zip = _write_file(tmp_path / "new.zip", 100, atime=4)
+    inventory = CacheInventory(tmp_path)
+    assert inventory.size == 400
+
+    # nothing happens while the cache is within budget
+    assert evict_lru(inventory, cache_size_budget=400, low_water_mark=0.5, min_age=0) == 0
+    assert inventory.size == 400
+
+    # least recently used zip gets evicted first, although the raw tile was accessed longer ago
+    assert evict_lru(inventory, cache_size_budget=399, low_water_mark=0.9, min_age=0) == 100
+    assert not old_zip.is_file()
+    assert new_zip.is_file()
+    assert inventory.size == 300
+
+    # tiers are exhausted before continuing with the next one
+    assert evict_lru(inventory, cache_size_budget=299, low_water_mark=0.5, min_age=0) == 200
+    assert not new_zip.is_file()
+    assert not clipped_tiff.is_file()
+    assert raw_tile.is_file()
+    assert inventory.size == 100
+
+    # recently modified files are considered in use
+    _write_file(tmp_path / "running.zip", 100, atime=5)
+    os.utime(tmp_path / "running.zip")
+    inventory.sync()
+    assert evict_lru(inventory, cache_size_budget=0, low_water_mark=0.5, min_age=60) == 100
+    assert not raw_tile.is_file()
+    assert (tmp_path / "running.zip").is_file()
+
+
+def test_evict_lru__keeps_files_in_progress(tmp_path) -> None:
+    partial_zip = _write_file(tmp_path / "partial_abc_foo.zip", 100, atime=1)
+    tmp_array = _write_file(tmp_path / "elevation_foo.123.tmp.npy", 100, atime=1)
+    old_zip = _write_file(tmp_path / "old.zip", 100, atime=2)
+    # partial files of long running conversions are older than the minimum age, but still in use
+    for file in (partial_zip, tmp_array, old_zip):
+        os.utime(file, (1, 1))
+    inventory = CacheInventory(tmp_path)
+
+    assert evict_lru(inventory, cache_size_budget=0, low_water_mark=0.5, min_age=60) == 100
+    assert not old_zip.is_file()
+    assert partial_zip.is_file()
+    assert tmp_array.is_file()
+    assert inventory.size == 200
+
+
+def test_cache_inventory(tmp_path) -> None:
+    inventory = CacheInventory(tmp_path)
+    assert inventory.size == 0
+    assert inventory.count(".stl") == 0
+
+    stl = tmp_path / "baa.stl"
+    stl.write_text("foo")
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    tiff = sub / "baa.tiff"
+    tiff.write_text("foobar")
+
+    # a fresh inventory picks up files of nested dirs with a single scan
+    inventory = CacheInventory(tmp_path)
+    assert inventory.size == 9
+    assert inventory.size_mb == round(9 / 1024**2, 4)
+    assert inventory.count(".stl") == 1
+    assert inventory.count(".tiff") == 1
+    assert set(inventory.files()) == {stl, tiff}
+
+    # explicit updates
+    zip = tmp_path / "baz.zip"
+    zip.write_text("foo")
+    inventory.add(zip)
+    assert inventory.count(".zip") == 1
+    assert inventory.size == 12
+    zip.unlink()
+    inventory.remove(zip)
+    assert inventory.count(".zip") == 0
+    assert inventory.size == 9
+
+    # changes made by others are picked up by sync
+    stl.unlink()
+    other_tiff = sub / "other.tiff"
+    other_tiff.write_text("foo")
+    new_sub = tmp_path / "new_sub"
+    new_sub.mkdir()
+    (new_sub / "new.zip").write_text("foo")
+    # ensure modification times differ even on file systems with coarse timestamps
+    for d in (tmp_path, sub):
+        os.utime(d, ns=(0, 0))
+    inventory.sync()
+    assert inventory.count(".stl") == 0
+    assert inventory.count(".tiff") == 2
+    assert inventory.count(".zip") == 1
+    assert inventory.size == 12
+
+    # removed dirs are dropped
+    for f in sub.iterdir():
+        f.unlink()
+    sub.rmdir()
+    inventory.sync()
+    assert inventory.count(".tiff") == 0
+    assert inventory.size == 3
+
+
+def test_run_cleanup_job__with_inventory(tmp_path) -> None:
+    stl = tmp_path / "baa.stl"
+    stl.write_text("foo")
+    tiff = _write_file(tmp_path / "baa.tiff", 3, atime=0)
+    inventory = CacheInventory(tmp_path)
+
+    # the lower tier stl file gets evicted, which already brings the cache below the low-water mark
+    run_cleanup_job(tmp_path, cache_size_budget=5, low_water_mark=0.8, inventory=inventory)
+    assert not stl.is_file()
+    assert tiff.is_file()
+    assert inventory.count(".stl") == 0
+    assert inventory.count(".tiff") == 1
+    assert inventory.size == 3
+
+
+def test_run_cleanup_job__with_grown_files(tmp_path) -> None:
+    tiff = _write_file(tmp_path / "clipped_foo.tiff", 0, atime=0)
+    zip = _write_file(tmp_path / "foo.zip", 0, atime=0)
+    inventory = CacheInventory(tmp_path)
+    assert inventory.size == 0
+
+    # files replaced under the same name are re-stat'ed by sync
+    tmp_file = tmp_path / "foo.123.tmp"
+    tmp_file.write_bytes(b"\0" * 100)
+    os.replace(tmp_file, zip)
+    os.utime(tmp_path, ns=(0, 0))
+    stats = run_cleanup_job(tmp_path, cache_size_budget=50, low_water_mark=0.8, inventory=inventory)
+    assert stats.freed == 100
+    assert not zip.is_file()
+    assert inventory.size == 0
+
+    # files rewritten in place are picked up by a full refresh
+    tiff.write_bytes(b"\0" * 100)
+    inventory.refresh()
+    stats = run_cleanup_job(tmp_path, cache_size_budget=50, low_water_mark=0.8, inventory=inventory)
+    assert stats.freed == 100
+    assert not tiff.is_file()
+    assert inventory.size == 0
+
+
+def test_janitor__refreshes_inventory(tmp_path) -> None:
+    tiff = _write_file(tmp_path / "clipped_foo.tiff", 0, atime=0)
+    inventory = CacheInventory(tmp_path)
+    tiff.write_bytes(b"\0" * 100)
+    janitor = Janitor(
+        inventory=inventory,
+        cache_size_budget=50,
+        low_water_mark=0.8,
+        min_age=0.0,
+        interval=3600.0,
+        check_interval=3600.0,
+    )
+    janitor.start()
+    try:
+        start = time.time()
+        while janitor.stats is None and time.time() - start < 5:
+            time.sleep(0.01)
+        # the scheduled cleanup rescans the inventory and notices the grown file
+        assert janitor.stats.freed == 100
+        assert not tiff.is_file()
+    finally:
+        janitor.stop()
+        janitor.join(timeout=5)
+
+
+def test_janitor(tmp_path) -> None:
+    inventory = CacheInventory(tmp_path)
+    janitor = Janitor(
+        inventory=inventory,
+        cache_size_budget=5,
+        low_water_mark=0.8,
+        min_age=0.0,
+        interval=3600.0,
+        check_interval=3600.0,
+    )
+    janitor.start()
+    try:
+        # initial cleanup runs right after start
+        start = time.time()
+        while janitor.stats is None and time.time() - start < 5:
+            time.sleep(0.01)
+        assert janitor.stats.freed == 0
+        first_run = janitor.stats.timestamp
+
+        # exceeding the budget and notifying triggers a cleanup ahead of schedule
+        zip = tmp_path / "baz.zip"
+        zip.write_text("foobar")
+        cleanups = COMPUTE_STAGE_SECONDS.count(stage="cleanup")
+        janitor.notify()
+        start = time.time()
+        while janitor.stats.timestamp == first_run and time.time() - start < 5:
+            time.sleep(0.01)
+        assert janitor.stats.freed == 6
+        assert not zip.is_file()
+        # housekeeping ahead of a conversion is recorded as its cleanup stage
+        start = time.time()
+        while COMPUTE_STAGE_SECONDS.count(stage="cleanup") == cleanups and time.time() - start < 5:
+            time.sleep(0.01)
+        assert COMPUTE_STAGE_SECONDS.count(stage="cleanup") == cleanups + 1
+    finally:
+        janitor.stop()
+        janitor.join(timeout=5)
+    assert not janitor.is_alive()
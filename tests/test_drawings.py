@@ -0,0 +1,88 @@
+import json
+from hashlib import md5
+
+from mapa_streamlit.caching import get_hash_of_geojson
+from mapa_streamlit.drawings import DrawingIndex, _get_canonical_form
+from tests.helpers import rectangle
+
+
+def test_get_hash_of_geojson() -> None:
+    geometry = rectangle(8.0, 48.0)["geometry"]
+    # needs to match the hash mapa uses for naming its intermediate files
+    assert get_hash_of_geojson(geometry) == md5(json.dumps(geometry, sort_keys=True).encode()).hexdigest()
+
+
+def test__get_canonical_form() -> None:
+    geometry = rectangle(8.0, 48.0)["geometry"]
+    canonical_form = _get_canonical_form(geometry)
+    assert canonical_form == _get_canonical_form(rectangle(8.0, 48.0)["geometry"])
+    assert canonical_form != _get_canonical_form(rectangle(8.0, 48.1)["geometry"])
+    hash(canonical_form)
+    assert _get_canonical_form({**geometry, "foo": "baa"}) is None
+    # integer and float coordinates result in different hashes
+    int_geometry = {**geometry, "coordinates": [[[8, 48], [8, 49], [9, 49], [9, 48], [8, 48]]]}
+    assert canonical_form != _get_canonical_form(int_geometry)
+
+
+def test_drawing_index() -> None:
+    index = DrawingIndex()
+    assert index.update([]) is None
+
+    first, second, third = rectangle(8.0, 48.0), rectangle(9.0, 48.0), rectangle(10.0, 48.0)
+    first_hash = get_hash_of_geojson(first["geometry"])
+    second_hash = get_hash_of_geojson(second["geometry"])
+    third_hash = get_hash_of_geojson(third["geometry"])
+
+    assert index.update([first]) == first_hash
+    assert index.get_geometry(first_hash) == first["geometry"]
+
+    # newly drawn rectangle becomes active
+    assert index.update([first, second]) == second_hash
+    # without new drawings, the active drawing remains
+    assert index.update([first, second]) == second_hash
+    assert index.update([first]) == second_hash
+    assert index.update([first, second, third]) == third_hash
+    assert index.known == {first_hash, second_hash, third_hash}
+    assert index.get_geometry(third_hash) == third["geometry"]
+    assert index.get_geometry("unknown") is None
+
+
+def test_drawing_index__caches_hashes(monkeypatch) -> None:
+    calls = []
+
+    def _counting_hash(geometry: dict) -> str:
+        calls.append(geometry)
+        return get_hash_of_geojson(geometry)
+
+    monkeypatch.setattr("mapa_streamlit.drawings.get_hash_of_geojson", _counting_hash)
+    index = DrawingIndex()
+    drawings = [rectangle(float(lon), 48.0) for lon in range(50)]
+    for i in range(1, len(drawings) + 1):
+        index.update(drawings[:i])
+    # every drawing got hashed exactly once, although it was part of many updates
+    assert len(calls) == len(drawings)
+    assert index.active == get_hash_of_geojson(drawings[-1]["geometry"])
+
+
+def test_drawing_index__distinguishes_value_types() -> None:
+    index = DrawingIndex()
+    geometry = rectangle(8.0, 48.0)["geometry"]
+    int_geometry = {**geometry, "coordinates": [[[8, 48], [8, 49], [9, 49], [9, 48], [8, 48]]]}
+    assert index.get_hash(geometry) == get_hash_of_geojson(geometry)
+    assert index.get_hash(int_geometry) == get_hash_of_geojson(int_geometry)
+    assert index.get_hash(geometry) != index.get_hash(int_geometry)
+
+
+def test_drawing_index__drops_removed_drawings() -> None:
+    index = DrawingIndex()
+    first, second, third = rectangle(8.0, 48.0), rectangle(9.0, 48.0), rectangle(10.0, 48.0)
+    first_hash, second_hash, third_hash = (get_hash_of_geojson(d["geometry"]) for d in (first, second, third))
+    index.update([first, second])
+    assert index.update([first, second, third]) == third_hash
+
+    # the active drawing is retained even when it got removed from the map
+    assert index.update([first]) == third_hash
+    assert index.get_geometry(first_hash) == first["geometry"]
+    assert index.get_geometry(second_hash) is None
+    assert index.get_geometry(third_hash) == third["geometry"]
+    assert set(index._hashes.values()) == {first_hash, third_hash}
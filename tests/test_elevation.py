@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from mapa_streamlit import elevation
+from mapa_streamlit.caching import get_hash_of_geojson
+from mapa_streamlit.elevation import (
+    Elevation,
+    _store_array,
+    _store_metadata,
+    load_elevation,
+    path_to_elevation_array,
+    path_to_elevation_metadata,
+)
+from tests.helpers import get_bbox
+
+
+def test_elevation__get_elevation_scale() -> None:
+    elevation = Elevation(array=np.zeros((2, 2)), top_edge_length=2000.0)
+    assert elevation.get_elevation_scale(200) == 0.1
+
+
+def test__store_array(tmp_path) -> None:
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    path = path_to_elevation_array("foo", tmp_path)
+    _store_array(array, path)
+
+    assert list(tmp_path.iterdir()) == [tmp_path / "elevation_foo.npy"]
+    mapped = np.load(path, mmap_mode="r")
+    assert isinstance(mapped, np.memmap)
+    assert not mapped.flags.writeable
+    np.testing.assert_array_equal(mapped, array)
+
+
+def test_load_elevation__reuses_cached_array(tmp_path, monkeypatch) -> None:
+    def download_dem_tiles(*args, **kwargs) -> None:
+        raise AssertionError("dem tiles must not be downloaded")
+
+    monkeypatch.setattr(elevation, "download_dem_tiles", download_dem_tiles)
+    geometry = get_bbox(8.0, 48.0, 8.1, 48.1)
+    geo_hash = get_hash_of_geojson(geometry)
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    _store_array(array, path_to_elevation_array(geo_hash, tmp_path))
+    _store_metadata(2000.0, path_to_elevation_metadata(geo_hash, tmp_path))
+
+    # the clipped raster was evicted, but the cached array is sufficient
+    result = load_elevation(geometry, tmp_path)
+    assert isinstance(result.array, np.memmap)
+    np.testing.assert_array_equal(result.array, array)
+    assert result.top_edge_length == 2000.0
+
+
+def test_mapa__private_functions_are_available() -> None:
+    # besides its public api, the conversion relies on private functions of mapa, which might change with any release
+    pytest.importorskip("mapa")
+    from mapa import _get_desired_size  # noqa: F401
+    from mapa.raster import _get_coordinate_of_pixel  # noqa: F401
@@ -0,0 +1,52 @@
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# cumulative import time budgets in milliseconds, generous enough to not be flaky on slow CI runners but tight enough
+# to catch heavy dependencies sneaking into the import path again
+IMPORT_TIME_BUDGETS = {
+    "mapa_streamlit": 50,
+    "mapa_streamlit.settings": 50,
+    "mapa_streamlit.caching": 250,
+    "mapa_streamlit.drawings": 250,
+    "mapa_streamlit.verification": 250,
+    "mapa_streamlit.cleaning": 500,
+    "mapa_streamlit.jobs": 500,
+    "app": 3000,
+}
+# modules which are only needed once a conversion actually runs or the map is rendered
+HEAVY_MODULES = ["mapa", "rasterio", "tomli", "folium", "streamlit_folium"]
+
+
+def _get_import_times(module: str) -> Dict[str, int]:
+    """Imports the given module in a fresh interpreter and returns the cumulative import time in µs of all modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        if match:
+            times[match.group(3)] = int(match.group(1))
+    return times
+
+
+@pytest.mark.parametrize("module", IMPORT_TIME_BUDGETS)
+def test_import_time(module: str) -> None:
+    if module == "app":
+        pytest.importorskip("streamlit")
+    times = _get_import_times(module)
+    assert module in times
+    imported_heavy_modules = [m for m in HEAVY_MODULES if m in times]
+    assert imported_heavy_modules == [], f"importing {module} should not import {imported_heavy_modules}"
+    assert times[module] / 1000 < IMPORT_TIME_BUDGETS[module]
@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import pickle
+import signal
+
+import numpy as np
+import pytest
+
+from mapa_streamlit.isolation import ConversionError, run_isolated
+from mapa_streamlit.profiling import stage
+from mapa_streamlit.progress import ProgressChannel, ProgressReporter
+
+
+def _add(a: int, b: int) -> int:
+    return a + b
+
+
+def _fail() -> None:
+    raise ValueError("conversion failed")
+
+
+def _allocate(size: int) -> int:
+    return int(np.ones(size, dtype=np.uint8).sum())
+
+
+def _add_in_stages(a: int, b: int) -> int:
+    with stage("adding"):
+        return a + b
+
+
+def _get_niceness() -> int:
+    return os.nice(0)
+
+
+def _report_progress(progress_bar: ProgressReporter) -> None:
+    progress_bar.progress(50)
+
+
+def _crash() -> None:
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_run_isolated() -> None:
+    result, peak_memory, timings = run_isolated(_add, {"a": 1, "b": 2})
+    assert result == 3
+    assert peak_memory > 0
+    assert timings == {}
+
+
+def test_run_isolated__collects_timings() -> None:
+    result, _, timings = run_isolated(_add_in_stages, {"a": 1, "b": 2})
+    assert result == 3
+    assert set(timings) == {"adding"}
+    assert timings["adding"] >= 0.0
+
+
+def test_run_isolated__failing_function() -> None:
+    with pytest.raises(ConversionError, match="conversion failed") as e:
+        run_isolated(_fail, {})
+    assert e.value.peak_memory > 0
+
+
+def test_run_isolated__exceeding_memory_limit() -> None:
+    with pytest.raises(ConversionError, match="exceeded its memory limit of 2048 MB"):
+        run_isolated(_allocate, {"size": 3 * 1024**3}, memory_limit=2 * 1024**3)
+    # smaller allocations succeed within the limit
+    assert run_isolated(_allocate, {"size": 64 * 1024**2}, memory_limit=2 * 1024**3)[0] == 64 * 1024**2
+
+
+def test_run_isolated__lowers_priority() -> None:
+    niceness = os.nice(0)
+    assert run_isolated(_get_niceness, {}, niceness=5)[0] == min(niceness + 5, 19)
+    # the calling process is not affected
+    assert os.nice(0) == niceness
+
+
+def test_run_isolated__reports_progress() -> None:
+    channel = ProgressChannel(slots=2, mp_context=multiprocessing.get_context("spawn"))
+    slot = channel.acquire()
+    run_isolated(_report_progress, {"progress_bar": ProgressReporter(slot)}, progress_slots=channel.array)
+    assert channel.get(slot) == 50.0
+
+
+def test_run_isolated__killed_process() -> None:
+    with pytest.raises(ConversionError, match="killed by SIGKILL"):
+        run_isolated(_crash, {})
+
+
+def test_conversion_error__pickle() -> None:
+    error = pickle.loads(pickle.dumps(ConversionError("foo", peak_memory=42)))
+    assert str(error) == "foo"
+    assert error.peak_memory == 42
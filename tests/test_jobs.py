@@ -0,0 +1,274 @@
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from mapa_streamlit.jobs import JobManager, JobState, QueueFullError, convert_bbox_to_stl, load_converter
+from mapa_streamlit.metrics import COMPUTE_STAGE_SECONDS, JOB_PEAK_MEMORY_BYTES, JOBS
+from mapa_streamlit.profiling import stage
+from tests.helpers import fake_convert_bbox_to_stl, wait_for
+
+
+def _fake_convert_bbox_to_stl_with_progress(output_file: Path, progress_bar, **kwargs) -> Path:
+    progress_bar.progress(50)
+    time.sleep(0.5)
+    return fake_convert_bbox_to_stl(output_file)
+
+
+def _fake_convert_bbox_to_stl_in_stages(output_file: Path, **kwargs) -> Path:
+    with stage("meshing"):
+        time.sleep(0.1)
+    with stage("zipping"):
+        return fake_convert_bbox_to_stl(output_file)
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(max_workers=2, converter=fake_convert_bbox_to_stl)
+    yield manager
+    manager.shutdown()
+
+
+def test_job_manager__successful_job(manager, tmp_path) -> None:
+    finished_jobs = JOBS.get(state=JobState.DONE)
+    conversions = COMPUTE_STAGE_SECONDS.count(stage="conversion")
+    peaks = JOB_PEAK_MEMORY_BYTES.count(tiles="1x1")
+    job_id = manager.submit(output_file=tmp_path / "foo")
+    assert manager.get(job_id).state in (JobState.QUEUED, JobState.RUNNING)
+
+    job = wait_for(manager, job_id)
+    assert job.state == JobState.DONE
+    assert job.result == tmp_path / "foo.zip"
+    assert job.result.is_file()
+    assert job.error is None
+    assert job.duration >= 0.0
+    assert job.peak_memory > 0
+    assert manager.running == 0
+    assert JOBS.get(state=JobState.DONE) == finished_jobs + 1
+    assert COMPUTE_STAGE_SECONDS.count(stage="conversion") == conversions + 1
+    assert JOB_PEAK_MEMORY_BYTES.count(tiles="1x1") == peaks + 1
+
+
+def test_job_manager__records_stages_of_conversions(tmp_path) -> None:
+    meshing = COMPUTE_STAGE_SECONDS.count(stage="meshing")
+    zipping = COMPUTE_STAGE_SECONDS.count(stage="zipping")
+    manager = JobManager(max_workers=1, converter=_fake_convert_bbox_to_stl_in_stages)
+    try:
+        job = wait_for(manager, manager.submit(output_file=tmp_path / "foo"))
+    finally:
+        manager.shutdown()
+    assert job.state == JobState.DONE
+    assert set(job.timings) == {"meshing", "zipping"}
+    assert job.timings["meshing"] >= 0.1
+    assert COMPUTE_STAGE_SECONDS.count(stage="meshing") == meshing + 1
+    assert COMPUTE_STAGE_SECONDS.count(stage="zipping") == zipping + 1
+
+
+def test_job_manager__failing_job(manager, tmp_path) -> None:
+    job_id = manager.submit(output_file=tmp_path / "foo", fail=True)
+    job = wait_for(manager, job_id)
+    assert job.state == JobState.FAILED
+    assert job.error == "conversion failed"
+    assert job.result is None
+    # neither the final nor the partially written archive are left behind
+    assert [f for f in tmp_path.iterdir() if f.is_file()] == []
+
+
+def test_job_manager__queues_jobs_exceeding_max_workers(manager, tmp_path) -> None:
+    job_ids = [manager.submit(output_file=tmp_path / f"foo_{i}", duration=0.5) for i in range(3)]
+    # only two workers are available, the third job needs to wait
+    assert manager.running == 2
+    assert manager.queue_depth == 1
+    assert manager.get(job_ids[2]).state == JobState.QUEUED
+
+    jobs = [wait_for(manager, job_id) for job_id in job_ids]
+    assert all(job.state == JobState.DONE for job in jobs)
+    assert manager.queue_depth == 0
+
+
+def test_job_manager__unknown_job(manager) -> None:
+    assert manager.get("unknown") is None
+    assert manager.get(None) is None
+
+
+def test_job_manager__publishes_result_atomically(manager, tmp_path) -> None:
+    job_id = manager.submit(output_file=tmp_path / "foo", duration=0.5)
+    time.sleep(0.3)
+    # while the job is still running, the result is not yet visible under its final name
+    assert manager.get(job_id).state == JobState.RUNNING
+    assert not (tmp_path / "foo.zip").is_file()
+
+    job = wait_for(manager, job_id)
+    assert job.state == JobState.DONE
+    assert [f.name for f in tmp_path.iterdir() if f.is_file()] == ["foo.zip"]
+    assert job.result.read_text() == "foo"
+
+
+def test_job_manager__coalesces_jobs_with_same_key(manager, tmp_path) -> None:
+    job_id = manager.submit(key="foo", output_file=tmp_path / "foo", duration=0.5)
+    assert manager.submit(key="foo", output_file=tmp_path / "foo", duration=0.5) == job_id
+    other_job_id = manager.submit(key="baa", output_file=tmp_path / "baa")
+    assert other_job_id != job_id
+    assert manager.running == 2
+
+    assert wait_for(manager, job_id).state == JobState.DONE
+    assert wait_for(manager, other_job_id).state == JobState.DONE
+
+    # once the job finished, a new job is created for the same key
+    assert manager.submit(key="foo", output_file=tmp_path / "foo") != job_id
+
+
+def test_job_manager__expires_finished_jobs(tmp_path) -> None:
+    manager = JobManager(max_workers=1, converter=fake_convert_bbox_to_stl, job_ttl=0.5)
+    try:
+        done_job_id = manager.submit(output_file=tmp_path / "foo")
+        failed_job_id = manager.submit(output_file=tmp_path / "baa", fail=True)
+        assert wait_for(manager, done_job_id).state == JobState.DONE
+        assert wait_for(manager, failed_job_id).state == JobState.FAILED
+
+        # terminal jobs are dropped once their ttl elapsed and another job gets submitted or finishes
+        time.sleep(0.5)
+        job_id = manager.submit(output_file=tmp_path / "baz", duration=0.5)
+        assert manager.get(done_job_id) is None
+        assert manager.get(failed_job_id) is None
+        assert wait_for(manager, job_id).state == JobState.DONE
+        assert list(manager._jobs) == [job_id]
+    finally:
+        manager.shutdown()
+
+
+def test_job_manager__rejects_jobs_exceeding_max_queue_depth(tmp_path) -> None:
+    manager = JobManager(max_workers=1, converter=fake_convert_bbox_to_stl, max_queue_depth=1)
+    try:
+        running_job_id = manager.submit(output_file=tmp_path / "foo_0", duration=0.5)
+        queued_job_id = manager.submit(key="foo", output_file=tmp_path / "foo_1")
+        with pytest.raises(QueueFullError):
+            manager.submit(output_file=tmp_path / "foo_2")
+        # attaching to an in-flight job is still possible
+        assert manager.submit(key="foo", output_file=tmp_path / "foo_1") == queued_job_id
+
+        assert wait_for(manager, running_job_id).state == JobState.DONE
+        assert wait_for(manager, queued_job_id).state == JobState.DONE
+    finally:
+        manager.shutdown()
+
+
+def test_job_manager__admits_jobs_based_on_available_memory(tmp_path) -> None:
+    manager = JobManager(
+        max_workers=3,
+        converter=fake_convert_bbox_to_stl,
+        memory_headroom=100,
+        available_memory=lambda: 1000,
+    )
+    try:
+        job_ids = [manager.submit(output_file=tmp_path / f"foo_{i}", memory=500, duration=0.5) for i in range(3)]
+        # the second job would leave less than the headroom, a single job is however always admitted
+        assert manager.running == 1
+        assert manager.position(job_ids[0]) is None
+        assert manager.position(job_ids[1]) == 1
+        assert manager.position(job_ids[2]) == 2
+        assert manager.expected_wait(job_ids[1]) is None
+
+        assert wait_for(manager, job_ids[0]).state == JobState.DONE
+        # once a job finished, its duration is used for predicting the wait of queued jobs
+        assert manager.running == 1
+        assert manager.expected_wait(job_ids[2]) >= 0.5
+        assert all(wait_for(manager, job_id).state == JobState.DONE for job_id in job_ids)
+    finally:
+        manager.shutdown()
+
+
+def _fake_convert_bbox_to_stl_allocating(output_file: Path, size: int, **kwargs) -> Path:
+    # reserves address space without touching the memory
+    np.empty(size, dtype=np.uint8)
+    return fake_convert_bbox_to_stl(output_file)
+
+
+def test_job_manager__limits_memory_of_conversions(tmp_path) -> None:
+    manager = JobManager(
+        max_workers=1,
+        converter=_fake_convert_bbox_to_stl_allocating,
+        memory_limit_base=1024**3,
+        memory_limit_factor=2.0,
+    )
+    try:
+        # the limit grows with the estimated memory of the job
+        job_id = manager.submit(output_file=tmp_path / "foo", size=4 * 1024**3, memory=1024**3)
+        job = wait_for(manager, job_id)
+        assert job.state == JobState.FAILED
+        assert job.error == "conversion exceeded its memory limit of 3072 MB"
+        assert job.peak_memory > 0
+        assert not list(tmp_path.glob("*.zip"))
+
+        # a failing conversion does not affect the worker pool
+        job_id = manager.submit(output_file=tmp_path / "foo", size=4 * 1024**3, memory=3 * 1024**3)
+        job = wait_for(manager, job_id)
+        assert job.state == JobState.DONE
+        assert job.peak_memory > 0
+    finally:
+        manager.shutdown()
+
+
+def test_job_manager__runs_background_jobs_at_low_priority(manager, tmp_path) -> None:
+    background_job_ids = [
+        manager.submit(key=f"bg_{i}", background=True, output_file=tmp_path / f"bg_{i}", duration=0.5) for i in range(3)
+    ]
+    # background jobs run one at a time and do not occupy the workers of interactive jobs
+    assert manager.get(background_job_ids[0]).state == JobState.RUNNING
+    assert manager.get(background_job_ids[1]).state == JobState.QUEUED
+    assert manager.running == 0
+    job_ids = [manager.submit(output_file=tmp_path / f"foo_{i}", duration=0.5) for i in range(3)]
+    assert manager.running == 2
+
+    # submitting an interactive job with the key of a queued background job promotes it
+    assert manager.submit(key="bg_2", output_file=tmp_path / "bg_2") == background_job_ids[2]
+    assert manager.get(background_job_ids[2]).background is False
+    assert manager.position(background_job_ids[2]) == 2
+
+    assert all(wait_for(manager, job_id).state == JobState.DONE for job_id in job_ids + background_job_ids)
+    # the remaining background job only started once no interactive job was waiting anymore
+    assert manager.get(background_job_ids[1]).started_at >= manager.get(background_job_ids[2]).started_at
+
+
+def test_job_manager__reports_progress_of_worker_processes(tmp_path) -> None:
+    manager = JobManager(max_workers=1, converter=_fake_convert_bbox_to_stl_with_progress)
+    try:
+        job_id = manager.submit(output_file=tmp_path / "foo")
+        other_job_id = manager.submit(output_file=tmp_path / "baa")
+        assert manager.progress(other_job_id) == 0.0
+        start = time.time()
+        while manager.progress(job_id) != 50.0:
+            assert time.time() - start < 30.0
+            time.sleep(0.05)
+        assert wait_for(manager, job_id).state == JobState.DONE
+        assert manager.progress(job_id) == 100.0
+        # the slot of the finished job is reused by the next job, which starts from zero
+        assert wait_for(manager, other_job_id).state == JobState.DONE
+        assert manager.progress("unknown") is None
+    finally:
+        manager.shutdown()
+
+
+def test_load_converter() -> None:
+    assert load_converter(None) is convert_bbox_to_stl
+    assert load_converter("") is convert_bbox_to_stl
+    assert load_converter("tests.helpers:fake_convert_bbox_to_stl") is fake_convert_bbox_to_stl
+
+
+def test_job_manager__profiles_jobs(tmp_path) -> None:
+    manager = JobManager(max_workers=1, converter=fake_convert_bbox_to_stl)
+    try:
+        profiled = manager.submit(output_file=tmp_path / "foo", profile=True)
+        assert wait_for(manager, profiled).state == JobState.DONE
+        not_profiled = manager.submit(output_file=tmp_path / "baa")
+        assert wait_for(manager, not_profiled).state == JobState.DONE
+    finally:
+        manager.shutdown()
+    # the profile is stored next to the result, but not taken for the result of the same output
+    assert sorted(f.name for f in tmp_path.iterdir() if f.is_file()) == [
+        "baa.zip",
+        "foo.zip",
+        "profile_foo.json",
+        "profile_foo.prof",
+    ]
@@ -0,0 +1,76 @@
+import pytest
+
+from mapa_streamlit.limits import AdaptiveLimits, Limits, Load, get_approximate_max_area
+
+BASE = Limits(max_dem_tiles=36, max_raster_pixels=1000, max_output_size=2000)
+IDLE = Load(ram_usage=10.0, cpu_usage=5.0, running=0, queue_depth=0, mean_duration=None)
+
+
+def _get_limits(loads: list) -> AdaptiveLimits:
+    return AdaptiveLimits(
+        base=BASE,
+        max_workers=2,
+        target_duration=100.0,
+        floor=0.25,
+        ceiling=2.0,
+        low_pressure=0.5,
+        high_pressure=0.9,
+        hysteresis=0.1,
+        update_interval=0.0,
+        get_load=lambda: loads.pop(0),
+    )
+
+
+def test_adaptive_limits__get_pressure() -> None:
+    limits = _get_limits([])
+    assert limits.get_pressure(IDLE) == 0.1
+    assert limits.get_pressure(IDLE._replace(cpu_usage=70.0)) == 0.7
+    assert limits.get_pressure(IDLE._replace(running=2, queue_depth=1)) == 1.5
+    assert limits.get_pressure(IDLE._replace(mean_duration=50.0)) == 0.5
+
+
+def test_adaptive_limits__get_target_scale() -> None:
+    limits = _get_limits([])
+    assert limits.get_target_scale(0.0) == 2.0
+    assert limits.get_target_scale(0.5) == 2.0
+    assert limits.get_target_scale(0.7) == pytest.approx(1.125)
+    assert limits.get_target_scale(0.9) == 0.25
+    assert limits.get_target_scale(3.0) == 0.25
+
+
+def test_adaptive_limits__update() -> None:
+    loads = [
+        IDLE,
+        IDLE._replace(running=2),
+        # small changes are ignored
+        IDLE._replace(running=2, ram_usage=84.0),
+        IDLE._replace(ram_usage=88.0),
+        # larger changes are applied
+        IDLE._replace(ram_usage=80.0),
+        IDLE._replace(ram_usage=20.0),
+    ]
+    limits = _get_limits(loads)
+    assert limits.scale == 1.0
+    assert limits.update() == 2.0
+    assert limits.limits == Limits(max_dem_tiles=72, max_raster_pixels=2000, max_output_size=4000)
+    assert limits.update() == 0.25
+    assert limits.limits == Limits(max_dem_tiles=9, max_raster_pixels=250, max_output_size=500)
+    assert limits.update() == 0.25
+    assert limits.update() == 0.25
+    assert limits.update() == pytest.approx(0.6875)
+    assert limits.update() == 2.0
+
+
+def test_adaptive_limits__update_interval() -> None:
+    loads = [IDLE, IDLE._replace(running=2)]
+    limits = _get_limits(loads)
+    limits.update_interval = 60.0
+    assert limits.update() == 2.0
+    # the load is not measured again within the update interval
+    assert limits.update() == 2.0
+    assert len(loads) == 1
+
+
+def test_get_approximate_max_area() -> None:
+    # a DEM tile of 1° x 1° at the equator
+    assert get_approximate_max_area(3600**2) == pytest.approx(12364, rel=1e-3)
@@ -0,0 +1,84 @@
+import urllib.request
+
+import pytest
+
+from mapa_streamlit.caching import ResultCache
+from mapa_streamlit.metrics import CACHE_REQUESTS, Metric, Registry, Timer, start_http_server, write_to_file
+
+
+def _get_registry() -> Registry:
+    registry = Registry()
+    counter = registry.counter("foo", "Foo counter.")
+    counter.inc(state="done")
+    counter.inc(2, state="done")
+    counter.inc(state="failed")
+    registry.gauge("baa", "Baa gauge.").set_function(lambda: 3)
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(1.0, 5.0))
+    histogram.observe(0.5, stage="queue")
+    histogram.observe(2.0, stage="queue")
+    return registry
+
+
+def test_registry__renders_prometheus_text_format() -> None:
+    assert _get_registry().render() == (
+        "# HELP foo Foo counter.\n"
+        "# TYPE foo counter\n"
+        'foo_total{state="done"} 3\n'
+        'foo_total{state="failed"} 1\n'
+        "# HELP baa Baa gauge.\n"
+        "# TYPE baa gauge\n"
+        "baa 3\n"
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{stage="queue",le="1.0"} 1\n'
+        'latency_seconds_bucket{stage="queue",le="5.0"} 2\n'
+        'latency_seconds_bucket{stage="queue",le="+Inf"} 2\n'
+        'latency_seconds_sum{stage="queue"} 2.5\n'
+        'latency_seconds_count{stage="queue"} 2\n'
+    )
+
+
+def test_metric__is_abstract() -> None:
+    class _Untyped(Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        _Untyped("foo", "Foo.")
+
+
+def test_timer() -> None:
+    histogram = Registry().histogram("foo_seconds", "Foo.")
+    with Timer(histogram, stage="validation"):
+        pass
+    assert histogram.count(stage="validation") == 1
+    assert histogram.count(stage="conversion") == 0
+
+
+def test_start_http_server() -> None:
+    registry = _get_registry()
+    server = start_http_server(port=0, registry=registry)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert response.read().decode() == registry.render()
+    finally:
+        server.shutdown()
+
+
+def test_write_to_file(tmp_path) -> None:
+    registry = _get_registry()
+    write_to_file(tmp_path / "mapa.prom", registry)
+    assert (tmp_path / "mapa.prom").read_text() == registry.render()
+    assert [f.name for f in tmp_path.iterdir()] == ["mapa.prom"]
+
+
+def test_cache_requests_are_counted(tmp_path) -> None:
+    hits, misses = CACHE_REQUESTS.get(result="hit"), CACHE_REQUESTS.get(result="miss")
+    cache = ResultCache(tmp_path)
+    assert cache.lookup("foo", record_hit=True) is None
+    (tmp_path / "foo.zip").write_text("foo")
+    assert cache.lookup("foo", record_hit=True) is not None
+    # plain lookups, e.g. for rendering the download button, are not counted
+    assert cache.lookup("foo") is not None
+    assert CACHE_REQUESTS.get(result="hit") == hits + 1
+    assert CACHE_REQUESTS.get(result="miss") == misses + 1
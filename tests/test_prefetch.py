@@ -0,0 +1,28 @@
+from mapa_streamlit import prefetch as prefetch_module
+from mapa_streamlit.batch import Region
+from mapa_streamlit.prefetch import prefetch
+from tests.helpers import PARAMS, get_bbox
+
+
+def test_prefetch(tmp_path, monkeypatch) -> None:
+    downloads = []
+
+    def _download_dem_tiles(bbox_geometry: dict, cache_dir) -> None:
+        downloads.append(bbox_geometry)
+        if bbox_geometry == regions[1].geometry:
+            raise OSError("connection reset")
+
+    monkeypatch.setattr(prefetch_module, "download_dem_tiles", _download_dem_tiles)
+    regions = [
+        Region(name="foo", geometry=get_bbox(8.0, 48.0, 8.1, 48.1), params=PARAMS),
+        Region(name="failing", geometry=get_bbox(9.0, 48.0, 9.1, 48.1), params=PARAMS),
+        Region(name="too_large", geometry=get_bbox(0.0, 0.0, 20.0, 20.0), params=PARAMS),
+        Region(name="out_of_bounds", geometry=get_bbox(190.0, 48.0, 190.1, 48.1), params=PARAMS),
+        Region(name="baa", geometry=get_bbox(10.0, 48.0, 10.1, 48.1), params={}),
+    ]
+
+    # failing downloads do not stop prefetching the remaining regions
+    assert prefetch(regions, tmp_path) == 2
+    assert downloads == [regions[0].geometry, regions[1].geometry, regions[4].geometry]
+    # nothing but the DEM tiles is fetched, no conversions are run
+    assert list(tmp_path.iterdir()) == []
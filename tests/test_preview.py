@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from mapa_streamlit.preview import _get_top_edge_length, create_preview, hillshade, load_heightmap, read_heightmap
+from tests.helpers import PARAMS, get_bbox
+
+GEOMETRY = get_bbox(8.0, 48.0, 8.2, 48.1)
+
+
+def _get_heightmap(rows: int = 50, cols: int = 100) -> np.ndarray:
+    # a single hill of 1000m on top of 200m
+    y, x = np.mgrid[0:rows, 0:cols]
+    return 200 + 1000 * np.exp(-((x - cols / 2) ** 2 + (y - rows / 2) ** 2) / 200)
+
+
+def test__get_top_edge_length() -> None:
+    # one degree of longitude at the equator
+    assert _get_top_edge_length((0.0, -1.0, 1.0, 0.0)) == pytest.approx(111_195, rel=1e-3)
+    assert _get_top_edge_length((0.0, 59.0, 1.0, 60.0)) == pytest.approx(111_195 / 2, rel=1e-3)
+
+
+def test_hillshade() -> None:
+    image = hillshade(_get_heightmap(), pixel_size=30.0)
+    assert image.dtype == np.uint8
+    assert image.shape == (50, 100)
+    # flat terrain is lit evenly, slopes facing the light are brighter than those facing away
+    assert hillshade(np.zeros((10, 10)), pixel_size=30.0).std() == 0
+    assert image[25, 40] > image[25, 60]
+
+
+def test_create_preview() -> None:
+    heightmap = _get_heightmap()
+    preview = create_preview(heightmap, GEOMETRY, **PARAMS)
+    assert preview.image.shape == heightmap.shape
+    assert (preview.size_x, preview.size_y) == (100, 200)
+    elevation_scale = 100 / _get_top_edge_length((8.0, 48.0, 8.2, 48.1))
+    assert preview.size_z == round((heightmap.max() - heightmap.min()) * elevation_scale * 2.0 + 2, 1)
+
+    # z-scale only affects the height of the model
+    flat = create_preview(heightmap, GEOMETRY, **{**PARAMS, "z_scale": 1.0})
+    assert (flat.size_x, flat.size_y) == (preview.size_x, preview.size_y)
+    assert flat.size_z < preview.size_z
+
+    squared = create_preview(heightmap, GEOMETRY, **{**PARAMS, "ensure_squared": True})
+    assert squared.image.shape == (50, 50)
+    assert (squared.size_x, squared.size_y) == (100, 100)
+
+    # tile borders are drawn into the image
+    tiled = create_preview(heightmap, GEOMETRY, **{**PARAMS, "split_area_in_tiles": "2x2"})
+    assert (tiled.image[25, :] == 0).all()
+    assert (tiled.image[:, 50] == 0).all()
+
+
+def test_read_heightmap(tmp_path) -> None:
+    rasterio = pytest.importorskip("rasterio")
+    from rasterio.transform import from_origin
+
+    # raster of 0.5° x 0.5° with a resolution of 1 arcsecond, like the DEM used by mapa
+    tiff = tmp_path / "clipped_foo.tiff"
+    size = 1800
+    data = np.tile(np.arange(size, dtype=np.float32), (size, 1))
+    with rasterio.open(
+        tiff,
+        "w",
+        driver="GTiff",
+        height=size,
+        width=size,
+        count=1,
+        dtype="float32",
+        crs="EPSG:4326",
+        transform=from_origin(8.0, 48.5, 1 / 3600, 1 / 3600),
+    ) as dataset:
+        dataset.write(data, 1)
+
+    heightmap = read_heightmap([str(tiff)], (8.0, 48.0, 8.5, 48.25), max_size=100)
+    assert heightmap.shape == (50, 100)
+    # west to east increasing elevation is preserved
+    assert (np.diff(heightmap[0]) > 0).all()
+
+    # cached clipped rasters are picked up without searching the STAC API, once they are completely written
+    np.save(tmp_path / "elevation_foo.npy", data)
+    assert load_heightmap(GEOMETRY, "foo", tmp_path, max_size=100).shape == (50, 100)
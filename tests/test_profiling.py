@@ -0,0 +1,81 @@
+import json
+import pstats
+import time
+
+import numpy as np
+import pytest
+
+from mapa_streamlit import profiling
+from mapa_streamlit.profiling import path_to_profile, run_profiled, stage
+from mapa_streamlit.tiling import convert_tiles_in_parallel
+from tests.helpers import fake_convert_tile
+
+
+def _convert(duration: float, fail: bool = False) -> str:
+    with stage("fetching"):
+        time.sleep(duration)
+    for _ in range(2):
+        with stage("meshing"):
+            time.sleep(duration)
+    if fail:
+        raise ValueError("conversion failed")
+    return "foo"
+
+
+def test_path_to_profile(tmp_path) -> None:
+    assert path_to_profile(tmp_path / "foo") == tmp_path / "profile_foo.prof"
+
+
+def test_stage__not_profiled() -> None:
+    with stage("fetching"):
+        pass
+    assert profiling._timings is None
+
+
+def test_collect_timings() -> None:
+    with profiling.collect_timings() as timings:
+        with stage("fetching"):
+            pass
+        # nested contexts collect into the same timings
+        with profiling.collect_timings() as nested_timings:
+            with stage("meshing"):
+                pass
+        assert nested_timings is timings
+    assert set(timings) == {"fetching", "meshing"}
+    assert profiling._timings is None
+
+
+def test_run_profiled(tmp_path) -> None:
+    assert run_profiled(_convert, tmp_path / "profile_foo.prof", duration=0.1) == "foo"
+
+    timings = json.loads((tmp_path / "profile_foo.json").read_text())
+    assert not timings["failed"]
+    assert set(timings["stages"]) == {"fetching", "meshing"}
+    assert timings["stages"]["fetching"] == pytest.approx(0.1, abs=0.05)
+    # stages entered several times are summed up
+    assert timings["stages"]["meshing"] == pytest.approx(0.2, abs=0.05)
+    assert timings["total"] >= timings["stages"]["fetching"] + timings["stages"]["meshing"]
+    assert any(function == "_convert" for _, _, function in pstats.Stats(str(tmp_path / "profile_foo.prof")).stats)
+    assert profiling._timings is None
+
+
+def test_run_profiled__failing_function(tmp_path) -> None:
+    with pytest.raises(ValueError, match="conversion failed"):
+        run_profiled(_convert, tmp_path / "profile_foo.prof", duration=0.0, fail=True)
+    # the profile of failing conversions is kept as well
+    assert (tmp_path / "profile_foo.prof").is_file()
+    assert json.loads((tmp_path / "profile_foo.json").read_text())["failed"]
+    assert profiling._timings is None
+
+
+def test_run_profiled__tiles(tmp_path) -> None:
+    tiles = [np.full((3, 4), i, dtype=np.float64) for i in range(4)]
+    run_profiled(
+        convert_tiles_in_parallel,
+        tmp_path / "profile_foo.prof",
+        tiles=tiles,
+        convert_tile=fake_convert_tile,
+        output_file=tmp_path / "foo",
+        max_workers=2,
+    )
+    assert set(json.loads((tmp_path / "profile_foo.json").read_text())["stages"]) == {"meshing", "zipping"}
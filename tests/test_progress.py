@@ -0,0 +1,31 @@
+import multiprocessing
+
+from mapa_streamlit import progress
+from mapa_streamlit.progress import ProgressChannel, ProgressReporter, attach
+
+
+def test_progress_channel() -> None:
+    channel = ProgressChannel(slots=2, mp_context=multiprocessing.get_context("spawn"))
+    first, second = channel.acquire(), channel.acquire()
+    assert (first, second) == (0, 1)
+    assert channel.acquire() is None
+
+    attach(channel.array)
+    try:
+        ProgressReporter(first).progress(10)
+        ProgressReporter(first).progress(42)
+        # only the latest value is visible
+        assert channel.get(first) == 42.0
+        assert channel.get(second) == 0.0
+
+        # released slots are reset once they are acquired again
+        channel.release(first)
+        assert channel.acquire() == first
+        assert channel.get(first) == 0.0
+    finally:
+        progress._slots = None
+
+
+def test_progress_reporter__without_channel() -> None:
+    # reporting progress outside of a worker process is a no-op
+    ProgressReporter(0).progress(50)
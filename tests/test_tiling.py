@@ -0,0 +1,52 @@
+import zipfile
+
+import numpy as np
+import pytest
+
+from mapa_streamlit.tiling import PREPARATION_PROGRESS, convert_tiles_in_parallel
+from tests.helpers import fake_convert_tile
+
+
+class _ProgressBar:
+    def __init__(self) -> None:
+        self.values = []
+
+    def progress(self, value: int) -> None:
+        self.values.append(value)
+
+
+def test_convert_tiles_in_parallel(tmp_path) -> None:
+    tiles = [np.full((3, 4), i, dtype=np.float64) for i in range(4)]
+    progress_bar = _ProgressBar()
+    archive = convert_tiles_in_parallel(
+        tiles, fake_convert_tile, tmp_path / "foo", max_workers=2, progress_bar=progress_bar
+    )
+
+    assert archive == tmp_path / "foo.zip"
+    with zipfile.ZipFile(archive) as zip_file:
+        assert sorted(zip_file.namelist()) == [f"foo_{i + 1}.stl" for i in range(4)]
+        for i, tile in enumerate(tiles):
+            assert zip_file.read(f"foo_{i + 1}.stl") == tile.tobytes()
+    # the STL files are removed once they are added to the archive
+    assert list(tmp_path.iterdir()) == [archive]
+    # progress is reported for each finished tile, whatever order they finish in
+    assert len(progress_bar.values) == 4
+    assert progress_bar.values == sorted(progress_bar.values)
+    assert PREPARATION_PROGRESS < progress_bar.values[0] and progress_bar.values[-1] == 100
+
+
+def test_convert_tiles_in_parallel__failing_tile(tmp_path) -> None:
+    tiles = [np.full((3, 4), i, dtype=np.float64) for i in range(4)]
+    with pytest.raises(ValueError, match="conversion failed"):
+        convert_tiles_in_parallel(tiles, fake_convert_tile, tmp_path / "foo", max_workers=2, fail_on=2)
+    # neither a partial archive nor any STL files are left behind
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_convert_tiles_in_parallel__single_tile(tmp_path, max_workers) -> None:
+    # a single tile is named like the archive, the same way as mapa does
+    archive = convert_tiles_in_parallel([np.ones((3, 4))], fake_convert_tile, tmp_path / "foo", max_workers)
+    with zipfile.ZipFile(archive) as zip_file:
+        assert zip_file.namelist() == ["foo.stl"]
+    assert list(tmp_path.iterdir()) == [archive]
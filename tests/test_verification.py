@@ -1,29 +1,61 @@
-from mapa_streamlit.verification import _get_area, selected_bbox_in_boundary, selected_bbox_too_large
+import pytest
 
+from mapa_streamlit.verification import (
+    CostEstimate,
+    estimate_cost,
+    selected_bbox_in_boundary,
+    selected_bbox_too_expensive,
+)
+from tests.helpers import get_bbox
 
-def test_selected_bbox_too_large() -> None:
-    geometry = {
-        "type": "Polygon",
-        "coordinates": [
-            [
-                [6.767578, 43.644026],
-                [6.767578, 47.754098],
-                [19.248047, 47.754098],
-                [19.248047, 43.644026],
-                [6.767578, 43.644026],
-            ]
-        ],
-    }
-    area = _get_area(geometry["coordinates"][0])
-    assert area == 51.3
-    assert selected_bbox_too_large(geometry=geometry, threshold=50) is True
-    assert selected_bbox_too_large(geometry=geometry, threshold=60) is False
+
+def test_estimate_cost() -> None:
+    # roughly 2 x 1 km in the black forest, within a single DEM tile and below the mesh resolution
+    cost = estimate_cost(get_bbox(8.076906, 48.098505, 8.107111, 48.115011))
+    assert cost.area == pytest.approx(4.1, abs=0.1)
+    assert cost.dem_tiles == 1
+    assert cost.raster_pixels == 109 * 59
+    assert cost.triangles == 4 * 59 * 109 + 6 * (59 + 109) - 2
+    assert cost.output_size == 84 + 50 * cost.triangles
+    assert cost.memory == 12 * cost.raster_pixels + 200 * cost.triangles
+
+    # same area in degrees spanning four DEM tiles
+    assert estimate_cost(get_bbox(7.99, 47.99, 8.02, 48.01)).dem_tiles == 4
+
+    # model size does not change the number of triangles, squaring the area reduces the number of pixels
+    geometry = get_bbox(8.0, 48.0, 8.5, 48.2)
+    assert estimate_cost(geometry, model_size=200) == estimate_cost(geometry, model_size=100)
+    assert estimate_cost(geometry, ensure_squared=True).raster_pixels == 720 * 720
+    # each tile is reduced to about the mesh resolution, so tiling increases the number of triangles
+    tiled = estimate_cost(geometry, split_area_in_tiles="2x2")
+    assert tiled.triangles > estimate_cost(geometry).triangles
+    # but tiles converted one after another do not increase the peak memory, while parallel ones do
+    assert tiled.memory == estimate_cost(geometry).memory
+    parallel = estimate_cost(geometry, split_area_in_tiles="2x2", parallel_tiles=2)
+    assert tiled.memory < parallel.memory < estimate_cost(geometry, split_area_in_tiles="2x2", parallel_tiles=4).memory
+
+
+def test_estimate_cost__depends_on_latitude() -> None:
+    equator = estimate_cost(get_bbox(10.0, 0.0, 15.0, 5.0))
+    polar = estimate_cost(get_bbox(10.0, 70.0, 15.0, 75.0))
+    # same extent in degrees, but much smaller area on the ground and coarser pixels in longitudinal direction
+    assert equator.dem_tiles == polar.dem_tiles == 25
+    assert polar.area < equator.area / 3
+    assert polar.raster_pixels == pytest.approx(equator.raster_pixels / 3, rel=0.01)
 
 
-def test__get_area() -> None:
-    bbox = [[1, 1], [1, 3], [3, 1], [3, 3]]
-    area = _get_area(bbox=bbox)
-    assert area == 5.66
+def test_selected_bbox_too_expensive() -> None:
+    cost = CostEstimate(area=1.0, dem_tiles=4, raster_pixels=1000, triangles=10, output_size=584, memory=14000)
+    assert selected_bbox_too_expensive(cost, max_dem_tiles=4, max_raster_pixels=1000, max_output_size=584) is None
+    assert selected_bbox_too_expensive(cost, max_dem_tiles=3, max_raster_pixels=1000, max_output_size=584) == (
+        "dem_tiles"
+    )
+    assert selected_bbox_too_expensive(cost, max_dem_tiles=4, max_raster_pixels=999, max_output_size=584) == (
+        "raster_pixels"
+    )
+    assert selected_bbox_too_expensive(cost, max_dem_tiles=4, max_raster_pixels=1000, max_output_size=583) == (
+        "output_size"
+    )
 
 
 def test_selected_bbox_in_boundary() -> None: